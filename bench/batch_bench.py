@@ -0,0 +1,96 @@
+"""对比逐个提交与流水线批量提交的创建耗时
+
+在临时netns中创建N个桥接和N个VXLAN接口（加入对应桥接），两种路径交替各跑
+--repeat次，报告耗时和CPU时间的中位数：
+
+    python bench/batch_bench.py --count 1000 --repeat 5
+"""
+
+import os
+import sys
+import time
+import argparse
+import statistics
+from pyroute2 import IPRoute, netns
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common.ifindex_cache import IfIndexCache
+from common.log import log
+from common.rollback_manager import RollbackManager
+from common.batch import NetlinkBatch
+from common.setup import create_bridge, create_vxlan_interface
+
+
+def run_sequential(ipr: IPRoute, count: int) -> float:
+    rollback = RollbackManager()
+    start = time.perf_counter()
+    for vni in range(1, count + 1):
+        create_bridge(ipr, rollback, f"br-vsi{vni}")
+    for vni in range(1, count + 1):
+        create_vxlan_interface(
+            ipr, rollback, vni, "192.0.2.1", master=f"br-vsi{vni}"
+        )
+    return time.perf_counter() - start
+
+
+def run_batched(ipr: IPRoute, count: int, window: int) -> float:
+    rollback = RollbackManager()
+    start = time.perf_counter()
+    batch = NetlinkBatch(window)
+    for vni in range(1, count + 1):
+        create_bridge(ipr, rollback, f"br-vsi{vni}", batch=batch)
+    failed = batch.run(ipr)
+    batch = NetlinkBatch(window)
+    for vni in range(1, count + 1):
+        create_vxlan_interface(
+            ipr, rollback, vni, "192.0.2.1", master=f"br-vsi{vni}", batch=batch
+        )
+    failed += batch.run(ipr)
+    elapsed = time.perf_counter() - start
+    if failed:
+        print(f"{len(failed)} batched requests failed, e.g. {failed[0].label}: "
+              f"{failed[0].error}")
+    return elapsed
+
+
+def bench(mode: str, count: int, window: int) -> float:
+    nsname = f"vxbench-{os.getpid()}"
+    netns.create(nsname)
+    try:
+        with IfIndexCache(IPRoute(netns=nsname, nlm_echo=True)) as ipr:
+            ipr.seed()
+            if mode == "sequential":
+                return run_sequential(ipr, count)
+            return run_batched(ipr, count, window)
+    finally:
+        netns.remove(nsname)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--count", type=int, default=500)
+    parser.add_argument("--window", type=int, default=256)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    # 关闭每个操作的打印，避免输出耗时干扰结果
+    sys.stdout = open(os.devnull, "w")
+    results = {"sequential": [], "batched": []}
+    for _ in range(args.repeat):
+        for mode, runs in results.items():
+            cpu = time.process_time()
+            seconds = bench(mode, args.count, args.window)
+            runs.append((seconds, time.process_time() - cpu))
+    log.flush()
+    sys.stdout = sys.__stdout__
+
+    ops = args.count * 2
+    median = {
+        mode: tuple(statistics.median(r[i] for r in runs) for i in (0, 1))
+        for (mode, runs) in results.items()
+    }
+    for mode, (seconds, cpu) in median.items():
+        rate = ops / seconds
+        print(f"{mode + ':':12}{seconds:.3f}s ({rate:.0f} ops/s, {cpu:.2f}s CPU)")
+    print(f"speedup:    {median['sequential'][0] / median['batched'][0]:.2f}x")
@@ -0,0 +1,129 @@
+"""不需要root的规划与执行基准
+
+与scale_bench.py使用相同的合成配置，但netlink后端是common.fake_iproute中的
+内存模拟：不创建netns，不需要CAP_NET_ADMIN，可以在CI和开发机上分析配置
+校验、计划构建、执行器和回滚本身的开销。每个规模（VLAN数:VRF数）和引擎
+依次测量：
+
+    full_apply   空的模拟内核上完整应用
+    rollback     用RollbackManager.rollback回滚，之后只剩lo和物理接口
+
+--latency给出每个请求的模拟往返延迟（秒），用于比较逐个等待、流水线批次
+和async并发在延迟下的表现：
+
+    python bench/fake_bench.py --scales 100:10,4094:500 --latency 0.0001
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import resource
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench.scale_bench import OVERLAY, UNDERLAY, UNDERLAY_IP, _scale, make_conf
+from common.fake_iproute import FakeAsyncIPRoute, FakeIPRoute, FakeKernel
+from common.log import log
+from common.rollback_manager import RollbackManager
+from distribute.sdr import sdr, sdr_async
+
+
+def make_kernel() -> FakeKernel:
+    """带有已启用的underlay/overlay接口和underlay地址的模拟内核"""
+    kernel = FakeKernel()
+    with FakeIPRoute(kernel) as ipr:
+        for ifname in (UNDERLAY, OVERLAY):
+            ipr.link("add", ifname=ifname, kind="dummy", state="up")
+        ipr.addr(
+            "add",
+            index=ipr.link_lookup(ifname=UNDERLAY)[0],
+            address=UNDERLAY_IP,
+            mask=24,
+        )
+    return kernel
+
+
+def run_scale(vlans: int, vrfs: int, engine: str, latency: float) -> dict:
+    kernel = make_kernel()
+    baseline = set(kernel.names)
+    conf = make_conf(vlans, vrfs)
+    rollback = RollbackManager()
+    phases = {}
+
+    def measure(name: str, fn):
+        kernel.requests = 0
+        start = time.perf_counter()
+        status = fn()
+        seconds = time.perf_counter() - start
+        operations = len(rollback.log)
+        phases[name] = {
+            "status": status,
+            "seconds": round(seconds, 4),
+            "operations": operations,
+            "ops_per_sec": round(operations / seconds, 1) if seconds else None,
+            "netlink_requests": kernel.requests,
+            "links": len(kernel.links),
+            "peak_rss_kib": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        }
+
+    def apply():
+        if engine == "async":
+            ipr = FakeAsyncIPRoute(kernel, latency, nlm_echo=True)
+            ok = asyncio.run(
+                sdr_async.configure_vxlan_bgp_evpn_distribute_sdr(
+                    conf, rollback, ipr=ipr
+                )
+            )
+            ipr.close()
+        else:
+            with FakeIPRoute(kernel, latency, nlm_echo=True) as ipr:
+                ok = sdr.configure_vxlan_bgp_evpn_distribute_sdr(
+                    conf, rollback, ipr=ipr
+                )
+        return "ok" if ok else "failed"
+
+    def roll_back():
+        with FakeIPRoute(kernel, latency) as ipr:
+            rollback.rollback(ipr)
+        # 回滚应删除全部创建的接口
+        return "ok" if set(kernel.names) == baseline else "incomplete"
+
+    measure("full_apply", apply)
+    measure("rollback", roll_back)
+    return {"vlans": vlans, "vrfs": vrfs, "engine": engine, "phases": phases}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--scales",
+        default="10:1,100:10,1000:100,4094:500",
+        help="逗号分隔的VLAN数:VRF数",
+    )
+    parser.add_argument(
+        "--engines", default="batch,async", help="逗号分隔的执行引擎：batch、async"
+    )
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="每个请求的模拟往返延迟（秒）"
+    )
+    parser.add_argument("--output", help="结果JSON写入的文件，默认输出到标准输出")
+    args = parser.parse_args()
+
+    # 只保留警告和错误，每个操作的日志不计入耗时
+    log.configure("warning")
+    report = {"latency": args.latency, "results": []}
+    for vlans, vrfs in (_scale(s) for s in args.scales.split(",")):
+        for engine in args.engines.split(","):
+            print(f"Running {vlans} VLANs / {vrfs} VRFs ({engine})...", file=sys.stderr)
+            report["results"].append(run_scale(vlans, vrfs, engine, args.latency))
+    log.flush()
+
+    data = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(data + "\n")
+    else:
+        print(data)
@@ -0,0 +1,100 @@
+"""对比dict列表与OperationLog记录操作的内存占用和序列化大小
+
+按每个L2VNI的典型操作（桥接、VXLAN、VLAN子接口、两条master关系、一个IP）
+记录N个VNI，不需要root权限，也不访问内核：
+
+    python bench/oplog_bench.py --count 16000
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common.rollback_manager import OperationRecorder, RollbackManager, UnitRollback
+
+
+class LegacyRecorder(OperationRecorder):
+    """改动之前RollbackManager的记录方式：六个集合/字典加每条操作一个dict"""
+
+    def __init__(self):
+        self.created_interfaces = set()
+        self.created_bridges = set()
+        self.created_vrfs = set()
+        self.created_veths = set()
+        self.assigned_ips = {}
+        self.master_relations = {}
+        self.operations = {
+            "interfaces": [],
+            "bridges": [],
+            "vrfs": [],
+            "veths": [],
+            "ip_assignments": [],
+            "master_relations": [],
+        }
+
+    def _record(self, category: str, entry: dict):
+        self.operations[category].append(entry)
+        if category == "interfaces":
+            self.created_interfaces.add(entry["name"])
+        elif category == "bridges":
+            self.created_bridges.add(entry["name"])
+        elif category == "ip_assignments":
+            self.assigned_ips.setdefault(entry["interface"], []).append(entry["ip"])
+        elif category == "master_relations":
+            self.master_relations[entry["slave"]] = entry["master"]
+
+
+def record(rollback, count: int):
+    for vni in range(1, count + 1):
+        unit = UnitRollback(rollback, f"l2vni:{vni}")
+        vlan_id = vni % 4094 + 1
+        unit.record_bridge(f"br-vsi{vni}", vni)
+        unit.record_interface(f"vxlan{vni}", vni)
+        unit.record_master_relation(f"vxlan{vni}", f"br-vsi{vni}")
+        unit.record_interface(f"eth1.{vlan_id}", vlan_id=vlan_id)
+        unit.record_master_relation(f"eth1.{vlan_id}", f"br-vsi{vni}")
+        unit.record_master_relation(f"br-vsi{vni}", "vrf1")
+        unit.record_ip_assignment(
+            f"br-vsi{vni}", f"10.{vni >> 8 & 255}.{vni & 255}.1/24"
+        )
+
+
+def measure(factory, count: int, serialize) -> tuple:
+    tracemalloc.start()
+    rollback = factory()
+    record(rollback, count)
+    (size, _) = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    start = time.perf_counter()
+    data = json.dumps(serialize(rollback), separators=(",", ":"))
+    return (size, len(data), time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--count", type=int, default=16000)
+    args = parser.parse_args()
+
+    results = {
+        "dict list": measure(
+            LegacyRecorder, args.count, lambda rollback: rollback.operations
+        ),
+        "OperationLog": measure(
+            RollbackManager, args.count, lambda rollback: rollback.log.to_compact()
+        ),
+    }
+    for name, (size, length, elapsed) in results.items():
+        print(
+            f"{name:13} memory {size / 2**20:7.2f} MiB, "
+            f"serialized {length / 2**20:6.2f} MiB in {elapsed:.3f}s"
+        )
+    (legacy, compact) = results.values()
+    print(
+        f"reduction:    memory {legacy[0] / compact[0]:.1f}x, "
+        f"serialized {legacy[1] / compact[1]:.1f}x"
+    )
@@ -0,0 +1,117 @@
+"""对比逐项回滚与按最小删除集合批量、按组删除的回滚耗时
+
+在临时netns中为N个VNI各创建桥接、VXLAN接口（加入桥接）和桥接上的IP，
+每隔10个VNI创建一对veth，然后分别用两种方式回滚：
+
+    python bench/rollback_bench.py --count 1000
+"""
+
+import os
+import sys
+import time
+import argparse
+from pyroute2 import IPRoute, netns
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common.ifindex_cache import IfIndexCache
+from common.log import log
+from common.rollback_manager import RollbackManager
+from common.batch import NetlinkBatch
+from common.setup import (
+    assign_ip_address,
+    create_bridge,
+    create_veth,
+    create_vxlan_interface,
+)
+
+
+def populate(ipr: IPRoute, count: int) -> RollbackManager:
+    rollback = RollbackManager()
+    batch = NetlinkBatch()
+    for vni in range(1, count + 1):
+        create_bridge(ipr, rollback, f"br-vsi{vni}", batch=batch)
+        if vni % 10 == 0:
+            create_veth(ipr, rollback, f"v{vni}-in", f"v{vni}-ext", batch=batch)
+    batch.run(ipr)
+    batch = NetlinkBatch()
+    for vni in range(1, count + 1):
+        create_vxlan_interface(
+            ipr, rollback, vni, "192.0.2.1", master=f"br-vsi{vni}", batch=batch
+        )
+        assign_ip_address(
+            ipr,
+            rollback,
+            f"br-vsi{vni}",
+            f"10.{vni // 256}.{vni % 256}.1/32",
+            batch=batch,
+        )
+    batch.run(ipr)
+    return rollback
+
+
+def legacy_rollback(rollback: RollbackManager, ipr: IPRoute):
+    """改动之前的回滚：每一项先link_lookup，再单独发出请求"""
+    for slave in rollback.master_relations:
+        idx = ipr.link_lookup(ifname=slave)
+        if idx:
+            ipr.link("set", index=idx[0], state="down")
+            ipr.link("set", index=idx[0], master=0)
+    for ifname, ips in rollback.assigned_ips.items():
+        for ip in ips:
+            idx = ipr.link_lookup(ifname=ifname)
+            if idx:
+                ipr.addr(
+                    "del",
+                    index=idx[0],
+                    address=ip.split("/")[0],
+                    mask=int(ip.split("/")[1]),
+                )
+    for names in (
+        rollback.created_veths,
+        rollback.created_bridges,
+        rollback.created_interfaces,
+        rollback.created_vrfs,
+    ):
+        for name in names:
+            idx = ipr.link_lookup(ifname=name)
+            if idx:
+                ipr.link("del", index=idx[0])
+
+
+def bench(mode: str, count: int) -> float:
+    nsname = f"vxbench-{os.getpid()}"
+    netns.create(nsname)
+    try:
+        with IfIndexCache(IPRoute(netns=nsname, nlm_echo=True)) as ipr:
+            rollback = populate(ipr.seed(), count)
+        with IPRoute(netns=nsname) as ipr:
+            start = time.perf_counter()
+            if mode == "legacy":
+                legacy_rollback(rollback, ipr)
+            else:
+                rollback.rollback(ipr)
+            elapsed = time.perf_counter() - start
+            left = [l.get("ifname") for l in ipr.get_links()]
+            if left != ["lo"]:
+                print(f"{mode}: {len(left) - 1} interfaces left", file=sys.__stdout__)
+            return elapsed
+    finally:
+        netns.remove(nsname)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--count", type=int, default=500)
+    args = parser.parse_args()
+
+    # 关闭每个操作的打印，避免输出耗时干扰结果
+    sys.stdout = open(os.devnull, "w")
+    legacy = bench("legacy", args.count)
+    batched = bench("batched", args.count)
+    log.flush()
+    sys.stdout = sys.__stdout__
+
+    print(f"legacy:  {legacy:.3f}s")
+    print(f"batched: {batched:.3f}s")
+    print(f"speedup: {legacy / batched:.2f}x")
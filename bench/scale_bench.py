@@ -0,0 +1,323 @@
+"""distribute-symmetric模式的规模基准
+
+每个规模（VLAN数:VRF数）在一个临时netns中运行，underlay/overlay为dummy接口
+（--link-kind veth时为veth）。依次测量：
+
+    full_apply   空状态下完整应用
+    noop         配置不变时重新应用（快速路径）
+    incremental  修改1%的VLAN后应用
+    removal      删除全部VRF和VLAN
+    rollback     重新完整应用后，用RollbackManager.rollback回滚
+
+每个阶段报告耗时、操作数和ops/s、netlink消息数、峰值RSS和状态文件大小，
+输出为JSON。给出--baseline时与之前的结果比较，超出--tolerance即视为回归，
+以非零状态退出：
+
+    python bench/scale_bench.py --scales 10:1,100:10,1000:100,4000:500 \\
+        --output scale.json
+    python bench/scale_bench.py --baseline scale.json --tolerance 0.2
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import resource
+import tempfile
+import subprocess
+from typing import List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+UNDERLAY = "ul0"
+OVERLAY = "ol0"
+UNDERLAY_IP = "192.0.2.1"
+
+
+def make_conf(vlans: int, vrfs: int) -> dict:
+    """合成配置：VLAN按顺序轮流分配到各VRF"""
+    return {
+        "Mode": "distribute-symmetric",
+        "UnderlayEth": UNDERLAY,
+        "OverlayEth": OVERLAY,
+        "VRFMapL3VNI": [
+            {
+                "VRFName": f"vrf{i}",
+                "VxLANL3VNI": 100000 + i,
+                "VRFRouteTableID": 1000 + i,
+                "VxLANInOutDomainVethPrefix": f"vt{i}",
+                "InOutVethRequire": False,
+                "InVRFVethIPAddr": f"169.254.{i >> 6}.{(i & 63) * 4 + 1}/30",
+                "ExternalVRFVethIPAddr": f"169.254.{i >> 6}.{(i & 63) * 4 + 2}/30",
+            }
+            for i in range(1, vrfs + 1)
+        ],
+        "VlanMapVNI": [
+            {
+                "VlanID": j,
+                "L2VxLANVNI": 10000 + j,
+                "L2VxLANVNIIPAddr": f"10.{j >> 8}.{j & 255}.1/24",
+                "L2VxLANVNIMacAddr": f"02:00:00:00:{j >> 8:02x}:{j & 255:02x}",
+                "L3VxLANVNI": 100000 + (j - 1) % vrfs + 1,
+            }
+            for j in range(1, vlans + 1)
+        ],
+    }
+
+
+def change_one_percent(conf: dict) -> dict:
+    """修改1%（至少一个）VLAN的IP地址"""
+    conf = json.loads(json.dumps(conf))
+    vlans = conf["VlanMapVNI"]
+    for vlan in vlans[: max(1, len(vlans) // 100)]:
+        j = vlan["VlanID"]
+        vlan["L2VxLANVNIIPAddr"] = f"11.{j >> 8}.{j & 255}.1/24"
+    return conf
+
+
+class MessageCounter:
+    """统计本进程发出的netlink请求数（包括dump）"""
+
+    def __init__(self):
+        from pyroute2.netlink.nlsocket import NetlinkRequest
+
+        self.count = 0
+        send = NetlinkRequest.send
+        counter = self
+
+        async def counting_send(request):
+            counter.count += 1
+            return await send(request)
+
+        NetlinkRequest.send = counting_send
+
+
+def _state_size(state_manager) -> int:
+    path = (
+        state_manager.STATE_DB
+        if state_manager.STATE_BACKEND == "sqlite"
+        else state_manager.STATE_FILE
+    )
+    return os.path.getsize(path) if os.path.exists(path) else 0
+
+
+def run_worker(vlans: int, vrfs: int, engine: str) -> dict:
+    """在目标netns中（由ip netns exec启动）依次执行各阶段"""
+    from pyroute2 import IPRoute
+    from main import apply_config
+    from common import state_manager
+    from common.types import compile_config
+    from common.planner import build_plan
+    from common.executor import execute_plan
+    from common.rollback_manager import RollbackManager
+    from distribute.sdr.sdr import configure_vxlan_bgp_evpn_distribute_sdr
+
+    counter = MessageCounter()
+    args = argparse.Namespace(
+        engine=engine,
+        concurrency=64,
+        reconcile=False,
+        resume=False,
+        rollback_scope="all",
+        force=False,
+        plan=False,
+        plan_latency=None,
+    )
+    conf = make_conf(vlans, vrfs)
+    changed = change_one_percent(conf)
+    phases = {}
+
+    def measure(name: str, fn):
+        counter.count = 0
+        start = time.perf_counter()
+        (status, operations) = fn()
+        seconds = time.perf_counter() - start
+        phases[name] = {
+            "status": status,
+            "seconds": round(seconds, 4),
+            "operations": operations,
+            "ops_per_sec": round(operations / seconds, 1) if seconds else None,
+            "netlink_messages": counter.count,
+            "peak_rss_kib": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            "state_file_bytes": _state_size(state_manager),
+        }
+
+    def apply(conf: dict):
+        def fn():
+            result = apply_config(json.dumps(conf), args)
+            return (result["status"], result.get("operations", 0))
+
+        return fn
+
+    def remove_all():
+        # 删除全部条目的配置不能通过校验，直接按与上次配置的差异生成删除计划
+        last_config = compile_config(changed)
+        empty = dict(changed, VRFMapL3VNI=[], VlanMapVNI=[])
+        plan = build_plan(compile_config(empty), UNDERLAY_IP, last_config)
+        rollback = RollbackManager()
+        with IPRoute() as ipr:
+            ok = execute_plan(ipr, rollback, plan)
+        if os.path.exists(state_manager.STATE_FILE):
+            os.remove(state_manager.STATE_FILE)
+        return ("ok" if ok else "failed", len(rollback.log))
+
+    rollback = RollbackManager()
+
+    def roll_back():
+        with IPRoute() as ipr:
+            rollback.rollback(ipr)
+        return ("ok", len(rollback.log))
+
+    measure("full_apply", apply(conf))
+    measure("noop", apply(conf))
+    measure("incremental", apply(changed))
+    measure("removal", remove_all)
+    # 回滚阶段只计时rollback本身，之前的完整应用不计入结果
+    configure_vxlan_bgp_evpn_distribute_sdr(conf, rollback)
+    measure("rollback", roll_back)
+    return phases
+
+
+def create_netns(name: str, link_kind: str):
+    from pyroute2 import IPRoute, netns
+
+    netns.create(name)
+    with IPRoute(netns=name) as ipr:
+        for ifname in (UNDERLAY, OVERLAY):
+            if link_kind == "veth":
+                ipr.link("add", ifname=ifname, kind="veth", peer=f"{ifname}-peer")
+            else:
+                ipr.link("add", ifname=ifname, kind="dummy")
+            idx = ipr.link_lookup(ifname=ifname)[0]
+            ipr.link("set", index=idx, state="up")
+        ipr.addr(
+            "add",
+            index=ipr.link_lookup(ifname=UNDERLAY)[0],
+            address=UNDERLAY_IP,
+            mask=24,
+        )
+
+
+def run_scale(vlans: int, vrfs: int, args) -> dict:
+    """在新建的netns和临时状态目录中运行一个规模的全部阶段"""
+    from pyroute2 import netns
+
+    name = f"vxscale-{os.getpid()}-{vlans}-{vrfs}"
+    state_dir = tempfile.mkdtemp(prefix="vxscale-")
+    env = dict(os.environ)
+    env["VXLANBGP_STATE_FILE"] = os.path.join(state_dir, "state.json")
+    env.pop("VXLANBGP_STATE_DB", None)
+    try:
+        create_netns(name, args.link_kind)
+        proc = subprocess.run(
+            ["ip", "netns", "exec", name, sys.executable, os.path.abspath(__file__)]
+            + ["--worker", f"{vlans}:{vrfs}", "--engine", args.engine],
+            env=env,
+            capture_output=True,
+            text=True,
+        )
+        if proc.returncode:
+            raise RuntimeError(f"worker for {vlans}:{vrfs} failed: {proc.stderr}")
+        return {
+            "vlans": vlans,
+            "vrfs": vrfs,
+            "phases": json.loads(proc.stdout.splitlines()[-1]),
+        }
+    finally:
+        netns.remove(name)
+        shutil.rmtree(state_dir, ignore_errors=True)
+
+
+def find_regressions(results: List[dict], baseline: dict, tolerance: float):
+    """耗时或峰值RSS超过基线(1+tolerance)倍的阶段"""
+    base = {(r["vlans"], r["vrfs"]): r["phases"] for r in baseline["results"]}
+    regressions = []
+    for result in results:
+        phases = base.get((result["vlans"], result["vrfs"]))
+        if phases is None:
+            continue
+        for phase, m in result["phases"].items():
+            if phase not in phases:
+                continue
+            for metric in ("seconds", "peak_rss_kib"):
+                limit = phases[phase][metric] * (1 + tolerance)
+                if m[metric] > limit:
+                    regressions.append(
+                        {
+                            "vlans": result["vlans"],
+                            "vrfs": result["vrfs"],
+                            "phase": phase,
+                            "metric": metric,
+                            "value": m[metric],
+                            "baseline": phases[phase][metric],
+                        }
+                    )
+    return regressions
+
+
+def _scale(text: str) -> tuple:
+    (vlans, vrfs) = text.split(":")
+    return (int(vlans), int(vrfs))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--scales",
+        default="10:1,100:10,1000:100,4000:500",
+        help="逗号分隔的VLAN数:VRF数",
+    )
+    parser.add_argument("--engine", choices=["batch", "async"], default="batch")
+    parser.add_argument("--link-kind", choices=["dummy", "veth"], default="dummy")
+    parser.add_argument("--output", help="结果JSON写入的文件，默认输出到标准输出")
+    parser.add_argument("--baseline", help="用于比较的之前的结果JSON")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    parser.add_argument("--worker", type=_scale, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        # 关闭每个操作的打印，避免输出耗时干扰结果
+        sys.stdout = open(os.devnull, "w")
+        phases = run_worker(*args.worker, args.engine)
+        # 缓冲的日志也写入/dev/null，不能出现在结果行之后
+        from common.log import log
+
+        log.flush()
+        sys.stdout = sys.__stdout__
+        print(json.dumps(phases))
+        sys.exit(0)
+
+    import pyroute2
+
+    report = {
+        "host": {
+            "kernel": platform.release(),
+            "python": platform.python_version(),
+            "pyroute2": pyroute2.__version__,
+        },
+        "engine": args.engine,
+        "link_kind": args.link_kind,
+        "results": [],
+    }
+    for vlans, vrfs in (_scale(s) for s in args.scales.split(",")):
+        print(f"Running {vlans} VLANs / {vrfs} VRFs...", file=sys.stderr)
+        report["results"].append(run_scale(vlans, vrfs, args))
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            report["regressions"] = find_regressions(
+                report["results"], json.load(f), args.tolerance
+            )
+
+    data = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(data + "\n")
+    else:
+        print(data)
+    if report.get("regressions"):
+        print(f"{len(report['regressions'])} regressions found", file=sys.stderr)
+        sys.exit(1)
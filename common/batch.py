@@ -0,0 +1,125 @@
+import gc
+import asyncio
+from typing import List, Optional
+from pyroute2 import IPRoute
+from common.ifindex_cache import IfIndexCache
+
+
+class BatchOp:
+    """批量提交中的单个netlink请求"""
+
+    __slots__ = ("label", "target", "command", "kwarg", "result", "error", "records")
+
+    def __init__(self, label: str, target: str, command: str, kwarg: dict):
+        self.label = label
+        self.target = target
+        self.command = command
+        self.kwarg = kwarg
+        self.result = None
+        self.error: Optional[Exception] = None
+        # 请求发出之前写入的回滚记录，请求被内核拒绝时撤销
+        self.records = ()
+
+
+class NetlinkBatch:
+    """流水线批量提交器
+
+    加入批次的请求互不依赖：run()在同一个netlink socket上连续发出所有请求
+    （每个请求使用独立的sequence number），然后统一收集ACK和错误，
+    并把每个错误对应回产生它的操作。
+    """
+
+    def __init__(self, window: int = 256, timeout: float = 30.0):
+        # 同时在途的请求上限：回复超出socket接收缓冲区（默认1MB）会被内核丢弃，
+        # 对应请求将永远等不到ACK
+        self.window = window
+        self.timeout = timeout
+        self.ops: List[BatchOp] = []
+
+    def __len__(self):
+        return len(self.ops)
+
+    def link(self, label: str, command: str, **kwarg) -> BatchOp:
+        op = BatchOp(label, "link", command, kwarg)
+        self.ops.append(op)
+        return op
+
+    def addr(self, label: str, command: str, **kwarg) -> BatchOp:
+        op = BatchOp(label, "addr", command, kwarg)
+        self.ops.append(op)
+        return op
+
+    def vlan_filter(self, label: str, command: str, **kwarg) -> BatchOp:
+        op = BatchOp(label, "vlan_filter", command, kwarg)
+        self.ops.append(op)
+        return op
+
+    async def _submit(self, core) -> None:
+        semaphore = asyncio.Semaphore(self.window)
+
+        async def submit_one(op: BatchOp):
+            async with semaphore:
+                return await asyncio.wait_for(
+                    getattr(core, op.target)(op.command, **op.kwarg), self.timeout
+                )
+
+        results = await asyncio.gather(
+            *(submit_one(op) for op in self.ops), return_exceptions=True
+        )
+        for op, result in zip(self.ops, results):
+            if isinstance(result, Exception):
+                op.error = result
+            else:
+                op.result = result
+
+    def run(self, ipr: IPRoute) -> List[BatchOp]:
+        """流水线提交全部请求，返回失败的操作"""
+        if not self.ops:
+            return []
+
+        sock = ipr.ipr if isinstance(ipr, IfIndexCache) else ipr
+        core = getattr(sock, "asyncore", None)
+        if core is None:
+            return self.run_sequential(ipr)
+
+        # 批次的全部回复在提交结束前都被引用：期间的分代GC反复扫描这些存活的
+        # 消息对象却回收不了什么（上千个请求的批次会触发多次全量回收），暂停GC
+        enabled = gc.isenabled()
+        gc.disable()
+        try:
+            core.event_loop.run_until_complete(self._submit(core))
+        finally:
+            if enabled:
+                gc.enable()
+
+        if isinstance(ipr, IfIndexCache):
+            for op in self.ops:
+                if op.target == "link" and op.error is None:
+                    ipr.update(op.command, op.kwarg, op.result)
+            # veth对端等回复中没有的接口，用一次dump代替逐个回源查询
+            if len(ipr.unresolved) > 1:
+                ipr.seed()
+        return [op for op in self.ops if op.error is not None]
+
+    def run_sequential(self, ipr: IPRoute) -> List[BatchOp]:
+        """逐个提交并等待ACK，返回失败的操作"""
+        for op in self.ops:
+            try:
+                op.result = getattr(ipr, op.target)(op.command, **op.kwarg)
+            except Exception as e:
+                op.error = e
+        return [op for op in self.ops if op.error is not None]
+
+
+def submit(
+    ipr: IPRoute,
+    batch: Optional[NetlinkBatch],
+    label: str,
+    target: str,
+    command: str,
+    **kwarg,
+):
+    """立即发送请求；传入batch时只加入批次，由调用方统一提交"""
+    if batch is not None:
+        return getattr(batch, target)(label, command, **kwarg)
+    return getattr(ipr, target)(command, **kwarg)
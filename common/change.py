@@ -1,6 +1,6 @@
 from pyroute2 import IPRoute
 from common.rollback_manager import RollbackManager
-from common.setup import create_veth, assign_ip_address, set_master
+from common.setup import create_veth, assign_ip_address
 from common.query import check_interface_exist
 from common.remove import remove_veth
 
@@ -29,7 +29,11 @@ def handle_veth_for_vrf(
     if require_veth:
         # 创建veth接口
         (in_veth, ext_veth) = create_veth(
-            ipr, rollback, f"{vrf_in_out_veth_name}-in", f"{vrf_in_out_veth_name}-ext"
+            ipr,
+            rollback,
+            f"{vrf_in_out_veth_name}-in",
+            f"{vrf_in_out_veth_name}-ext",
+            master=vrf_name,
         )
         if not in_veth or not ext_veth:
             return False
@@ -43,8 +47,4 @@ def handle_veth_for_vrf(
         ):
             return False
 
-        # 设置master
-        if not set_master(ipr, rollback, in_veth, vrf_name):
-            return False
-
     return True
@@ -1,4 +1,4 @@
-from common.types import VRFMapL3VNIList,VlanMapVNIList
+from common.types import VRFMapL3VNIList,VlanMapVNIList, CompiledConf
 
 
 class DiffAnalyzer:
@@ -20,6 +20,24 @@ class DiffAnalyzer:
 
         return {"added": added, "removed": removed, "changed": changed}
 
+    @staticmethod
+    def compare_vlan_config_with_details(
+        old: list[VlanMapVNIList], new: list[VlanMapVNIList]
+    ) -> dict:
+        """比较VLAN配置差异，changed中同时保留新旧条目"""
+        old_map = {v["VlanID"]: v for v in old}
+        new_map = {v["VlanID"]: v for v in new}
+
+        added = [v for vid, v in new_map.items() if vid not in old_map]
+        removed = [v for vid, v in old_map.items() if vid not in new_map]
+        changed = [
+            {"vlan_id": vid, "old": old_map[vid], "new": new_map[vid]}
+            for vid in set(old_map.keys()) & set(new_map.keys())
+            if old_map[vid] != new_map[vid]
+        ]
+
+        return {"added": added, "removed": removed, "changed": changed}
+
     @staticmethod
     def compare_vrf_config(old: list[VRFMapL3VNIList], new: list[VRFMapL3VNIList]) -> dict:
         """比较VRF配置差异"""
@@ -69,4 +87,62 @@ class DiffAnalyzer:
                     }
                 )
 
-        return {"added": added, "removed": removed, "changed": changed}
\ No newline at end of file
+        return {"added": added, "removed": removed, "changed": changed}
+
+    @staticmethod
+    def compare_vlan_entries(old: CompiledConf, new: CompiledConf) -> dict:
+        """compare_vlan_config_with_details的编译配置版本，直接使用VlanID索引
+
+        先比较整个配置的摘要，再逐条比较条目摘要，不再比较完整的字典。
+        """
+        if old.digest == new.digest and old.overlay_eth == new.overlay_eth:
+            return {"added": [], "removed": [], "changed": []}
+
+        added = [v for vid, v in new.vlan_by_id.items() if vid not in old.vlan_by_id]
+        removed = [v for vid, v in old.vlan_by_id.items() if vid not in new.vlan_by_id]
+        changed = [
+            {"vlan_id": vid, "old": old.vlan_by_id[vid], "new": v}
+            for vid, v in new.vlan_by_id.items()
+            if vid in old.vlan_by_id
+            and (
+                old.vlan_by_id[vid].digest != v.digest
+                or old.vlan_by_id[vid].subif != v.subif
+            )
+        ]
+
+        return {"added": added, "removed": removed, "changed": changed}
+
+    @staticmethod
+    def compare_vrf_entries(old: CompiledConf, new: CompiledConf) -> dict:
+        """compare_vrf_config_with_details的编译配置版本，直接使用VRFName索引
+
+        只对摘要不同的条目展开字段级的比较。
+        """
+        if old.digest == new.digest:
+            return {"added": [], "removed": [], "changed": []}
+
+        added = [v for name, v in new.vrf_by_name.items() if name not in old.vrf_by_name]
+        removed = [
+            v for name, v in old.vrf_by_name.items() if name not in new.vrf_by_name
+        ]
+        changed = []
+
+        for name, new_vrf in new.vrf_by_name.items():
+            old_vrf = old.vrf_by_name.get(name)
+            if old_vrf is None or old_vrf.digest == new_vrf.digest:
+                continue
+            changed_fields = {
+                k: (old_vrf.raw.get(k), new_vrf.raw.get(k))
+                for k in set(old_vrf.raw.keys()) | set(new_vrf.raw.keys())
+                if old_vrf.raw.get(k) != new_vrf.raw.get(k)
+            }
+            changed.append(
+                {
+                    "name": name,
+                    "old": old_vrf,
+                    "new": new_vrf,
+                    "changed_fields": changed_fields,
+                }
+            )
+
+        return {"added": added, "removed": removed, "changed": changed}
@@ -0,0 +1,192 @@
+"""--plan：不改动内核，输出一次运行将要发出的netlink请求和耗时估计
+
+只读地dump一次链路和地址，复制到common.fake_iproute.FakeKernel中，然后在这份
+副本上执行与实际运行相同的过程：中断运行的回滚、协调/继续执行的判断、差异
+分析、计划构建和所选的执行器。因此列出的请求及其顺序就是实际运行发出的请求，
+包括查询和dump；失败的请求（例如与现有接口冲突）也会标出。不打开可写的
+netlink socket，也不写状态文件和操作日志。
+
+耗时估计按每个请求的操作类型取平均延迟：--plan-latency给出之前用--metrics
+写出的PREFIX.json时取其中各类型的平均值，否则测量本机一次只读请求的往返。
+同一次往返中流水线发出的请求在内核中仍按顺序处理，实际耗时介于按往返计的
+下限和逐个请求累加的上限之间。
+"""
+
+import json
+import time
+import asyncio
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+from common.types import SVD_MODE, EnvConf
+from common.log import log
+from common.trace import span
+from common.fake_iproute import FakeAsyncIPRoute, FakeIPRoute, FakeKernel
+from common.reconcile import KernelSnapshot
+from common.rollback_manager import RollbackManager
+
+# 测量往返延迟时的请求数
+PROBE_SAMPLES = 20
+
+
+def load_latencies(path: str) -> Tuple[Dict[str, float], float]:
+    """由--metrics写出的JSON摘要得到各操作类型的平均延迟和总平均延迟（秒）"""
+    with open(path, "r") as f:
+        summary = json.load(f)
+    latencies = {op: m["mean_ms"] / 1000 for (op, m) in summary["ops"].items()}
+    default = summary["seconds"] / summary["messages"] if summary["messages"] else 0.0
+    return (latencies, default)
+
+
+def probe_latency(ipr, ifname: str) -> float:
+    """用只读的link_lookup测量本机一次netlink往返的时间"""
+    start = time.perf_counter()
+    for _ in range(PROBE_SAMPLES):
+        ipr.link_lookup(ifname=ifname)
+    return (time.perf_counter() - start) / PROBE_SAMPLES
+
+
+def estimate(
+    journal: List[dict], latencies: Dict[str, float], default: float
+) -> Tuple[float, float]:
+    """耗时的下限（每次往返取其中最慢的请求）和上限（逐个请求累加）"""
+    serial = 0.0
+    slowest: Dict[int, float] = {}
+    for entry in journal:
+        latency = latencies.get(entry["op"], default)
+        serial += latency
+        trip = entry["round_trip"]
+        slowest[trip] = max(slowest.get(trip, 0.0), latency)
+    return (sum(slowest.values()), serial)
+
+
+def plan_config(conf: EnvConf, last_state: Optional[dict], args) -> dict:
+    """在内核的内存副本上执行配置，输出请求列表、各类操作的数量和耗时估计"""
+    if conf.get("Mode") not in ("distribute-symmetric", SVD_MODE):
+        log.error("--plan supports distribute-symmetric and SVD modes only")
+        return {"status": "error", "success": False}
+
+    from pyroute2 import IPRoute
+
+    # SVD模式的ip/bridge命令经由common.iproute2交给FakeIPRoute，同样在副本上执行
+    if conf["Mode"] == SVD_MODE:
+        from distribute.svd.svd import (
+            configure_vxlan_bgp_evpn_distribute_svd as configure,
+        )
+        from distribute.svd.svd_async import (
+            configure_vxlan_bgp_evpn_distribute_svd as configure_async,
+        )
+    else:
+        from distribute.sdr.sdr import (
+            configure_vxlan_bgp_evpn_distribute_sdr as configure,
+        )
+        from distribute.sdr.sdr_async import (
+            configure_vxlan_bgp_evpn_distribute_sdr as configure_async,
+        )
+
+    with span("kernel.dump"), IPRoute() as ipr:
+        kernel = FakeKernel.from_snapshot(KernelSnapshot.capture(ipr))
+        if args.plan_latency:
+            (latencies, default) = load_latencies(args.plan_latency)
+            source = args.plan_latency
+        else:
+            (latencies, default) = ({}, probe_latency(ipr, conf["UnderlayEth"]))
+            source = f"{default * 1000:.3f}ms measured round trip"
+    links = len(kernel.links)
+    kernel.journal = []
+
+    # 与apply_config相同：中断的运行先回滚，或者--resume时并入本次运行
+    rollback = RollbackManager(scope=args.rollback_scope)
+    if last_state and last_state.get("interrupted") and args.resume:
+        rollback = RollbackManager.from_operations(
+            last_state["operations"], scope=args.rollback_scope
+        )
+    elif last_state and last_state.get("interrupted"):
+        with FakeIPRoute(kernel) as ipr:
+            RollbackManager.from_operations(last_state["operations"]).rollback(ipr)
+
+    with span("plan.simulate"):
+        if args.engine == "async":
+            ipr = FakeAsyncIPRoute(kernel, nlm_echo=True)
+            success = asyncio.run(
+                configure_async(
+                    conf,
+                    rollback,
+                    last_state,
+                    args.concurrency,
+                    args.reconcile,
+                    args.resume,
+                    ipr=ipr,
+                )
+            )
+            ipr.close()
+        else:
+            with FakeIPRoute(kernel, nlm_echo=True) as ipr:
+                success = configure(
+                    conf, rollback, last_state, args.reconcile, args.resume, ipr=ipr
+                )
+
+    journal = kernel.journal
+    for (seq, entry) in enumerate(journal, 1):
+        msg = "{seq:>6}  {op:<12} {entity}"
+        if entry["args"]:
+            msg += " {args}"
+        if entry["removed"] > 1:
+            msg += " (+{cascaded} cascaded)"
+        if "error" in entry:
+            msg += " -> {errno}"
+        log.info(
+            msg,
+            seq=seq,
+            op=entry["op"],
+            entity=entry["entity"] or "-",
+            args=" ".join(f"{k}={v}" for (k, v) in entry["args"].items()),
+            round_trip=entry["round_trip"],
+            cascaded=entry["removed"] - 1,
+            errno=entry.get("error"),
+        )
+
+    counts = Counter(entry["op"] for entry in journal)
+    for (op, count) in counts.most_common():
+        log.info(
+            "{op:<12} {count:>8,}  {seconds:>9.3f}s",
+            op=op,
+            count=count,
+            seconds=count * latencies.get(op, default),
+        )
+    (low, high) = estimate(journal, latencies, default)
+    removed = sum(entry["removed"] for entry in journal)
+    created = len(kernel.links) - links + removed
+    log.info(
+        "{requests:,} netlink requests in {round_trips:,} round trips ({engine} engine)",
+        requests=len(journal),
+        round_trips=kernel.round_trips,
+        engine=args.engine,
+    )
+    log.info(
+        "{created:,} interfaces created, {removed:,} torn down",
+        created=created,
+        removed=removed,
+    )
+    log.info(
+        "Estimated time: {low:.2f}s to {high:.2f}s (latency: {source})",
+        low=round(low, 3),
+        high=round(high, 3),
+        source=source,
+    )
+    if not success:
+        log.warning(
+            "The apply would fail; failed units: {units}",
+            units=", ".join(sorted(rollback.failed_units())) or "-",
+        )
+
+    return {
+        "status": "planned",
+        "success": success,
+        "operations": len(rollback.log),
+        "requests": len(journal),
+        "round_trips": kernel.round_trips,
+        "counts": dict(counts),
+        "created": created,
+        "removed": removed,
+        "estimate_seconds": [round(low, 3), round(high, 3)],
+    }
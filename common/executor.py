@@ -0,0 +1,424 @@
+import time
+import asyncio
+from collections import Counter
+from typing import Dict, List, Optional, Set
+from pyroute2 import IPRoute
+from pyroute2.netlink.exceptions import NetlinkError
+from common.rollback_manager import RollbackManager
+from common.batch import NetlinkBatch
+from common.planner import Op, Plan
+from common.trace import TRACER, span
+from common.log import Progress, log
+from common.metrics import op_type
+from common import setup_async, remove_async
+from common.setup import (
+    assign_ip_address,
+    create_bridge,
+    create_svd_vxlan,
+    create_veth,
+    create_vlan_interface,
+    create_vrf,
+    create_vxlan_interface,
+    set_link_up,
+    set_mac_address,
+    set_master,
+)
+from common.remove import (
+    remove_bridge,
+    remove_interface,
+    remove_veth,
+    remove_vlan_interface,
+    remove_vrf,
+    remove_vxlan_interface,
+    unassign_ip_address,
+    unset_master,
+)
+
+
+def _vrf_add(ipr, rollback, op: Op, batch) -> bool:
+    return bool(create_vrf(ipr, rollback, op.ifname, op.args["table"], batch=batch))
+
+
+def _bridge_add(ipr, rollback, op: Op, batch) -> bool:
+    return bool(
+        create_bridge(
+            ipr,
+            rollback,
+            op.ifname,
+            master=op.args.get("master", ""),
+            address=op.args.get("address", ""),
+            vlan_filtering=op.args.get("vlan_filtering", False),
+            batch=batch,
+        )
+    )
+
+
+def _vxlan_add(ipr, rollback, op: Op, batch) -> bool:
+    return bool(
+        create_vxlan_interface(
+            ipr,
+            rollback,
+            op.args["vni"],
+            op.args["local_ip"],
+            master=op.args.get("master", ""),
+            batch=batch,
+        )
+    )
+
+
+def _svd_vxlan_add(ipr, rollback, op: Op, batch) -> bool:
+    return bool(
+        create_svd_vxlan(
+            ipr,
+            rollback,
+            op.ifname,
+            op.args["local_ip"],
+            master=op.args.get("master", ""),
+            batch=batch,
+        )
+    )
+
+
+def _vlan_add(ipr, rollback, op: Op, batch) -> bool:
+    return bool(
+        create_vlan_interface(
+            ipr,
+            rollback,
+            op.args["parent"],
+            op.args["vlan_id"],
+            master=op.args.get("master", ""),
+            batch=batch,
+        )
+    )
+
+
+def _veth_add(ipr, rollback, op: Op, batch) -> bool:
+    (in_veth, ext_veth) = create_veth(
+        ipr,
+        rollback,
+        op.ifname,
+        op.args["peer"],
+        master=op.args.get("master", ""),
+        batch=batch,
+    )
+    return bool(in_veth and ext_veth)
+
+
+OP_HANDLERS = {
+    "vrf.add": _vrf_add,
+    "bridge.add": _bridge_add,
+    "vxlan.add": _vxlan_add,
+    "svd.vxlan.add": _svd_vxlan_add,
+    "vlan.add": _vlan_add,
+    "veth.add": _veth_add,
+    "link.up": lambda ipr, rollback, op, batch: set_link_up(
+        ipr, op.ifname, batch=batch
+    ),
+    "addr.add": lambda ipr, rollback, op, batch: assign_ip_address(
+        ipr, rollback, op.ifname, op.args["address"], batch=batch
+    ),
+    "master.set": lambda ipr, rollback, op, batch: set_master(
+        ipr, rollback, op.ifname, op.args["master"], batch=batch
+    ),
+    "mac.set": lambda ipr, rollback, op, batch: set_mac_address(
+        ipr, rollback, op.ifname, op.args["address"], batch=batch
+    ),
+    "master.unset": lambda ipr, rollback, op, batch: unset_master(
+        ipr, rollback, op.ifname, op.args["master"], batch=batch
+    ),
+    "addr.del": lambda ipr, rollback, op, batch: unassign_ip_address(
+        ipr, rollback, op.ifname, op.args["address"], batch=batch
+    ),
+    "bridge.del": lambda ipr, rollback, op, batch: remove_bridge(
+        ipr, rollback, op.ifname, batch=batch
+    ),
+    "vxlan.del": lambda ipr, rollback, op, batch: remove_vxlan_interface(
+        ipr, rollback, op.args["vni"], batch=batch
+    ),
+    "vlan.del": lambda ipr, rollback, op, batch: remove_vlan_interface(
+        ipr, rollback, op.args["parent"], op.args["vlan_id"], batch=batch
+    ),
+    "vrf.del": lambda ipr, rollback, op, batch: remove_vrf(
+        ipr, rollback, op.ifname, batch=batch
+    ),
+    "veth.del": lambda ipr, rollback, op, batch: remove_veth(
+        ipr, rollback, op.ifname, batch=batch
+    ),
+    "link.del": lambda ipr, rollback, op, batch: remove_interface(
+        ipr, rollback, op.ifname, batch=batch
+    ),
+}
+
+
+def execute_plan(
+    ipr: IPRoute, rollback: RollbackManager, plan: Plan, pipelined: bool = True
+) -> bool:
+    """逐层执行计划：同一层的操作互不依赖，作为一个批次流水线提交
+
+    rollback.scope为"unit"时，一个操作失败只标记其所属实体失败：该实体
+    剩余的操作和依赖它的操作被跳过，其他实体照常执行。
+    """
+    levels = plan.levels()
+    log.info(
+        "Executing plan: {operations} operations in {levels} levels, "
+        "critical path {critical_path} operations",
+        operations=len(plan),
+        levels=len(levels),
+        critical_path=len(plan.critical_path()),
+    )
+
+    isolate = rollback.scope == "unit"
+    # 每个实体剩余的操作数，归零时记录检查点
+    remaining = Counter(op.unit for op in plan.ops)
+    # 失败或被跳过的操作
+    bad: Set[int] = set()
+    progress = Progress(log, len(remaining), len(plan))
+
+    for depth, level in enumerate(levels):
+        start = time.perf_counter()
+        batch: Optional[NetlinkBatch] = NetlinkBatch() if pipelined else None
+        # 批次中的请求属于哪个计划操作
+        owners: Dict[int, Op] = {}
+        done: List[Op] = []
+
+        # 生成请求（流水线时只加入批次）的Python开销与下面的提交分开计时
+        with span("queue", level=depth):
+            for op in level:
+                if isolate and _skip(rollback, op, bad):
+                    continue
+                TRACER.unit_started(op.unit)
+                queued = len(batch.ops) if batch is not None else 0
+                if not OP_HANDLERS[op.kind](ipr, rollback.scoped(op.unit), op, batch):
+                    log.error(
+                        "Operation {kind} {entity} failed at level {depth}",
+                        entity=op.ifname,
+                        kind=op.kind,
+                        unit=op.unit,
+                        depth=depth,
+                    )
+                    if not isolate:
+                        return False
+                    _fail(rollback, op, bad)
+                    continue
+                if batch is not None:
+                    for batch_op in batch.ops[queued:]:
+                        owners[id(batch_op)] = op
+                done.append(op)
+
+        if batch is not None:
+            with span("batch.run", level=depth, requests=len(batch)):
+                failed = batch.run(ipr)
+            for batch_op in failed:
+                owner = owners[id(batch_op)]
+                log.error(
+                    "Operation at level {depth} failed for {entity}",
+                    entity=batch_op.label,
+                    unit=owner.unit,
+                    op=op_type(batch_op.target, batch_op.command, batch_op.kwarg),
+                    depth=depth,
+                    error=batch_op.error,
+                )
+            # 被内核拒绝的请求（例如接口已存在）没有改动内核，撤销其回滚记录
+            rollback.withdraw(
+                [
+                    record
+                    for batch_op in failed
+                    if isinstance(batch_op.error, NetlinkError)
+                    for record in batch_op.records
+                ]
+            )
+            if failed and not isolate:
+                return False
+            for batch_op in failed:
+                _fail(rollback, owners[id(batch_op)], bad)
+
+        finished = 0
+        for op in done:
+            if op.id in bad:
+                continue
+            remaining[op.unit] -= 1
+            if not remaining[op.unit]:
+                rollback.set_unit_result(op.unit, "ok")
+                rollback.checkpoint(op.unit)
+                TRACER.unit_finished(op.unit, "ok")
+                finished += 1
+
+        log.info(
+            "Level {depth}: {operations} operations in {seconds:.3f}s",
+            depth=depth,
+            operations=len(level),
+            seconds=time.perf_counter() - start,
+        )
+        progress.update(ops=len(level), units=finished)
+        if TRACER.enabled:
+            TRACER.complete(
+                f"level {depth}",
+                start,
+                time.perf_counter(),
+                "phase",
+                {"operations": len(level)},
+            )
+
+    progress.finish()
+    return not bad
+
+
+def _skip(rollback: RollbackManager, op: Op, bad: Set[int]) -> bool:
+    """实体已失败或依赖的操作没有成功时跳过该操作"""
+    if rollback.unit_results.get(op.unit, "ok") != "ok":
+        bad.add(op.id)
+        return True
+    if any(dep.id in bad for dep in op.deps):
+        bad.add(op.id)
+        rollback.set_unit_result(op.unit, "skipped")
+        TRACER.unit_finished(op.unit, "skipped")
+        return True
+    return False
+
+
+def _fail(rollback: RollbackManager, op: Op, bad: Set[int]):
+    bad.add(op.id)
+    rollback.set_unit_result(op.unit, "failed")
+    TRACER.unit_finished(op.unit, "failed")
+
+
+async def _veth_add_async(ipr, rollback, op: Op) -> bool:
+    (in_veth, ext_veth) = await setup_async.create_veth(
+        ipr, rollback, op.ifname, op.args["peer"], master=op.args.get("master", "")
+    )
+    return bool(in_veth and ext_veth)
+
+
+ASYNC_OP_HANDLERS = {
+    "vrf.add": lambda ipr, rollback, op: setup_async.create_vrf(
+        ipr, rollback, op.ifname, op.args["table"]
+    ),
+    "bridge.add": lambda ipr, rollback, op: setup_async.create_bridge(
+        ipr,
+        rollback,
+        op.ifname,
+        master=op.args.get("master", ""),
+        address=op.args.get("address", ""),
+        vlan_filtering=op.args.get("vlan_filtering", False),
+    ),
+    "vxlan.add": lambda ipr, rollback, op: setup_async.create_vxlan_interface(
+        ipr,
+        rollback,
+        op.args["vni"],
+        op.args["local_ip"],
+        master=op.args.get("master", ""),
+    ),
+    "svd.vxlan.add": lambda ipr, rollback, op: setup_async.create_svd_vxlan(
+        ipr,
+        rollback,
+        op.ifname,
+        op.args["local_ip"],
+        master=op.args.get("master", ""),
+    ),
+    "vlan.add": lambda ipr, rollback, op: setup_async.create_vlan_interface(
+        ipr,
+        rollback,
+        op.args["parent"],
+        op.args["vlan_id"],
+        master=op.args.get("master", ""),
+    ),
+    "veth.add": _veth_add_async,
+    "link.up": lambda ipr, rollback, op: setup_async.set_link_up(ipr, op.ifname),
+    "addr.add": lambda ipr, rollback, op: setup_async.assign_ip_address(
+        ipr, rollback, op.ifname, op.args["address"]
+    ),
+    "master.set": lambda ipr, rollback, op: setup_async.set_master(
+        ipr, rollback, op.ifname, op.args["master"]
+    ),
+    "mac.set": lambda ipr, rollback, op: setup_async.set_mac_address(
+        ipr, rollback, op.ifname, op.args["address"]
+    ),
+    "master.unset": lambda ipr, rollback, op: remove_async.unset_master(
+        ipr, rollback, op.ifname, op.args["master"]
+    ),
+    "addr.del": lambda ipr, rollback, op: remove_async.unassign_ip_address(
+        ipr, rollback, op.ifname, op.args["address"]
+    ),
+    "bridge.del": lambda ipr, rollback, op: remove_async.remove_bridge(
+        ipr, rollback, op.ifname
+    ),
+    "vxlan.del": lambda ipr, rollback, op: remove_async.remove_vxlan_interface(
+        ipr, rollback, op.args["vni"]
+    ),
+    "vlan.del": lambda ipr, rollback, op: remove_async.remove_vlan_interface(
+        ipr, rollback, op.args["parent"], op.args["vlan_id"]
+    ),
+    "vrf.del": lambda ipr, rollback, op: remove_async.remove_vrf(
+        ipr, rollback, op.ifname
+    ),
+    "veth.del": lambda ipr, rollback, op: remove_async.remove_veth(
+        ipr, rollback, op.ifname
+    ),
+    "link.del": lambda ipr, rollback, op: remove_async.remove_interface(
+        ipr, rollback, op.ifname
+    ),
+}
+
+
+async def execute_plan_async(
+    ipr, rollback: RollbackManager, plan: Plan, concurrency: int = 64
+) -> bool:
+    """按依赖并发执行计划
+
+    每个操作是一个task，在其依赖全部成功后立即开始，不等待整层完成，
+    因此不同VRF/VNI的工作互相交错；同时在途的请求数由信号量限制。
+    出现失败后不再发出新的请求，已在途的请求照常完成；rollback.scope为
+    "unit"时只停止失败的实体和依赖它的操作。
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    isolate = rollback.scope == "unit"
+    remaining = Counter(op.unit for op in plan.ops)
+    tasks: Dict[int, asyncio.Task] = {}
+    bad: Set[int] = set()
+    start = time.perf_counter()
+    progress = Progress(log, len(remaining), len(plan))
+
+    async def run(op: Op) -> bool:
+        for dep in op.deps:
+            if not await tasks[dep.id]:
+                if isolate:
+                    _skip(rollback, op, bad)
+                return False
+        if (bad and not isolate) or (isolate and _skip(rollback, op, bad)):
+            return False
+        TRACER.unit_started(op.unit)
+        async with semaphore:
+            ok = bool(
+                await ASYNC_OP_HANDLERS[op.kind](ipr, rollback.scoped(op.unit), op)
+            )
+        if not ok:
+            log.error(
+                "Operation {kind} {entity} failed",
+                entity=op.ifname,
+                kind=op.kind,
+                unit=op.unit,
+            )
+            _fail(rollback, op, bad)
+            progress.update(ops=1)
+            return False
+        remaining[op.unit] -= 1
+        if not remaining[op.unit]:
+            rollback.set_unit_result(op.unit, "ok")
+            rollback.checkpoint(op.unit)
+            TRACER.unit_finished(op.unit, "ok")
+        progress.update(ops=1, units=int(not remaining[op.unit]))
+        return True
+
+    log.info(
+        "Executing plan: {operations} operations, "
+        "up to {concurrency} concurrent requests",
+        operations=len(plan),
+        concurrency=concurrency,
+    )
+    for op in plan.ops:
+        tasks[op.id] = asyncio.create_task(run(op))
+    await asyncio.gather(*tasks.values())
+
+    progress.finish()
+    log.info("Plan finished in {seconds:.3f}s", seconds=time.perf_counter() - start)
+    return not bad
@@ -0,0 +1,626 @@
+"""内存中模拟的netlink后端，不需要root和CAP_NET_ADMIN
+
+FakeIPRoute/FakeAsyncIPRoute实现本项目用到的IPRoute/AsyncIPRoute子集：
+link add/set/del、link_lookup、get_links、addr add/del、get_addr和vlan_filter，
+以及NetlinkBatch使用的asyncore流水线接口。common.iproute2提交的命令（SVD模式
+的ip link add ... external vnifilter和bridge -batch）由iproute2()转换为同一个
+内核上的请求：VXLAN设备的创建、VNI过滤表项（vni.add/vni.del）和桥接端口
+选项（brport.set）。多个实例可以共享同一个FakeKernel，就像多个netlink
+socket面对同一个网络命名空间。
+
+语义与内核一致的部分：
+    - 接口名重复返回EEXIST，超过IFNAMSIZ-1个字符返回EINVAL
+    - ifindex、master、父接口（IFLA_LINK）不存在返回ENODEV
+    - 同一端口上重复的VXLAN VNI返回EEXIST，重复的地址返回EEXIST，
+      删除不存在的地址返回EADDRNOTAVAIL
+    - VNI过滤表项只能加在开启vnifilter的VXLAN设备上，桥接端口选项只能
+      设在桥接的端口上，否则返回EOPNOTSUPP
+    - 删除接口时连带删除veth对端和其上的VLAN子接口、其上的地址，
+      以它为master的接口被释放；按接口组删除
+    - 不支持的接口类型返回EOPNOTSUPP
+
+latency为每次请求的往返延迟（秒）：同步调用逐个等待，流水线批次和async
+引擎的并发请求的延迟互相重叠，可以用来比较不同执行器的表现。kernel.round_trips
+按同样的方式计数往返次数；kernel.journal不为None时记录每个请求（见
+common/dry_run.py）。
+
+    kernel = FakeKernel()
+    with FakeIPRoute(kernel, latency=0.0001) as ipr:
+        configure_vxlan_bgp_evpn_distribute_sdr(conf, rollback, ipr=ipr)
+"""
+
+import os
+import time
+import errno
+import asyncio
+from typing import Dict, List, Optional, Set
+from pyroute2.netlink.exceptions import NetlinkError
+from common.metrics import op_type
+
+IFNAMSIZ = 16
+IFF_UP = 0x1
+AF_INET = 2
+AF_INET6 = 10
+VXLAN_PORT = 4789
+KINDS = ("bridge", "vrf", "vxlan", "vlan", "veth", "dummy")
+
+
+class FakeMessage(dict):
+    """模拟pyroute2的netlink消息：get()支持("linkinfo", "kind")形式的路径"""
+
+    def get(self, key, default=None):
+        if not isinstance(key, tuple):
+            return super().get(key, default)
+        value = self
+        for k in key:
+            if not isinstance(value, dict) or k not in value:
+                return default
+            value = value[k]
+        return value
+
+
+class FakeLink:
+    __slots__ = (
+        "index",
+        "ifname",
+        "kind",
+        "data",
+        "master",
+        "link",
+        "address",
+        "flags",
+        "group",
+    )
+
+    def __init__(self, index: int, ifname: str, kind: Optional[str], data: dict):
+        self.index = index
+        self.ifname = ifname
+        self.kind = kind
+        self.data = data
+        self.master = 0
+        self.link = 0
+        # 按ifindex生成的本地管理MAC地址
+        self.address = "02:fa:00:" + ":".join(
+            f"{index >> shift & 255:02x}" for shift in (16, 8, 0)
+        )
+        self.flags = 0
+        self.group = 0
+
+    def message(self, event: str = "RTM_NEWLINK") -> FakeMessage:
+        return FakeMessage(
+            event=event,
+            index=self.index,
+            ifname=self.ifname,
+            flags=self.flags,
+            master=self.master,
+            link=self.link,
+            address=self.address,
+            group=self.group,
+            linkinfo={"kind": self.kind, "data": dict(self.data)},
+            attrs=[["IFLA_IFNAME", self.ifname], ["IFLA_ADDRESS", self.address]],
+        )
+
+
+def _error(code: int, message: str = ""):
+    return NetlinkError(code, message or os.strerror(code))
+
+
+class FakeKernel:
+    """一个网络命名空间的接口和地址"""
+
+    def __init__(self):
+        self.links: Dict[int, FakeLink] = {}
+        self.names: Dict[str, int] = {}
+        # ifindex -> {(地址, 前缀长度)}
+        self.addrs: Dict[int, Set[tuple]] = {}
+        # 反向索引，使级联删除和VNI查重不必扫描全部接口
+        self.children: Dict[int, Set[int]] = {}
+        self.slaves: Dict[int, Set[int]] = {}
+        self.vnis: Dict[tuple, int] = {}
+        self.next_index = 1
+        self.requests = 0
+        self.round_trips = 0
+        # 累计删除的接口数，包括级联删除的
+        self.removed = 0
+        # 不为None时记录每个请求：操作类型、接口名、参数、所在的往返和错误
+        self.journal: Optional[List[dict]] = None
+        self._add("lo", None, {}).flags |= IFF_UP
+
+    @classmethod
+    def from_snapshot(cls, snapshot) -> "FakeKernel":
+        """复制common.reconcile.KernelSnapshot中的接口和地址，保留原有的ifindex"""
+        kernel = cls()
+        states = sorted(snapshot.links.values(), key=lambda s: s.index)
+        for state in states:
+            if state.ifname in kernel.names:
+                continue
+            kernel.next_index = state.index
+            link = kernel._add(state.ifname, state.kind, dict(state.attrs))
+            link.address = state.address or link.address
+            link.flags = IFF_UP if state.up else 0
+            for ip in state.addrs:
+                (address, mask) = ip.split("/")
+                kernel.addrs[link.index].add((address, int(mask)))
+            if link.kind == "vxlan":
+                kernel.vnis[kernel._vni_key(link.data)] = link.index
+        # master和父接口可能是其他类型的设备或位于其他命名空间，原样复制
+        for state in states:
+            link = kernel.links.get(state.index)
+            if link is None or link.ifname != state.ifname:
+                continue
+            if state.master in kernel.links:
+                link.master = state.master
+                kernel.slaves[state.master].add(link.index)
+            if state.link in kernel.links:
+                kernel._set_link(link, state.link)
+            else:
+                link.link = state.link
+        kernel.next_index = max(kernel.links) + 1
+        return kernel
+
+    def request(self, method: str, *args, **kwarg):
+        """执行一个请求；开启journal时记录它"""
+        self.requests += 1
+        if self.journal is None:
+            return getattr(self, method)(*args, **kwarg)
+        entry = self._describe(method, args[0] if args else None, kwarg)
+        removed = self.removed
+        try:
+            return getattr(self, method)(*args, **kwarg)
+        except NetlinkError as e:
+            entry["error"] = errno.errorcode.get(e.code, str(e.code))
+            raise
+        finally:
+            entry["removed"] = self.removed - removed
+            self.journal.append(entry)
+
+    def _describe(self, method: str, command: Optional[str], kwarg: dict) -> dict:
+        """请求的操作类型、目标接口名和其余参数，ifindex换成接口名"""
+        target = self.links.get(kwarg.get("index"))
+        args = {}
+        for (key, value) in kwarg.items():
+            if key in ("index", "ifname"):
+                continue
+            if key in ("master", "link") and value in self.links:
+                value = self.links[value].ifname
+            args[key] = value
+        return {
+            "op": op_type(method, command, kwarg),
+            "entity": kwarg.get("ifname") or (target.ifname if target else ""),
+            "args": args,
+            "round_trip": self.round_trips,
+        }
+
+    def _get(self, index) -> FakeLink:
+        link = self.links.get(index)
+        if link is None:
+            raise _error(errno.ENODEV)
+        return link
+
+    def _lookup(self, kwarg: dict) -> FakeLink:
+        if kwarg.get("index"):
+            return self._get(kwarg["index"])
+        if kwarg.get("ifname") in self.names:
+            return self.links[self.names[kwarg["ifname"]]]
+        raise _error(errno.ENODEV)
+
+    def _check_name(self, ifname: Optional[str]):
+        if not ifname or len(ifname) >= IFNAMSIZ or "/" in ifname:
+            raise _error(errno.EINVAL, "Attribute failed policy validation")
+        if ifname in self.names:
+            raise _error(errno.EEXIST)
+
+    def _add(self, ifname: str, kind: Optional[str], data: dict) -> FakeLink:
+        link = FakeLink(self.next_index, ifname, kind, data)
+        self.next_index += 1
+        self.links[link.index] = link
+        self.names[ifname] = link.index
+        self.addrs[link.index] = set()
+        self.children[link.index] = set()
+        self.slaves[link.index] = set()
+        return link
+
+    def _set_link(self, link: FakeLink, parent: int):
+        link.link = parent
+        self.children[parent].add(link.index)
+
+    def _set_master(self, link: FakeLink, master: int):
+        if master:
+            if self._get(master).kind not in ("bridge", "vrf") or master == link.index:
+                raise _error(errno.EOPNOTSUPP)
+        if link.master:
+            self.slaves[link.master].discard(link.index)
+        link.master = master
+        if master:
+            self.slaves[master].add(link.index)
+
+    def _apply(self, link: FakeLink, kwarg: dict):
+        """add和set共有的属性"""
+        if "master" in kwarg:
+            self._set_master(link, kwarg["master"])
+        if kwarg.get("address"):
+            link.address = kwarg["address"].lower()
+        if "group" in kwarg:
+            link.group = kwarg["group"]
+        if kwarg.get("state") == "up":
+            link.flags |= IFF_UP
+        elif kwarg.get("state") == "down":
+            link.flags &= ~IFF_UP
+
+    def _remove(self, link: FakeLink, removed: List[FakeLink]):
+        if link.index not in self.links:
+            return
+        del self.links[link.index]
+        del self.names[link.ifname]
+        del self.addrs[link.index]
+        removed.append(link)
+        self.removed += 1
+        if link.master in self.slaves:
+            self.slaves[link.master].discard(link.index)
+        if link.kind == "vxlan":
+            self.vnis.pop(self._vni_key(link.data), None)
+        for idx in self.slaves.pop(link.index):
+            self.links[idx].master = 0
+        # veth对端和VLAN子接口随之删除（veth两端的IFLA_LINK互相指向）
+        for idx in self.children.pop(link.index):
+            if idx in self.links:
+                self._remove(self.links[idx], removed)
+
+    @staticmethod
+    def _vni_key(data: dict) -> tuple:
+        return (data.get("vxlan_id"), data.get("vxlan_port", VXLAN_PORT))
+
+    def link(self, command: str, **kwarg) -> List[FakeMessage]:
+        if command == "add":
+            return self._link_add(kwarg)
+        if command == "set":
+            link = self._lookup(kwarg)
+            self._apply(link, kwarg)
+            return []
+        if command in ("del", "delete", "remove"):
+            removed: List[FakeLink] = []
+            if "group" in kwarg and not kwarg.get("index"):
+                group = [
+                    link for link in self.links.values() if link.group == kwarg["group"]
+                ]
+                for link in group:
+                    self._remove(link, removed)
+            else:
+                self._remove(self._lookup(kwarg), removed)
+            return []
+        raise _error(errno.EOPNOTSUPP)
+
+    def _link_add(self, kwarg: dict) -> List[FakeMessage]:
+        ifname = kwarg.get("ifname")
+        kind = kwarg.get("kind")
+        self._check_name(ifname)
+        if kind not in KINDS:
+            raise _error(errno.EOPNOTSUPP)
+        if kwarg.get("master"):
+            self._get(kwarg["master"])
+
+        data = {k: v for (k, v) in kwarg.items() if k.startswith(kind + "_")}
+        parent = 0
+        peer = None
+        if kind == "vlan":
+            parent = self._get(kwarg.get("link")).index
+            data["vlan_id"] = kwarg.get("vlan_id")
+        elif kind == "vxlan":
+            if self._vni_key(data) in self.vnis:
+                raise _error(errno.EEXIST)
+        elif kind == "veth":
+            peer = kwarg.get("peer")
+            if isinstance(peer, dict):
+                peer = peer.get("ifname")
+            self._check_name(peer)
+            if peer == ifname:
+                raise _error(errno.EEXIST)
+
+        link = self._add(ifname, kind, data)
+        if parent:
+            self._set_link(link, parent)
+        if kind == "vxlan":
+            self.vnis[self._vni_key(data)] = link.index
+        if peer is not None:
+            # 对端不继承IFF_UP和master
+            other = self._add(peer, "veth", {})
+            self._set_link(link, other.index)
+            self._set_link(other, link.index)
+        self._apply(link, kwarg)
+        return [link.message()]
+
+    def addr(self, command: str, index: int = 0, address: str = "", mask: int = 0):
+        entries = self.addrs.get(index)
+        if entries is None:
+            raise _error(errno.ENODEV)
+        key = (address, mask)
+        if command == "add":
+            if key in entries:
+                raise _error(errno.EEXIST)
+            entries.add(key)
+        elif command in ("del", "delete", "remove"):
+            if key not in entries:
+                raise _error(errno.EADDRNOTAVAIL)
+            entries.remove(key)
+        else:
+            raise _error(errno.EOPNOTSUPP)
+        return []
+
+    def vlan_filter(self, command: str, index: int = 0, **kwarg):
+        link = self._get(index)
+        if link.kind != "bridge" and not link.master:
+            raise _error(errno.EOPNOTSUPP)
+        return []
+
+    def vni_filter(self, command: str, index: int = 0, **kwarg):
+        link = self._get(index)
+        if link.kind != "vxlan" or not link.data.get("vxlan_vnifilter"):
+            raise _error(errno.EOPNOTSUPP)
+        return []
+
+    def brport(self, command: str, index: int = 0, **kwarg):
+        link = self._get(index)
+        if not link.master or self.links[link.master].kind != "bridge":
+            raise _error(errno.EOPNOTSUPP)
+        return []
+
+    def link_lookup(self, ifname: Optional[str] = None, **kwarg) -> List[int]:
+        return [self.names[ifname]] if ifname in self.names else []
+
+    def get_links(self) -> List[FakeMessage]:
+        return [link.message() for link in self.links.values()]
+
+    def get_addr(self, index: Optional[int] = None, **kwarg) -> List[FakeMessage]:
+        msgs = []
+        for idx, entries in self.addrs.items():
+            if index is not None and idx != index:
+                continue
+            for (address, mask) in sorted(entries):
+                family = AF_INET6 if ":" in address else AF_INET
+                msgs.append(
+                    FakeMessage(
+                        event="RTM_NEWADDR",
+                        index=idx,
+                        family=family,
+                        prefixlen=mask,
+                        address=address,
+                        attrs=[["IFA_ADDRESS", address]],
+                    )
+                )
+        return msgs
+
+
+# ip link add ... type vxlan的选项 -> (属性, 带值的选项为值的类型，否则为属性的取值)
+VXLAN_OPTIONS = {
+    "local": ("vxlan_local", str),
+    "dstport": ("vxlan_port", int),
+    "ttl": ("vxlan_ttl", int),
+    "external": ("vxlan_collect_metadata", 1),
+    "vnifilter": ("vxlan_vnifilter", 1),
+    "nolearning": ("vxlan_learning", 0),
+}
+# bridge link set的端口选项
+BRPORT_OPTIONS = ("vlan_tunnel", "neigh_suppress", "learning")
+
+
+class CommandSyntaxError(ValueError):
+    """模拟的iproute2不支持的命令"""
+
+
+def _ip_request(argv: List[str]) -> tuple:
+    """ip link add NAME type vxlan ...对应的(方法, 命令, 参数)"""
+    if argv[1:3] != ["link", "add"] or argv[4:6] != ["type", "vxlan"]:
+        raise CommandSyntaxError(" ".join(argv))
+    kwarg = {"ifname": argv[3], "kind": "vxlan"}
+    words = iter(argv[6:])
+    for word in words:
+        if word not in VXLAN_OPTIONS:
+            raise CommandSyntaxError(f'Unknown argument "{word}"')
+        (key, value) = VXLAN_OPTIONS[word]
+        kwarg[key] = value(next(words)) if callable(value) else value
+    return ("link", "add", kwarg)
+
+
+def _bridge_request(line: str, names: Dict[str, int]) -> tuple:
+    """bridge -batch的一行对应的(方法, 命令, 参数)：vni add/delete或link set"""
+    words = line.split()
+    fields = dict(zip(words[2::2], words[3::2]))
+    dev = fields.pop("dev", None)
+    if dev not in names:
+        raise CommandSyntaxError(f'Cannot find device "{dev}"')
+    kwarg = {"index": names[dev]}
+    if words[:2] in (["vni", "add"], ["vni", "delete"]) and set(fields) == {"vni"}:
+        (first, _, last) = fields["vni"].partition("-")
+        kwarg.update(vni=int(first), vni_end=int(last or first))
+        return ("vni_filter", "add" if words[1] == "add" else "del", kwarg)
+    if words[:2] == ["link", "set"] and set(fields) <= set(BRPORT_OPTIONS):
+        kwarg.update((key, int(value == "on")) for (key, value) in fields.items())
+        return ("brport", "set", kwarg)
+    raise CommandSyntaxError(f'Command "{line}" is unknown')
+
+
+def _round_trip(owner):
+    """事件循环的同一轮中发出的请求一起发送，共用一次往返"""
+    if not owner._in_flight:
+        owner.kernel.round_trips += 1
+        owner._in_flight = True
+        asyncio.get_running_loop().call_soon(setattr, owner, "_in_flight", False)
+
+
+class _FakeCore:
+    """FakeIPRoute.asyncore：NetlinkBatch在其事件循环上并发提交请求"""
+
+    def __init__(self, ipr: "FakeIPRoute"):
+        self.ipr = ipr
+        self.kernel = ipr.kernel
+        self.event_loop = asyncio.new_event_loop()
+        self._in_flight = False
+
+    async def _call(self, method: str, *args, **kwarg):
+        # 内核在发送时处理请求，延迟是等待回复的时间；
+        # latency为0时也让出一次，使并发的请求落在同一轮中
+        _round_trip(self)
+        result = self.ipr._call(method, *args, **kwarg)
+        await asyncio.sleep(self.ipr.latency)
+        return result
+
+    async def link(self, command, **kwarg):
+        return await self._call("link", command, **kwarg)
+
+    async def addr(self, command, **kwarg):
+        return await self._call("addr", command, **kwarg)
+
+    async def vlan_filter(self, command, **kwarg):
+        return await self._call("vlan_filter", command, **kwarg)
+
+
+class FakeIPRoute:
+    """IPRoute的替身，所有请求作用于kernel"""
+
+    def __init__(
+        self,
+        kernel: Optional[FakeKernel] = None,
+        latency: float = 0.0,
+        nlm_echo: bool = False,
+    ):
+        self.kernel = kernel if kernel is not None else FakeKernel()
+        self.latency = latency
+        self.nlm_echo = nlm_echo
+        self._core: Optional[_FakeCore] = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @property
+    def asyncore(self) -> _FakeCore:
+        if self._core is None:
+            self._core = _FakeCore(self)
+        return self._core
+
+    def close(self):
+        if self._core is not None:
+            self._core.event_loop.close()
+            self._core = None
+
+    def _call(self, method: str, *args, **kwarg):
+        result = self.kernel.request(method, *args, **kwarg)
+        # 未开启nlm_echo时add的回复只有ACK，不携带新接口
+        if method == "link" and not self.nlm_echo:
+            return []
+        return result
+
+    def _sync(self, method: str, *args, **kwarg):
+        self.kernel.round_trips += 1
+        result = self._call(method, *args, **kwarg)
+        if self.latency:
+            time.sleep(self.latency)
+        return result
+
+    def link(self, command, **kwarg):
+        return self._sync("link", command, **kwarg)
+
+    def addr(self, command, **kwarg):
+        return self._sync("addr", command, **kwarg)
+
+    def vlan_filter(self, command, **kwarg):
+        return self._sync("vlan_filter", command, **kwarg)
+
+    def link_lookup(self, match=None, **kwarg) -> List[int]:
+        return self._sync("link_lookup", **kwarg)
+
+    def get_links(self, *argv, **kwarg):
+        return iter(self._sync("get_links"))
+
+    def get_addr(self, **kwarg):
+        return iter(self._sync("get_addr", **kwarg))
+
+    def iproute2(self, argv: List[str], input: str = "") -> tuple:
+        """模拟common.iproute2的命令，返回(退出状态, 标准错误)
+
+        bridge -batch逐行执行，出错时停止；-force时继续执行其余的行。
+        """
+        if argv[0] == "ip":
+            try:
+                (method, command, kwarg) = _ip_request(argv)
+                self._sync(method, command, **kwarg)
+            except CommandSyntaxError as e:
+                return (255, f"{e}\n")
+            except NetlinkError as e:
+                return (2, f"RTNETLINK answers: {e.args[1]}\n")
+            return (0, "")
+        errors = []
+        for (lineno, line) in enumerate(input.splitlines(), 1):
+            if not line.strip():
+                continue
+            try:
+                (method, command, kwarg) = _bridge_request(line, self.kernel.names)
+                self._sync(method, command, **kwarg)
+            except (CommandSyntaxError, NetlinkError) as e:
+                message = e.args[1] if isinstance(e, NetlinkError) else e
+                errors.append(f"{message}\nCommand failed -:{lineno}")
+                if "-force" not in argv:
+                    break
+        return (1 if errors else 0, "".join(f"{e}\n" for e in errors))
+
+
+async def _aiter(items):
+    for item in items:
+        yield item
+
+
+class FakeAsyncIPRoute:
+    """AsyncIPRoute的替身；并发请求的延迟互相重叠"""
+
+    def __init__(
+        self,
+        kernel: Optional[FakeKernel] = None,
+        latency: float = 0.0,
+        nlm_echo: bool = False,
+    ):
+        self.sync = FakeIPRoute(kernel, 0.0, nlm_echo)
+        self.kernel = self.sync.kernel
+        self.latency = latency
+        self._in_flight = False
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self.sync.close()
+
+    async def _call(self, method: str, *args, **kwarg):
+        _round_trip(self)
+        result = self.sync._call(method, *args, **kwarg)
+        await asyncio.sleep(self.latency)
+        return result
+
+    async def link(self, command, **kwarg):
+        return await self._call("link", command, **kwarg)
+
+    async def addr(self, command, **kwarg):
+        return await self._call("addr", command, **kwarg)
+
+    async def vlan_filter(self, command, **kwarg):
+        return await self._call("vlan_filter", command, **kwarg)
+
+    async def link_lookup(self, match=None, **kwarg) -> List[int]:
+        return await self._call("link_lookup", **kwarg)
+
+    async def get_links(self, *argv, **kwarg):
+        return _aiter(await self._call("get_links"))
+
+    async def get_addr(self, **kwarg):
+        return _aiter(await self._call("get_addr", **kwarg))
+
+    async def iproute2(self, argv: List[str], input: str = "") -> tuple:
+        # 命令在一个进程中逐个发出请求，每个请求等待一次往返
+        requests = self.kernel.requests
+        result = self.sync.iproute2(argv, input)
+        await asyncio.sleep(self.latency * (self.kernel.requests - requests))
+        return result
@@ -0,0 +1,52 @@
+import os
+import hashlib
+from typing import Iterable, Optional
+from common.types import CompiledConf
+
+# 快速路径只依赖sysfs：不打开netlink socket，也不导入pyroute2
+SYS_CLASS_NET = "/sys/class/net"
+
+IFF_UP = 0x1
+
+
+def _read(path: str) -> str:
+    with open(path) as f:
+        return f.read().strip()
+
+
+def kernel_marker(ifnames: Iterable[str]) -> Optional[str]:
+    """内核状态标记：接口总数，加上每个受管接口的ifindex、master和IFF_UP
+
+    接口被删除重建（ifindex变化）、脱离master、被关闭，或者增删了其他接口，
+    标记都会改变。sysfs不可用时返回None，此时不能走快速路径。
+    """
+    try:
+        count = len(os.listdir(SYS_CLASS_NET))
+    except OSError:
+        return None
+
+    h = hashlib.blake2b(digest_size=16)
+    h.update(f"{count}\n".encode())
+    for ifname in ifnames:
+        path = os.path.join(SYS_CLASS_NET, ifname)
+        try:
+            ifindex = _read(os.path.join(path, "ifindex"))
+            up = int(_read(os.path.join(path, "flags")), 16) & IFF_UP
+        except (OSError, ValueError):
+            (ifindex, up) = ("-", 0)
+        try:
+            master = os.path.basename(os.readlink(os.path.join(path, "master")))
+        except OSError:
+            master = ""
+        h.update(f"{ifname}:{ifindex}:{master}:{up}\n".encode())
+    return h.hexdigest()
+
+
+def is_unchanged(conf: CompiledConf, last_state: Optional[dict]) -> bool:
+    """配置摘要与上次成功的状态一致，且内核标记未变时，本次运行无需任何操作"""
+    if not last_state or not last_state.get("success", False):
+        return False
+    if last_state.get("digests", {}).get("config") != conf.digest:
+        return False
+    marker = last_state.get("kernel_marker")
+    return marker is not None and marker == kernel_marker(conf.ifnames())
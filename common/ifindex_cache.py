@@ -0,0 +1,178 @@
+from typing import Dict, List, Optional, Set
+from pyroute2 import AsyncIPRoute, IPRoute
+
+
+class IfIndexCache:
+    """接口名到ifindex的缓存
+
+    包装IPRoute：启动时通过一次RTM_GETLINK dump填充，之后根据本进程
+    add/del请求的回复同步更新，link_lookup(ifname=...)命中缓存时不再访问内核。
+    其他方法原样转发给被包装的IPRoute。
+    """
+
+    def __init__(self, ipr: IPRoute):
+        self.ipr = ipr
+        self.index: Dict[str, int] = {}
+        self.names: Dict[int, str] = {}
+        # ifindex -> IFLA_LINK（veth对端、VLAN父接口），用于处理内核的级联删除
+        self.links: Dict[int, int] = {}
+        # links的反向索引：ifindex -> 以它为IFLA_LINK的接口
+        self.lowers: Dict[int, Set[int]] = {}
+        # 缓存中状态未知的接口名，查询时必须回源内核
+        self.unresolved: Set[str] = set()
+        self.complete = False
+        self.hits = 0
+        self.misses = 0
+
+    def __getattr__(self, name):
+        return getattr(self.ipr, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self.ipr.close()
+
+    def seed(self, links=None) -> "IfIndexCache":
+        """通过一次link dump初始化缓存；传入已有的dump结果时不再重复dump"""
+        self._load(self.ipr.get_links() if links is None else links)
+        return self
+
+    def _load(self, links):
+        self.index.clear()
+        self.names.clear()
+        self.links.clear()
+        self.lowers.clear()
+        self.unresolved.clear()
+        for link in links:
+            self._store(link)
+        self.complete = True
+
+    def _store(self, msg):
+        ifname = msg.get("ifname")
+        index = msg.get("index")
+        if not ifname or not index:
+            return
+        self.index[ifname] = index
+        self.names[index] = ifname
+        if msg.get("link"):
+            self._unlink(index)
+            self.links[index] = msg.get("link")
+            self.lowers.setdefault(msg.get("link"), set()).add(index)
+        self.unresolved.discard(ifname)
+
+    def _unlink(self, index: int) -> Optional[int]:
+        """删除index的IFLA_LINK及其反向索引，返回原来的IFLA_LINK"""
+        link = self.links.pop(index, None)
+        if link is not None:
+            lowers = self.lowers.get(link)
+            lowers.discard(index)
+            if not lowers:
+                del self.lowers[link]
+        return link
+
+    def _forget(self, index: int):
+        ifname = self.names.pop(index, None)
+        if ifname is not None:
+            self.index.pop(ifname, None)
+        # 删除接口会连带删除veth对端和其上的VLAN子接口，这些名字交给内核确认
+        related = list(self.lowers.get(index, ()))
+        link = self._unlink(index)
+        if link is not None:
+            related.append(link)
+        for idx in related:
+            self._unlink(idx)
+            name = self.names.pop(idx, None)
+            if name is not None:
+                self.index.pop(name, None)
+                self.unresolved.add(name)
+
+    def _cached(self, ifname: str) -> Optional[List[int]]:
+        if ifname in self.index:
+            self.hits += 1
+            return [self.index[ifname]]
+        if self.complete and ifname not in self.unresolved:
+            self.hits += 1
+            return []
+        self.misses += 1
+        return None
+
+    def _remember(self, ifname: str, result: List[int]):
+        self.unresolved.discard(ifname)
+        if result:
+            self.index[ifname] = result[0]
+            self.names[result[0]] = ifname
+
+    def link_lookup(self, match=None, **kwarg) -> List[int]:
+        ifname = kwarg.get("ifname")
+        if match is not None or ifname is None or len(kwarg) != 1:
+            return self.ipr.link_lookup(match, **kwarg)
+
+        result = self._cached(ifname)
+        if result is None:
+            result = self.ipr.link_lookup(ifname=ifname)
+            self._remember(ifname, result)
+        return result
+
+    def link(self, command, **kwarg):
+        result = self.ipr.link(command, **kwarg)
+        self.update(command, kwarg, result)
+        return result
+
+    def update(self, command: str, kwarg: dict, result):
+        """根据一次link请求及其回复更新缓存"""
+        if command == "add":
+            for msg in result or []:
+                if msg.get("event") == "RTM_NEWLINK":
+                    self._store(msg)
+            # 未开启nlm_echo时回复中没有ifindex，下次查询回源
+            if kwarg.get("ifname") not in self.index:
+                self.unresolved.add(kwarg.get("ifname"))
+            peer = kwarg.get("peer")
+            if isinstance(peer, dict):
+                peer = peer.get("ifname")
+            if peer:
+                self.unresolved.add(peer)
+        elif command in ("del", "delete", "remove"):
+            index = kwarg.get("index")
+            if index is None and kwarg.get("ifname") in self.index:
+                index = self.index[kwarg["ifname"]]
+            if index is not None:
+                self._forget(index)
+            elif kwarg.get("ifname"):
+                self.unresolved.add(kwarg["ifname"])
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "cached": len(self.index)}
+
+
+class AsyncIfIndexCache(IfIndexCache):
+    """IfIndexCache的asyncio版本，包装AsyncIPRoute"""
+
+    def __init__(self, ipr: AsyncIPRoute):
+        super().__init__(ipr)
+
+    async def seed(self, links=None) -> "AsyncIfIndexCache":
+        if links is None:
+            links = [link async for link in await self.ipr.get_links()]
+        self._load(links)
+        return self
+
+    async def link_lookup(self, match=None, **kwarg) -> List[int]:
+        ifname = kwarg.get("ifname")
+        if match is not None or ifname is None or len(kwarg) != 1:
+            return await self.ipr.link_lookup(match, **kwarg)
+
+        result = self._cached(ifname)
+        if result is None:
+            result = await self.ipr.link_lookup(ifname=ifname)
+            self._remember(ifname, result)
+        return result
+
+    async def link(self, command, **kwarg):
+        result = await self.ipr.link(command, **kwarg)
+        self.update(command, kwarg, result)
+        return result
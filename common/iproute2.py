@@ -0,0 +1,69 @@
+"""pyroute2没有对应接口的配置经由iproute2命令（ip、bridge）提交
+
+vnifilter的VXLAN设备、VNI过滤表项和桥接端口选项由iproute2命令完成。命令
+不直接启动子进程，而是交给传入的IPRoute：提供iproute2(argv, input)方法的
+对象（common.fake_iproute的替身）自行执行，把每条命令转换为模拟内核上的
+请求；普通的IPRoute/AsyncIPRoute没有这个方法，命令在子进程中执行。启用
+统计或追踪时每条命令按操作类型（ip.link.add、bridge.batch）计时，与
+common.metrics中的netlink请求一起输出。
+"""
+
+import time
+import asyncio
+import subprocess
+from typing import List, Tuple
+from common.metrics import METRICS, observe
+from common.trace import TRACER
+
+
+class CommandError(Exception):
+    """iproute2命令以非0状态退出"""
+
+    def __init__(self, returncode: int, stderr: str):
+        super().__init__(stderr.strip() or f"exit status {returncode}")
+        self.returncode = returncode
+
+
+def command_op(argv: List[str]) -> str:
+    """命令的操作类型：bridge -batch为bridge.batch，其余取前三个词"""
+    if argv[0] == "bridge" and "-batch" in argv:
+        return "bridge.batch"
+    return ".".join(argv[:3])
+
+
+def _observe(argv: List[str], start: float, returncode: int, stderr: str):
+    if METRICS.enabled or TRACER.enabled:
+        error = CommandError(returncode, stderr) if returncode else None
+        observe(METRICS, command_op(argv), start, error)
+
+
+def run(ipr, argv: List[str], input: str = "") -> Tuple[int, str]:
+    """执行iproute2命令，input为标准输入；返回(退出状态, 标准错误)"""
+    start = time.perf_counter()
+    runner = getattr(ipr, "iproute2", None)
+    if runner is not None:
+        (returncode, stderr) = runner(argv, input)
+    else:
+        proc = subprocess.run(argv, input=input, capture_output=True, text=True)
+        (returncode, stderr) = (proc.returncode, proc.stderr)
+    _observe(argv, start, returncode, stderr)
+    return (returncode, stderr)
+
+
+async def run_async(ipr, argv: List[str], input: str = "") -> Tuple[int, str]:
+    """run()的asyncio版本"""
+    start = time.perf_counter()
+    runner = getattr(ipr, "iproute2", None)
+    if runner is not None:
+        (returncode, stderr) = await runner(argv, input)
+    else:
+        proc = await asyncio.create_subprocess_exec(
+            *argv,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.PIPE,
+        )
+        (_, err) = await proc.communicate(input.encode())
+        (returncode, stderr) = (proc.returncode, err.decode())
+    _observe(argv, start, returncode, stderr)
+    return (returncode, stderr)
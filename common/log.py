@@ -0,0 +1,156 @@
+"""带级别的结构化日志
+
+每条记录是一个消息模板加上字段，只有在级别开启时才格式化：
+
+    log.debug("Creating bridge {entity}", entity=name)
+    log.error("Failed to create bridge {entity}", entity=name, op="bridge.add", error=e)
+
+error参数展开为errno（NetlinkError.code或OSError.errno的名称）和error（错误
+信息）字段。text格式输出为一行文本，警告和错误带"Warning: "/"Error: "前缀；
+json格式每行一个JSON对象，包含全部字段，便于journald之后按实体或errno检索。
+
+默认级别为info：每个操作一行的记录是debug级别，大规模配置时不再刷屏。
+输出先写入缓冲区，满buffer_lines行、出现错误、输出进度行或进程退出时
+一次写出；进程被强制杀死时丢失的只是日志，操作记录仍在操作日志中。
+"""
+
+import os
+import sys
+import json
+import time
+import errno
+import atexit
+from typing import List, Optional
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+
+LEVELS = {"debug": DEBUG, "info": INFO, "warning": WARNING, "error": ERROR}
+LEVEL_NAMES = {v: k for (k, v) in LEVELS.items()}
+TEXT_PREFIX = {WARNING: "Warning: ", ERROR: "Error: "}
+
+
+def error_fields(error) -> dict:
+    """异常的结构化字段：errno名称和错误信息"""
+    if isinstance(error, str):
+        return {"error": error}
+    code = getattr(error, "code", None)
+    if not isinstance(code, int):
+        code = getattr(error, "errno", None)
+    if isinstance(code, int) and code > 0:
+        return {
+            "errno": errno.errorcode.get(code, str(code)),
+            "error": os.strerror(code),
+        }
+    return {"error": str(error) or type(error).__name__}
+
+
+class Logger:
+    def __init__(self, level: int = INFO, fmt: str = "text", buffer_lines: int = 256):
+        self.level = level
+        self.fmt = fmt
+        self.buffer_lines = buffer_lines
+        # json格式时加入每条记录的字段
+        self.context: dict = {}
+        self._buffer: List[str] = []
+
+    def configure(
+        self, level: str = "info", fmt: str = "text", netns: Optional[str] = None
+    ):
+        self.level = LEVELS[level]
+        self.fmt = fmt
+        self.context = {"netns": netns} if netns else {}
+
+    def log(self, level: int, msg: str, error=None, **fields):
+        if level < self.level:
+            return
+        if error is not None:
+            fields.update(error_fields(error))
+        text = msg.format(**fields) if fields else msg
+        if self.fmt == "json":
+            record = {"ts": round(time.time(), 6), "level": LEVEL_NAMES[level]}
+            record["msg"] = text
+            record.update(self.context)
+            record.update(fields)
+            line = json.dumps(record, default=str)
+        else:
+            line = TEXT_PREFIX.get(level, "") + text
+            if error is not None:
+                line += f": {fields['error']}"
+                if "errno" in fields:
+                    line += f" ({fields['errno']})"
+        self._buffer.append(line)
+        if level >= ERROR or len(self._buffer) >= self.buffer_lines:
+            self.flush()
+
+    def debug(self, msg: str, **fields):
+        self.log(DEBUG, msg, **fields)
+
+    def info(self, msg: str, **fields):
+        self.log(INFO, msg, **fields)
+
+    def warning(self, msg: str, error=None, **fields):
+        self.log(WARNING, msg, error, **fields)
+
+    def error(self, msg: str, error=None, **fields):
+        self.log(ERROR, msg, error, **fields)
+
+    def flush(self):
+        if not self._buffer:
+            return
+        # 每次写出时取sys.stdout，调用方重定向标准输出后仍然有效
+        sys.stdout.write("\n".join(self._buffer) + "\n")
+        sys.stdout.flush()
+        self._buffer.clear()
+
+
+class Progress:
+    """限速的进度行，例如"1,200/4,000 units, 310 ops/s, ETA 9s"
+
+    每interval秒最多输出一次；不到interval就完成的运行不输出进度。
+    """
+
+    def __init__(self, logger: Logger, units: int, ops: int, interval: float = 1.0):
+        self.logger = logger
+        self.total_units = units
+        self.total_ops = ops
+        self.interval = interval
+        self.units = 0
+        self.ops = 0
+        self.start = time.perf_counter()
+        self._last = self.start
+        self._reported = False
+
+    def update(self, ops: int = 0, units: int = 0):
+        self.ops += ops
+        self.units += units
+        now = time.perf_counter()
+        if now - self._last >= self.interval:
+            self._last = now
+            self._emit(now)
+
+    def finish(self):
+        if self._reported:
+            self._emit(time.perf_counter())
+
+    def _emit(self, now: float):
+        elapsed = now - self.start
+        rate = self.ops / elapsed if elapsed > 0 else 0.0
+        eta: Optional[float] = None
+        if rate > 0:
+            eta = (self.total_ops - self.ops) / rate
+        self.logger.info(
+            "{units:,}/{total_units:,} units, {ops_per_sec:.0f} ops/s, ETA {eta}",
+            units=self.units,
+            total_units=self.total_units,
+            ops_per_sec=round(rate, 1),
+            eta=f"{eta:.0f}s" if eta is not None else "-",
+        )
+        self._reported = True
+        self.logger.flush()
+
+
+log = Logger()
+atexit.register(log.flush)
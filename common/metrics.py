@@ -0,0 +1,247 @@
+"""netlink调用的计数与延迟统计
+
+启用后（main.py --metrics），instrument()返回的代理为每次netlink调用按操作
+类型（vxlan.add、bridge.add、master.set、addr.add、lookup……）记录次数、延迟
+直方图和按errno分类的错误。NetlinkBatch经由代理的asyncore流水线提交的请求
+同样被统计，其延迟为请求的在途时间；common.iproute2执行的命令按ip.link.add、
+bridge.batch计入。运行结束时写出Prometheus textfile
+（node_exporter的textfile collector可直接读取）和JSON摘要。
+
+未启用统计和追踪（见common/trace.py）时instrument()原样返回IPRoute，
+没有额外开销。
+"""
+
+import json
+import time
+import errno
+import inspect
+from typing import Dict, List, Optional, Tuple
+from common.state_manager import write_atomic
+from common.trace import TRACER
+
+# 延迟直方图各桶的上界（秒）
+BUCKETS = (
+    0.0001,
+    0.00025,
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+)
+
+# 被计时的IPRoute方法
+TIMED_METHODS = ("link", "addr", "link_lookup", "get_links", "get_addr", "vlan_filter")
+# link set按携带的属性区分类型
+SET_TYPES = (("master", "master"), ("address", "mac"), ("group", "group"))
+
+
+def op_type(method: str, command: Optional[str], kwarg: dict) -> str:
+    """由IPRoute方法和参数得到操作类型"""
+    if method == "link_lookup":
+        return "lookup"
+    if method == "get_links":
+        return "link.dump"
+    if method == "get_addr":
+        return "addr.dump"
+    if method == "vlan_filter":
+        return f"vlan.{command}"
+    if method == "vni_filter":
+        return f"vni.{command}"
+    if method == "link":
+        if command == "add":
+            return f"{kwarg.get('kind', 'link')}.add"
+        if command == "set":
+            for key, name in SET_TYPES:
+                if key in kwarg:
+                    return f"{name}.set"
+            return "link.set"
+        if command == "del" and "group" in kwarg:
+            return "group.del"
+    return f"{method}.{command}"
+
+
+class NetlinkMetrics:
+    """各操作类型的请求数、延迟直方图（累积桶）和错误数"""
+
+    def __init__(self):
+        self.enabled = False
+        self.messages = 0
+        self.counts: Dict[str, int] = {}
+        self.sums: Dict[str, float] = {}
+        self.buckets: Dict[str, List[int]] = {}
+        self.errors: Dict[Tuple[str, str], int] = {}
+
+    def observe(self, op: str, seconds: float, error: Optional[Exception] = None):
+        self.messages += 1
+        self.counts[op] = self.counts.get(op, 0) + 1
+        self.sums[op] = self.sums.get(op, 0.0) + seconds
+        buckets = self.buckets.setdefault(op, [0] * len(BUCKETS))
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                buckets[i] += 1
+        if error is not None:
+            code = getattr(error, "code", None)
+            name = (
+                errno.errorcode.get(code, str(code))
+                if isinstance(code, int)
+                else type(error).__name__
+            )
+            self.errors[(op, name)] = self.errors.get((op, name), 0) + 1
+
+    def summary(self, run: Optional[dict] = None) -> dict:
+        ops = {}
+        for op in sorted(self.counts):
+            ops[op] = {
+                "count": self.counts[op],
+                "seconds": round(self.sums[op], 6),
+                "mean_ms": round(self.sums[op] / self.counts[op] * 1000, 3),
+                "errors": {
+                    name: n for (o, name), n in sorted(self.errors.items()) if o == op
+                },
+            }
+        return {
+            "messages": self.messages,
+            "seconds": round(sum(self.sums.values()), 6),
+            "ops": ops,
+            "run": run or {},
+        }
+
+    def to_prometheus(self, labels: dict, run: Optional[dict] = None) -> str:
+        def fmt(extra: dict) -> str:
+            merged = dict(labels, **extra)
+            if not merged:
+                return ""
+            return "{" + ",".join(f'{k}="{v}"' for (k, v) in merged.items()) + "}"
+
+        lines = [
+            "# HELP vxlanbgp_netlink_messages_total Netlink requests sent.",
+            "# TYPE vxlanbgp_netlink_messages_total counter",
+            f"vxlanbgp_netlink_messages_total{fmt({})} {self.messages}",
+            "# HELP vxlanbgp_netlink_request_duration_seconds Netlink request latency.",
+            "# TYPE vxlanbgp_netlink_request_duration_seconds histogram",
+        ]
+        for op in sorted(self.counts):
+            for bound, count in zip(BUCKETS, self.buckets[op]):
+                lines.append(
+                    "vxlanbgp_netlink_request_duration_seconds_bucket"
+                    f"{fmt({'op': op, 'le': bound})} {count}"
+                )
+            lines.append(
+                "vxlanbgp_netlink_request_duration_seconds_bucket"
+                f"{fmt({'op': op, 'le': '+Inf'})} {self.counts[op]}"
+            )
+            lines.append(
+                "vxlanbgp_netlink_request_duration_seconds_sum"
+                f"{fmt({'op': op})} {self.sums[op]:.6f}"
+            )
+            lines.append(
+                "vxlanbgp_netlink_request_duration_seconds_count"
+                f"{fmt({'op': op})} {self.counts[op]}"
+            )
+        lines += [
+            "# HELP vxlanbgp_netlink_errors_total Failed netlink requests by errno.",
+            "# TYPE vxlanbgp_netlink_errors_total counter",
+        ]
+        for (op, name), count in sorted(self.errors.items()):
+            lines.append(
+                f"vxlanbgp_netlink_errors_total{fmt({'op': op, 'errno': name})} {count}"
+            )
+        if run:
+            lines += [
+                "# HELP vxlanbgp_run_success Whether the last run succeeded.",
+                "# TYPE vxlanbgp_run_success gauge",
+                f"vxlanbgp_run_success{fmt({})} {int(run.get('success', False))}",
+                "# HELP vxlanbgp_run_duration_seconds Apply time of the last run.",
+                "# TYPE vxlanbgp_run_duration_seconds gauge",
+                f"vxlanbgp_run_duration_seconds{fmt({})} {run.get('duration', 0)}",
+                "# HELP vxlanbgp_run_timestamp_seconds End time of the last run.",
+                "# TYPE vxlanbgp_run_timestamp_seconds gauge",
+                f"vxlanbgp_run_timestamp_seconds{fmt({})} {time.time():.0f}",
+            ]
+        return "\n".join(lines) + "\n"
+
+    def write(self, prefix: str, labels: dict, run: Optional[dict] = None):
+        """写出prefix.prom和prefix.json，均为原子替换"""
+        write_atomic(f"{prefix}.prom", self.to_prometheus(labels, run))
+        write_atomic(f"{prefix}.json", json.dumps(self.summary(run), indent=2))
+
+
+METRICS = NetlinkMetrics()
+
+
+class InstrumentedIPRoute:
+    """IPRoute/AsyncIPRoute的计时代理，其余属性原样转发"""
+
+    def __init__(self, ipr, metrics: NetlinkMetrics):
+        self.ipr = ipr
+        self.metrics = metrics
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.ipr.close()
+
+    def __getattr__(self, name):
+        attr = getattr(self.ipr, name)
+        # NetlinkBatch经由asyncore流水线提交
+        if name == "asyncore":
+            return InstrumentedIPRoute(attr, self.metrics)
+        if name not in TIMED_METHODS:
+            return attr
+
+        def timed(*args, **kwarg):
+            op = op_type(name, args[0] if args else None, kwarg)
+            start = time.perf_counter()
+            try:
+                result = attr(*args, **kwarg)
+                if inspect.isawaitable(result):
+                    return self._timed_await(op, start, result)
+                # 同步dump返回生成器，计时包括读取全部回复
+                if inspect.isgenerator(result):
+                    result = list(result)
+            except Exception as e:
+                self._observe(op, start, e)
+                raise
+            self._observe(op, start)
+            return result
+
+        return timed
+
+    async def _timed_await(self, op: str, start: float, awaitable):
+        try:
+            result = await awaitable
+        except Exception as e:
+            self._observe(op, start, e)
+            raise
+        self._observe(op, start)
+        return result
+
+    def _observe(self, op: str, start: float, error: Optional[Exception] = None):
+        observe(self.metrics, op, start, error)
+
+
+def observe(
+    metrics: NetlinkMetrics, op: str, start: float, error: Optional[Exception] = None
+):
+    """记录一个从start开始、此刻结束的请求"""
+    end = time.perf_counter()
+    metrics.observe(op, end - start, error)
+    # --trace时每个请求同时作为一个netlink区间记录
+    if TRACER.enabled:
+        args = {"error": str(error)} if error is not None else {}
+        TRACER.interval(op, start, end, "netlink", args)
+
+
+def instrument(ipr):
+    """启用统计或追踪时返回计时代理，否则原样返回"""
+    if METRICS.enabled or TRACER.enabled:
+        return InstrumentedIPRoute(ipr, METRICS)
+    return ipr
@@ -0,0 +1,165 @@
+"""多网络命名空间并行执行
+
+每个目标（netns名称加一份EnvConf）由一个独立的工作进程执行：
+
+    [
+        {"Netns": "tenant1", "Conf": {...}},
+        {"Netns": "tenant2", "Conf": {...}, "StateFile": "/var/lib/evpn/t2.json"}
+    ]
+
+工作进程通过`ip netns exec`进入目标命名空间后运行main.py：netlink socket、
+RollbackManager和状态文件都属于该进程，互不影响。ip netns exec同时重新挂载
+/sys，快速路径读取的sysfs与目标命名空间一致；仅在进程内setns()做不到这一点。
+"""
+
+import os
+import sys
+import json
+import tempfile
+import subprocess
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import List, Optional
+from common.state_manager import STATE_FILE
+
+MAIN = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "main.py"
+)
+
+
+def target_state_file(netns: str) -> str:
+    """目标默认的状态文件：与STATE_FILE同目录，文件名带上netns名称"""
+    (base, ext) = os.path.splitext(STATE_FILE)
+    return f"{base}.{netns}{ext}"
+
+
+def load_targets(path: str) -> List[dict]:
+    with open(path, "r") as f:
+        targets = json.load(f)
+    seen = set()
+    for target in targets:
+        if not target.get("Netns") or not isinstance(target.get("Conf"), dict):
+            raise ValueError("Each target needs Netns and Conf")
+        if target["Netns"] in seen:
+            raise ValueError(f"Duplicate target netns {target['Netns']}")
+        seen.add(target["Netns"])
+    return targets
+
+
+def _forwarded_args(args) -> List[str]:
+    """传给工作进程的main.py参数"""
+    argv = [
+        "--engine",
+        args.engine,
+        "--concurrency",
+        str(args.concurrency),
+        "--rollback-scope",
+        args.rollback_scope,
+        "--log-level",
+        args.log_level,
+        "--log-format",
+        args.log_format,
+    ]
+    for flag in ("reconcile", "resume", "force", "plan"):
+        if getattr(args, flag):
+            argv.append(f"--{flag}")
+    if args.plan_latency:
+        argv += ["--plan-latency", args.plan_latency]
+    return argv
+
+
+def _output_args(args, target: dict) -> List[str]:
+    """每个目标写出各自的指标、追踪和profile文件，文件名带上netns名称"""
+    netns = target["Netns"]
+    argv = []
+    if args.metrics:
+        argv += ["--metrics", f"{args.metrics}.{netns}"]
+    for flag in ("trace", "profile"):
+        path = getattr(args, flag)
+        if path:
+            (base, ext) = os.path.splitext(path)
+            argv += [f"--{flag}", f"{base}.{netns}{ext}"]
+    return argv
+
+
+def apply_target(target: dict, argv: List[str]) -> dict:
+    """在一个工作进程中执行单个目标，返回其结果和输出"""
+    netns = target["Netns"]
+    state_file = target.get("StateFile") or target_state_file(netns)
+    env = dict(os.environ)
+    env["VXLANBGP_MAIN_CONF"] = json.dumps(target["Conf"])
+    env["VXLANBGP_STATE_FILE"] = state_file
+    env["VXLANBGP_STATE_DB"] = os.path.splitext(state_file)[0] + ".db"
+    # 指标带上netns标签，各目标的指标文件可以放在同一个textfile目录中
+    env["VXLANBGP_NETNS"] = netns
+
+    (fd, result_file) = tempfile.mkstemp(prefix="vxlanbgp-", suffix=".json")
+    os.close(fd)
+    try:
+        proc = subprocess.run(
+            ["ip", "netns", "exec", netns, sys.executable, MAIN]
+            + argv
+            + ["--result", result_file],
+            env=env,
+            capture_output=True,
+            text=True,
+        )
+        result: Optional[dict] = None
+        try:
+            with open(result_file, "r") as f:
+                result = json.load(f)
+        except ValueError:
+            pass
+        if result is None:
+            # 工作进程没有运行到写结果，例如netns不存在
+            result = {"status": "error", "success": False}
+        result["netns"] = netns
+        result["log"] = proc.stdout + proc.stderr
+        return result
+    finally:
+        os.remove(result_file)
+
+
+def apply_targets(path: str, args) -> List[dict]:
+    """并行执行targets文件中的全部目标，打印每个目标的输出和汇总报告"""
+    targets = load_targets(path)
+    workers = args.workers or min(len(targets), os.cpu_count() or 1)
+    argv = _forwarded_args(args)
+    print(f"Applying {len(targets)} namespaces with {workers} workers...")
+
+    results: List[dict] = []
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [
+            pool.submit(apply_target, target, argv + _output_args(args, target))
+            for target in targets
+        ]
+        # 按完成顺序输出，每个目标的输出整体打印，不与其他目标交错；
+        # json格式的记录已经带有netns字段，原样输出
+        for future in as_completed(futures):
+            result = future.result()
+            results.append(result)
+            for line in result["log"].splitlines():
+                if args.log_format == "json":
+                    print(line)
+                else:
+                    print(f"[{result['netns']}] {line}")
+
+    results.sort(key=lambda r: r["netns"])
+    print(f"{'NETNS':20} {'STATUS':10} {'DURATION':>9}  FAILED UNITS")
+    for result in results:
+        duration = result.get("duration")
+        print(
+            f"{result['netns']:20} {result['status']:10} "
+            f"{f'{duration:.3f}s' if duration is not None else '-':>9}  "
+            f"{','.join(result.get('failed_units', [])) or '-'}"
+        )
+    ok = sum(1 for r in results if r["success"])
+    print(f"{ok} of {len(results)} namespaces configured successfully")
+
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(
+                [{k: v for (k, v) in r.items() if k != "log"} for r in results],
+                f,
+                indent=2,
+            )
+    return results
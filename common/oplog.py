@@ -0,0 +1,232 @@
+from array import array
+from typing import Dict, Iterator, List, Optional, Tuple
+
+# 操作类别和动作按下标编码
+CATEGORIES = (
+    "interfaces",
+    "bridges",
+    "vrfs",
+    "veths",
+    "ip_assignments",
+    "master_relations",
+    "bridge_vlans",
+    "bridge_vnis",
+)
+ACTIONS = ("add", "del")
+
+# 每个类别的字段：两个字符串列和两个整数列，None表示该列不用；
+# 字段顺序即转换回JSON时的键顺序，与record_*方法一致
+FIELDS = {
+    "interfaces": ("name", None, "vni", "vlan_id"),
+    "bridges": ("name", None, "vni", None),
+    "vrfs": ("name", None, "vni", None),
+    "veths": ("name", "vrf", None, None),
+    "ip_assignments": ("interface", "ip", None, None),
+    "master_relations": ("slave", "master", None, None),
+    # SVD模式的桥接VLAN（桥接自身的VLAN时flags为self）和VNI过滤表项
+    "bridge_vlans": ("dev", "flags", "vni", "vlan_id"),
+    "bridge_vnis": ("dev", None, "vni", None),
+}
+
+_CATEGORY_CODE = {c: i for i, c in enumerate(CATEGORIES)}
+_ACTION_CODE = {a: i for i, a in enumerate(ACTIONS)}
+
+# 字符串列和整数列中表示None的值
+NONE = -1
+# 动作列中表示已删除（撤销）的操作的值
+REMOVED = 0xFF
+
+
+class OperationLog:
+    """紧凑的操作记录：按列存放在array中，字符串（接口名、IP、实体）驻留为下标
+
+    每条操作占用7个定长整数，不再是一个带重复键的dict。to_json()转换回
+    原来的{类别: [dict, ...]}格式，to_compact()/from_compact()用于状态文件。
+    remove()只把动作列标记为REMOVED，各列不重建；标记的操作在遍历时跳过，
+    to_compact()时丢弃。
+    """
+
+    __slots__ = (
+        "strings",
+        "_ids",
+        "cat",
+        "act",
+        "s1",
+        "s2",
+        "n1",
+        "n2",
+        "unit",
+        "removed",
+    )
+
+    def __init__(self):
+        self.strings: List[str] = []
+        self._ids: Dict[str, int] = {}
+        self.cat = array("B")
+        self.act = array("B")
+        self.s1 = array("i")
+        self.s2 = array("i")
+        self.n1 = array("i")
+        self.n2 = array("i")
+        self.unit = array("i")
+        self.removed = 0
+
+    def __len__(self):
+        return len(self.cat) - self.removed
+
+    def _intern(self, value: Optional[str]) -> int:
+        if value is None:
+            return NONE
+        sid = self._ids.get(value)
+        if sid is None:
+            sid = self._ids[value] = len(self.strings)
+            self.strings.append(value)
+        return sid
+
+    def _find(self, value: Optional[str]) -> Optional[int]:
+        """字符串的下标，不驻留；从未出现过的字符串返回None，不与任何操作匹配"""
+        if value is None:
+            return NONE
+        return self._ids.get(value)
+
+    def _string(self, sid: int) -> Optional[str]:
+        return None if sid == NONE else self.strings[sid]
+
+    def append(self, category: str, entry: dict):
+        (f1, f2, f3, f4) = FIELDS[category]
+        self.cat.append(_CATEGORY_CODE[category])
+        self.act.append(_ACTION_CODE[entry.get("action", "add")])
+        self.s1.append(self._intern(entry.get(f1)))
+        self.s2.append(self._intern(entry.get(f2)) if f2 else NONE)
+        n1 = entry.get(f3) if f3 else None
+        n2 = entry.get(f4) if f4 else None
+        self.n1.append(NONE if n1 is None else n1)
+        self.n2.append(NONE if n2 is None else n2)
+        self.unit.append(self._intern(entry.get("unit")))
+
+    def _key(self, category: str, entry: dict) -> Optional[tuple]:
+        """与记录entry相同的操作在各列中的值；含从未出现过的字符串时返回None"""
+        (f1, f2, f3, f4) = FIELDS[category]
+        key = (
+            _CATEGORY_CODE[category],
+            _ACTION_CODE[entry.get("action", "add")],
+            self._find(entry.get(f1)),
+            self._find(entry.get(f2)) if f2 else NONE,
+            NONE if not f3 or entry.get(f3) is None else entry[f3],
+            NONE if not f4 or entry.get(f4) is None else entry[f4],
+            self._find(entry.get("unit")),
+        )
+        return None if None in key else key
+
+    def remove(self, items: List[Tuple[str, dict]]) -> int:
+        """删除与items中各条记录相同的操作（每条删除最后一个匹配），返回删除的条数
+
+        从末尾向前扫描，全部找到即停止：撤销的是最近发出的请求的记录，通常
+        只扫描最后一个批次。匹配的操作标记为REMOVED，各列不重建。
+        """
+        wanted: Dict[tuple, int] = {}
+        for category, entry in items:
+            key = self._key(category, entry)
+            if key is not None:
+                wanted[key] = wanted.get(key, 0) + 1
+        remaining = sum(wanted.values())
+        dropped = 0
+        i = len(self.cat)
+        while remaining and i:
+            i -= 1
+            key = (
+                self.cat[i],
+                self.act[i],
+                self.s1[i],
+                self.s2[i],
+                self.n1[i],
+                self.n2[i],
+                self.unit[i],
+            )
+            if wanted.get(key):
+                wanted[key] -= 1
+                remaining -= 1
+                self.act[i] = REMOVED
+                dropped += 1
+        self.removed += dropped
+        return dropped
+
+    def rows(
+        self, category: str, action: str = "add"
+    ) -> Iterator[Tuple[str, Optional[str]]]:
+        """给定类别和动作的操作的两个字符串字段"""
+        (c, a) = (_CATEGORY_CODE[category], _ACTION_CODE[action])
+        strings = self.strings
+        for i in range(len(self.cat)):
+            if self.cat[i] == c and self.act[i] == a:
+                s2 = self.s2[i]
+                yield (strings[self.s1[i]], None if s2 == NONE else strings[s2])
+
+    def values(
+        self, category: str, action: str = "add"
+    ) -> Iterator[Tuple[Optional[str], Optional[str], Optional[int], Optional[int]]]:
+        """给定类别和动作的操作的全部四个字段"""
+        (c, a) = (_CATEGORY_CODE[category], _ACTION_CODE[action])
+        for i in range(len(self.cat)):
+            if self.cat[i] == c and self.act[i] == a:
+                (n1, n2) = (self.n1[i], self.n2[i])
+                yield (
+                    self._string(self.s1[i]),
+                    self._string(self.s2[i]),
+                    None if n1 == NONE else n1,
+                    None if n2 == NONE else n2,
+                )
+
+    def entry(self, i: int) -> Tuple[str, dict]:
+        """第i条操作，转换回record_*方法记录的dict"""
+        category = CATEGORIES[self.cat[i]]
+        action = ACTIONS[self.act[i]]
+        (f1, f2, f3, f4) = FIELDS[category]
+        entry: dict = {f1: self._string(self.s1[i])}
+        if f2:
+            entry[f2] = self._string(self.s2[i])
+        # 删除操作只记录字符串字段
+        if action == "add":
+            for field, value in ((f3, self.n1[i]), (f4, self.n2[i])):
+                if field:
+                    entry[field] = None if value == NONE else value
+        entry["action"] = action
+        if self.unit[i] != NONE:
+            entry["unit"] = self.strings[self.unit[i]]
+        return (category, entry)
+
+    def entries(self) -> Iterator[Tuple[str, dict]]:
+        for i in range(len(self.cat)):
+            if self.act[i] != REMOVED:
+                yield self.entry(i)
+
+    def to_json(self) -> Dict[str, List[dict]]:
+        operations: Dict[str, List[dict]] = {c: [] for c in CATEGORIES}
+        for category, entry in self.entries():
+            operations[category].append(entry)
+        return operations
+
+    def to_compact(self) -> dict:
+        """状态文件中的紧凑格式：字符串表加每列一个整数列表，不含已删除的操作"""
+        columns = ("cat", "act", "s1", "s2", "n1", "n2", "unit")
+        if not self.removed:
+            data = {column: getattr(self, column).tolist() for column in columns}
+        else:
+            live = [i for (i, a) in enumerate(self.act) if a != REMOVED]
+            data = {
+                column: [getattr(self, column)[i] for i in live] for column in columns
+            }
+        return {"strings": self.strings, **data}
+
+    @classmethod
+    def from_compact(cls, data: dict) -> "OperationLog":
+        log = cls()
+        log.strings = list(data["strings"])
+        log._ids = {s: i for i, s in enumerate(log.strings)}
+        for column in ("cat", "act", "s1", "s2", "n1", "n2", "unit"):
+            getattr(log, column).extend(data[column])
+        return log
+
+    @staticmethod
+    def is_compact(data: dict) -> bool:
+        return "strings" in data
@@ -0,0 +1,352 @@
+from collections import Counter
+from typing import Dict, List, Optional
+from common.types import CompiledConf, VlanEntry, VRFEntry
+from common.diff_analyzer import DiffAnalyzer
+from common.trace import span
+
+VETH_FIELDS = (
+    "InOutVethRequire",
+    "VxLANInOutDomainVethPrefix",
+    "InVRFVethIPAddr",
+    "ExternalVRFVethIPAddr",
+)
+
+
+class Op:
+    """执行计划中的一个netlink操作"""
+
+    __slots__ = ("id", "kind", "ifname", "args", "unit", "deps", "level")
+
+    def __init__(self, id: int, kind: str, ifname: str, args: dict, unit: str):
+        self.id = id
+        self.kind = kind
+        self.ifname = ifname
+        self.args = args
+        # 操作所属的实体（"vrf:NAME" 或 "l2vni:VNI"）
+        self.unit = unit
+        self.deps: List["Op"] = []
+        self.level = 0
+
+    def __repr__(self):
+        return f"{self.kind} {self.ifname}"
+
+
+class Plan:
+    """由配置编译出的操作DAG
+
+    依赖关系由每个操作读写的接口名推导：写操作（创建、删除、改变master）
+    排在该接口之前的所有读写之后；读操作（以该接口为master或父接口、
+    在其上配置IP）排在该接口最近一次写之后。操作按加入顺序即为一个拓扑序。
+    """
+
+    def __init__(self):
+        self.ops: List[Op] = []
+        self._last_write: Dict[str, Op] = {}
+        self._reads: Dict[str, List[Op]] = {}
+
+    def __len__(self):
+        return len(self.ops)
+
+    def add(
+        self,
+        kind: str,
+        ifname: str,
+        unit: str,
+        reads: tuple = (),
+        writes: Optional[tuple] = None,
+        **args,
+    ) -> Op:
+        op = Op(len(self.ops), kind, ifname, args, unit)
+        deps: Dict[int, Op] = {}
+
+        for name in reads:
+            last = self._last_write.get(name)
+            if last is not None:
+                deps[last.id] = last
+            self._reads.setdefault(name, []).append(op)
+
+        for name in (ifname,) if writes is None else writes:
+            last = self._last_write.get(name)
+            if last is not None:
+                deps[last.id] = last
+            for reader in self._reads.pop(name, []):
+                if reader is not op:
+                    deps[reader.id] = reader
+            self._last_write[name] = op
+
+        op.deps = list(deps.values())
+        op.level = max((dep.level + 1 for dep in op.deps), default=0)
+        self.ops.append(op)
+        return op
+
+    def levels(self) -> List[List[Op]]:
+        """按层分组，同一层内的操作互不依赖"""
+        levels: List[List[Op]] = []
+        for op in self.ops:
+            while len(levels) <= op.level:
+                levels.append([])
+            levels[op.level].append(op)
+        return levels
+
+    def critical_path(self) -> List[Op]:
+        """DAG中最长的依赖链"""
+        if not self.ops:
+            return []
+        op = max(self.ops, key=lambda o: o.level)
+        path = [op]
+        while op.deps:
+            op = max(op.deps, key=lambda o: o.level)
+            path.append(op)
+        return path[::-1]
+
+    def counts(self) -> Dict[str, int]:
+        return dict(Counter(op.kind for op in self.ops))
+
+
+def _plan_veth_add(plan: Plan, vrf: VRFEntry, unit: str):
+    plan.add(
+        "veth.add",
+        vrf.in_veth,
+        unit,
+        reads=(vrf.name,),
+        writes=(vrf.in_veth, vrf.ext_veth),
+        peer=vrf.ext_veth,
+        master=vrf.name,
+    )
+    plan.add("link.up", vrf.ext_veth, unit, reads=(vrf.ext_veth,), writes=())
+    plan.add(
+        "addr.add",
+        vrf.in_veth,
+        unit,
+        reads=(vrf.in_veth,),
+        writes=(),
+        address=vrf.in_veth_ip,
+    )
+    plan.add(
+        "addr.add",
+        vrf.ext_veth,
+        unit,
+        reads=(vrf.ext_veth,),
+        writes=(),
+        address=vrf.ext_veth_ip,
+    )
+
+
+def _plan_veth_remove(plan: Plan, vrf: VRFEntry, unit: str):
+    # 删除veth任意一端会同时删除对端
+    plan.add("veth.del", vrf.in_veth, unit, writes=(vrf.in_veth, vrf.ext_veth))
+
+
+def _plan_l3_vni_add(plan: Plan, vrf: VRFEntry, underlay_ip: str):
+    unit = f"vrf:{vrf.name}"
+
+    plan.add("bridge.add", vrf.bridge, unit, reads=(vrf.name,), master=vrf.name)
+    plan.add(
+        "vxlan.add",
+        vrf.vxlan,
+        unit,
+        reads=(vrf.bridge,),
+        vni=vrf.l3_vni,
+        local_ip=underlay_ip,
+        master=vrf.bridge,
+    )
+
+
+def plan_vrf_add(plan: Plan, vrf: VRFEntry, underlay_ip: str):
+    unit = f"vrf:{vrf.name}"
+
+    plan.add("vrf.add", vrf.name, unit, table=vrf.table)
+    _plan_l3_vni_add(plan, vrf, underlay_ip)
+    if vrf.veth_require:
+        _plan_veth_add(plan, vrf, unit)
+
+
+def plan_vrf_remove(plan: Plan, vrf: VRFEntry):
+    unit = f"vrf:{vrf.name}"
+
+    if vrf.veth_require:
+        _plan_veth_remove(plan, vrf, unit)
+    plan.add("master.unset", vrf.bridge, unit, reads=(vrf.name,), master=vrf.name)
+    plan.add("bridge.del", vrf.bridge, unit)
+    plan.add("vxlan.del", vrf.vxlan, unit, vni=vrf.l3_vni)
+    plan.add("vrf.del", vrf.name, unit)
+
+
+def plan_vrf_change(
+    plan: Plan,
+    vrf_change_info: dict,
+    attached_bridges: List[str],
+    underlay_ip: str,
+):
+    """按变化的字段更新VRF；attached_bridges为保持不变、需要重新挂接的L2桥接"""
+    old: VRFEntry = vrf_change_info["old"]
+    new: VRFEntry = vrf_change_info["new"]
+    changed_fields = vrf_change_info["changed_fields"]
+    unit = f"vrf:{new.name}"
+
+    # VRF的路由表不能原地修改：删除重建，原有的从属接口需要重新挂接
+    recreate = "VRFRouteTableID" in changed_fields
+    if recreate:
+        plan.add("vrf.del", new.name, unit)
+        plan.add("vrf.add", new.name, unit, table=new.table)
+
+    if "VxLANL3VNI" in changed_fields:
+        plan.add("bridge.del", old.bridge, unit)
+        plan.add("vxlan.del", old.vxlan, unit, vni=old.l3_vni)
+        _plan_l3_vni_add(plan, new, underlay_ip)
+    elif recreate:
+        attached_bridges = [new.bridge] + attached_bridges
+
+    if any(key in changed_fields for key in VETH_FIELDS):
+        if old.veth_require:
+            _plan_veth_remove(plan, old, unit)
+        if new.veth_require:
+            _plan_veth_add(plan, new, unit)
+    elif recreate and new.veth_require:
+        attached_bridges = [new.in_veth] + attached_bridges
+
+    if recreate:
+        for ifname in attached_bridges:
+            plan.add("master.set", ifname, unit, reads=(new.name,), master=new.name)
+
+
+def plan_vlan_add(plan: Plan, vlan: VlanEntry, vrf_name: str, underlay_ip: str):
+    unit = f"l2vni:{vlan.l2_vni}"
+
+    # 一条RTM_NEWLINK同时携带MAC、master和IFF_UP
+    plan.add(
+        "bridge.add",
+        vlan.bridge,
+        unit,
+        reads=(vrf_name,),
+        master=vrf_name,
+        address=vlan.mac,
+    )
+    if vlan.ip:
+        plan.add(
+            "addr.add",
+            vlan.bridge,
+            unit,
+            reads=(vlan.bridge,),
+            writes=(),
+            address=vlan.ip,
+        )
+    plan.add(
+        "vxlan.add",
+        vlan.vxlan,
+        unit,
+        reads=(vlan.bridge,),
+        vni=vlan.l2_vni,
+        local_ip=underlay_ip,
+        master=vlan.bridge,
+    )
+    plan.add(
+        "vlan.add",
+        vlan.subif,
+        unit,
+        reads=(vlan.bridge, vlan.parent),
+        parent=vlan.parent,
+        vlan_id=vlan.vlan_id,
+        master=vlan.bridge,
+    )
+
+
+def plan_vlan_remove(plan: Plan, vlan: VlanEntry, vrf_name: str):
+    unit = f"l2vni:{vlan.l2_vni}"
+
+    plan.add("master.unset", vlan.bridge, unit, reads=(vrf_name,), master=vrf_name)
+    if vlan.ip:
+        plan.add(
+            "addr.del",
+            vlan.bridge,
+            unit,
+            reads=(vlan.bridge,),
+            writes=(),
+            address=vlan.ip,
+        )
+    plan.add("bridge.del", vlan.bridge, unit)
+    plan.add("vxlan.del", vlan.vxlan, unit, vni=vlan.l2_vni)
+    plan.add(
+        "vlan.del",
+        vlan.subif,
+        unit,
+        parent=vlan.parent,
+        vlan_id=vlan.vlan_id,
+    )
+
+
+def build_plan(
+    conf: CompiledConf, underlay_ip: str, last_conf: Optional[CompiledConf] = None
+) -> Plan:
+    """把配置编译成操作DAG；给出last_conf时只包含与其相比的差异"""
+    plan = Plan()
+
+    if last_conf is None:
+        with span("plan.vrf_adds", count=len(conf.vrfs)):
+            for vrf in conf.vrfs:
+                plan_vrf_add(plan, vrf, underlay_ip)
+        with span("plan.vlan_adds", count=len(conf.vlans)):
+            for vlan in conf.vlans:
+                plan_vlan_add(plan, vlan, conf.vrf_for(vlan).name, underlay_ip)
+        return plan
+
+    # 配置摘要相同时无需逐条比较
+    if last_conf.digest == conf.digest and last_conf.overlay_eth == conf.overlay_eth:
+        return plan
+
+    with span("diff"):
+        vrf_diff = DiffAnalyzer.compare_vrf_entries(last_conf, conf)
+        vlan_diff = DiffAnalyzer.compare_vlan_entries(last_conf, conf)
+
+    # 1. 删除的VLAN，以及修改的VLAN的旧条目；所属VRF按上次的配置查找
+    removed_vlans = vlan_diff["removed"] + [c["old"] for c in vlan_diff["changed"]]
+    with span("plan.vlan_removals", count=len(removed_vlans)):
+        for vlan in removed_vlans:
+            vrf = vlan.vrf or conf.vrf_for(vlan)
+            plan_vlan_remove(plan, vlan, vrf.name)
+
+    # 2. 删除的VRF
+    with span("plan.vrf_removals", count=len(vrf_diff["removed"])):
+        for vrf in vrf_diff["removed"]:
+            plan_vrf_remove(plan, vrf)
+
+    # 3. 修改的VRF：未变化的VLAN桥接在VRF重建后需要重新挂接
+    touched_vlans = {v.vlan_id for v in vlan_diff["added"]} | {
+        c["vlan_id"] for c in vlan_diff["changed"]
+    }
+
+    def attached_bridges(l3_vni: int) -> List[str]:
+        return [
+            v.bridge
+            for v in conf.vlans_by_l3_vni.get(l3_vni, [])
+            if v.vlan_id not in touched_vlans
+        ]
+
+    with span("plan.vrf_changes", count=len(vrf_diff["changed"])):
+        for vrf_change_info in vrf_diff["changed"]:
+            l3_vni = vrf_change_info["new"].l3_vni
+            plan_vrf_change(
+                plan, vrf_change_info, attached_bridges(l3_vni), underlay_ip
+            )
+
+    # 4. 新增的VRF：VRF改名而L3VNI不变时，未变化的VLAN桥接随旧VRF的删除失去
+    # master，需要挂到新的VRF上
+    with span("plan.vrf_adds", count=len(vrf_diff["added"])):
+        for vrf in vrf_diff["added"]:
+            plan_vrf_add(plan, vrf, underlay_ip)
+            for ifname in attached_bridges(vrf.l3_vni):
+                plan.add(
+                    "master.set",
+                    ifname,
+                    f"vrf:{vrf.name}",
+                    reads=(vrf.name,),
+                    master=vrf.name,
+                )
+
+    # 5. 新增的VLAN，以及修改的VLAN的新条目
+    added_vlans = vlan_diff["added"] + [c["new"] for c in vlan_diff["changed"]]
+    with span("plan.vlan_adds", count=len(added_vlans)):
+        for vlan in added_vlans:
+            plan_vlan_add(plan, vlan, conf.vrf_for(vlan).name, underlay_ip)
+
+    return plan
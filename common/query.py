@@ -1,11 +1,12 @@
 from pyroute2 import IPRoute
+from common.log import log
 
 
 def get_interface_ip(ipr: IPRoute, interface_name: str):
     # 获取接口索引
     interface_index = ipr.link_lookup(ifname=interface_name)
     if not interface_index:
-        print(f"Interface {interface_name} not found")
+        log.info("Interface {entity} not found", entity=interface_name)
         return None
 
     # 获取该接口的所有IP地址信息
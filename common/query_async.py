@@ -0,0 +1,31 @@
+from common.ifindex_cache import AsyncIfIndexCache
+from common.log import log
+
+# common.query的asyncio版本
+
+
+async def get_interface_ip(ipr: AsyncIfIndexCache, interface_name: str):
+    # 获取接口索引
+    interface_index = await ipr.link_lookup(ifname=interface_name)
+    if not interface_index:
+        log.info("Interface {entity} not found", entity=interface_name)
+        return None
+
+    # 提取IPv4和IPv6地址
+    ipv4_addrs = []
+    ipv6_addrs = []
+
+    async for addr in await ipr.get_addr(index=interface_index[0]):
+        attrs = dict(addr["attrs"])
+        if "IFA_ADDRESS" in attrs:
+            ip = attrs["IFA_ADDRESS"]
+            if addr["family"] == 2:  # AF_INET (IPv4)
+                ipv4_addrs.append(ip)
+            elif addr["family"] == 10:  # AF_INET6 (IPv6)
+                ipv6_addrs.append(ip)
+
+    return {"interface": interface_name, "ipv4": ipv4_addrs, "ipv6": ipv6_addrs}
+
+
+async def check_interface_exist(ipr: AsyncIfIndexCache, interface_name: str) -> bool:
+    return len(await ipr.link_lookup(ifname=interface_name)) != 0
@@ -0,0 +1,464 @@
+import re
+import ipaddress
+from typing import Dict, Optional, Set
+from common.types import CompiledConf
+from common.ifindex_cache import IfIndexCache
+from common.planner import Plan
+from common.log import log
+
+IFF_UP = 0x1
+
+# linkinfo中参与比较的属性，不一致时接口只能删除重建
+LINKINFO_ATTRS = ("vxlan_id", "vxlan_local", "vrf_table", "vlan_id")
+
+
+def _addr_key(ip_addr: str) -> str:
+    """地址的规范形式，用于比较配置与内核中的地址"""
+    return str(ipaddress.ip_interface(ip_addr))
+
+
+class LinkState:
+    """快照中的一个接口"""
+
+    __slots__ = (
+        "ifname",
+        "index",
+        "kind",
+        "master",
+        "link",
+        "address",
+        "up",
+        "attrs",
+        "addrs",
+    )
+
+    def __init__(self, msg):
+        self.ifname: str = msg.get("ifname")
+        self.index: int = msg.get("index")
+        self.kind: Optional[str] = msg.get(("linkinfo", "kind"))
+        self.master: int = msg.get("master") or 0
+        self.link: int = msg.get("link") or 0
+        self.address: str = (msg.get("address") or "").lower()
+        self.up = bool(msg.get("flags", 0) & IFF_UP)
+        self.attrs = {}
+        for key in LINKINFO_ATTRS:
+            value = msg.get(("linkinfo", "data", key))
+            if value is not None:
+                self.attrs[key] = value
+        self.addrs: Set[str] = set()
+
+
+class KernelSnapshot:
+    """由一次link dump和一次addr dump构建的内核拓扑模型"""
+
+    def __init__(self, links, addrs):
+        self.links: Dict[str, LinkState] = {}
+        self.by_index: Dict[int, LinkState] = {}
+        for msg in links:
+            link = LinkState(msg)
+            if link.ifname and link.index:
+                self.links[link.ifname] = link
+                self.by_index[link.index] = link
+
+        for msg in addrs:
+            link = self.by_index.get(msg.get("index"))
+            if link is None or not msg.get("address"):
+                continue
+            ip = ipaddress.ip_interface(f"{msg.get('address')}/{msg.get('prefixlen')}")
+            # IPv6链路本地地址由内核自动生成，不属于配置；IPv4的169.254.0.0/16
+            # 不是自动生成的，veth地址可以配置在其中
+            if not (ip.version == 6 and ip.is_link_local):
+                link.addrs.add(str(ip))
+
+    @classmethod
+    def capture(cls, ipr) -> "KernelSnapshot":
+        links = list(ipr.get_links())
+        snapshot = cls(links, ipr.get_addr())
+        # 同一次dump同时用于初始化ifindex缓存
+        if isinstance(ipr, IfIndexCache):
+            ipr.seed(links)
+        return snapshot
+
+    @classmethod
+    async def capture_async(cls, ipr) -> "KernelSnapshot":
+        links = [link async for link in await ipr.get_links()]
+        addrs = [addr async for addr in await ipr.get_addr()]
+        if isinstance(ipr, IfIndexCache):
+            await ipr.seed(links)
+        return cls(links, addrs)
+
+    def name_of(self, index: int) -> str:
+        link = self.by_index.get(index)
+        return link.ifname if link is not None else ""
+
+
+class DesiredLink:
+    """配置要求的一个接口"""
+
+    __slots__ = (
+        "ifname",
+        "kind",
+        "unit",
+        "master",
+        "address",
+        "attrs",
+        "parent",
+        "peer",
+        "addrs",
+        "create",
+    )
+
+    def __init__(
+        self,
+        ifname: str,
+        kind: str,
+        unit: str,
+        master: str = "",
+        address: str = "",
+        parent: str = "",
+        peer: str = "",
+        addrs=(),
+        create=None,
+        **attrs,
+    ):
+        self.ifname = ifname
+        self.kind = kind
+        self.unit = unit
+        self.master = master
+        self.address = address.lower()
+        self.parent = parent
+        # veth对端；只有带create的一端负责创建整对
+        self.peer = peer
+        self.attrs = attrs
+        self.addrs = {_addr_key(a) for a in addrs if a}
+        # 创建操作：(kind, args)
+        self.create = create
+
+
+def desired_topology(conf: CompiledConf, underlay_ip: str) -> Dict[str, DesiredLink]:
+    """配置对应的接口集合，按创建顺序排列（master在从属接口之前）"""
+    desired: Dict[str, DesiredLink] = {}
+
+    def put(link: DesiredLink):
+        desired[link.ifname] = link
+
+    for vrf in conf.vrfs:
+        unit = f"vrf:{vrf.name}"
+
+        put(
+            DesiredLink(
+                vrf.name,
+                "vrf",
+                unit,
+                vrf_table=vrf.table,
+                create=("vrf.add", {"table": vrf.table}),
+            )
+        )
+        put(
+            DesiredLink(
+                vrf.bridge,
+                "bridge",
+                unit,
+                master=vrf.name,
+                create=("bridge.add", {"master": vrf.name}),
+            )
+        )
+        put(
+            DesiredLink(
+                vrf.vxlan,
+                "vxlan",
+                unit,
+                master=vrf.bridge,
+                vxlan_id=vrf.l3_vni,
+                vxlan_local=underlay_ip,
+                create=(
+                    "vxlan.add",
+                    {"vni": vrf.l3_vni, "local_ip": underlay_ip, "master": vrf.bridge},
+                ),
+            )
+        )
+        if vrf.veth_require:
+            put(
+                DesiredLink(
+                    vrf.in_veth,
+                    "veth",
+                    unit,
+                    master=vrf.name,
+                    peer=vrf.ext_veth,
+                    addrs=(vrf.in_veth_ip,),
+                    create=("veth.add", {"peer": vrf.ext_veth, "master": vrf.name}),
+                )
+            )
+            put(
+                DesiredLink(
+                    vrf.ext_veth,
+                    "veth",
+                    unit,
+                    peer=vrf.in_veth,
+                    addrs=(vrf.ext_veth_ip,),
+                )
+            )
+
+    for vlan in conf.vlans:
+        vrf_name = conf.vrf_for(vlan).name
+        unit = f"l2vni:{vlan.l2_vni}"
+
+        put(
+            DesiredLink(
+                vlan.bridge,
+                "bridge",
+                unit,
+                master=vrf_name,
+                address=vlan.mac,
+                addrs=(vlan.ip,),
+                create=("bridge.add", {"master": vrf_name, "address": vlan.mac}),
+            )
+        )
+        put(
+            DesiredLink(
+                vlan.vxlan,
+                "vxlan",
+                unit,
+                master=vlan.bridge,
+                vxlan_id=vlan.l2_vni,
+                vxlan_local=underlay_ip,
+                create=(
+                    "vxlan.add",
+                    {
+                        "vni": vlan.l2_vni,
+                        "local_ip": underlay_ip,
+                        "master": vlan.bridge,
+                    },
+                ),
+            )
+        )
+        put(
+            DesiredLink(
+                vlan.subif,
+                "vlan",
+                unit,
+                master=vlan.bridge,
+                parent=vlan.parent,
+                vlan_id=vlan.vlan_id,
+                create=(
+                    "vlan.add",
+                    {
+                        "parent": vlan.parent,
+                        "vlan_id": vlan.vlan_id,
+                        "master": vlan.bridge,
+                    },
+                ),
+            )
+        )
+
+    return desired
+
+
+def _managed_names(
+    conf: CompiledConf, last_conf: Optional[CompiledConf], created: Set[str]
+) -> Set[str]:
+    """本工具管理的接口名：不在期望集合中的这些接口视为残留，需要删除
+
+    只认本次或上次配置中出现过的名字，以及操作记录中本工具创建过的接口。
+    """
+    names = set(created)
+    names.update(conf.ifnames())
+    if last_conf is not None:
+        names.update(last_conf.ifnames())
+    return names
+
+
+def _naming_pattern(conf: CompiledConf, last_conf: Optional[CompiledConf]):
+    """vxlanN、br-vsiN和OverlayEth上的VLAN子接口的命名规则"""
+    overlays = {
+        c.overlay_eth for c in (conf, last_conf) if c is not None and c.overlay_eth
+    }
+    return re.compile(
+        r"vxlan\d+|br-vsi\d+|(?:%s)\.\d+"
+        % "|".join(re.escape(o) for o in sorted(overlays))
+    )
+
+
+def _matches(want: DesiredLink, actual: LinkState, snapshot: KernelSnapshot) -> bool:
+    """接口能否原地修改；类型或不可修改的属性不同时必须删除重建"""
+    if actual.kind != want.kind:
+        return False
+    for key, value in want.attrs.items():
+        if actual.attrs.get(key) != value:
+            return False
+    if want.parent and snapshot.name_of(actual.link) != want.parent:
+        return False
+    if want.peer:
+        peer = snapshot.links.get(want.peer)
+        if peer is None or peer.kind != "veth" or actual.link != peer.index:
+            return False
+    return True
+
+
+def _plan_delete(plan: Plan, actual: LinkState, unit: str, snapshot: KernelSnapshot):
+    kind = {"vrf": "vrf.del", "bridge": "bridge.del", "veth": "veth.del"}.get(
+        actual.kind, "link.del"
+    )
+    writes = (actual.ifname,)
+    if actual.kind == "veth" and actual.link in snapshot.by_index:
+        # 删除veth任意一端会同时删除对端
+        writes += (snapshot.name_of(actual.link),)
+    if "vxlan_id" in actual.attrs:
+        # 同一端口上VNI不能重复：占用该VNI的接口删除后才能创建新的
+        writes += (f"vni:{actual.attrs['vxlan_id']}",)
+    plan.add(kind, actual.ifname, unit, writes=writes)
+
+
+def _converged(want: DesiredLink, snapshot: KernelSnapshot) -> bool:
+    """接口已完全符合配置：reconcile_plan不会为它生成任何操作"""
+    actual = snapshot.links.get(want.ifname)
+    return (
+        actual is not None
+        and _matches(want, actual, snapshot)
+        and snapshot.name_of(actual.master) == want.master
+        and (not want.address or actual.address == want.address)
+        and actual.up
+        and actual.addrs == want.addrs
+    )
+
+
+def verify_units(
+    conf: CompiledConf, underlay_ip: str, snapshot: KernelSnapshot, units: Set[str]
+) -> Set[str]:
+    """用一次快照验证检查点：返回其全部接口都已符合配置的实体"""
+    verified = set(units)
+    for want in desired_topology(conf, underlay_ip).values():
+        if want.unit in verified and not _converged(want, snapshot):
+            verified.discard(want.unit)
+    return verified
+
+
+def reconcile_plan(
+    conf: CompiledConf,
+    underlay_ip: str,
+    snapshot: KernelSnapshot,
+    last_conf: Optional[CompiledConf] = None,
+    skip_units: Set[str] = frozenset(),
+    created: Set[str] = frozenset(),
+) -> Plan:
+    """对比配置与内核快照，生成使内核收敛到配置的最小计划
+
+    不依赖状态文件：内核已符合配置时计划为空，重复执行是幂等的。
+    last_conf和created（操作记录中本工具创建过的接口名）只用于识别已从
+    配置中删除的接口：其他接口即使符合命名规则也不是本工具创建的，不删除。
+    skip_units中的实体（已经验证完成的检查点）不再逐个接口比较。
+    """
+    plan = Plan()
+    desired = {
+        ifname: want
+        for ifname, want in desired_topology(conf, underlay_ip).items()
+        if want.unit not in skip_units
+    }
+    skipped = {ifname for ifname in conf.ifnames() if ifname not in desired}
+    managed = _managed_names(conf, last_conf, created)
+    pattern = _naming_pattern(conf, last_conf)
+    recreate: Set[str] = set()
+    deleted: Set[str] = set()
+
+    # 1. 删除残留的接口，以及类型或属性不符、需要重建的接口
+    for ifname, actual in snapshot.links.items():
+        if ifname in deleted:
+            continue
+        want = desired.get(ifname)
+        if want is None:
+            if ifname in skipped:
+                continue
+            if ifname not in managed:
+                if pattern.fullmatch(ifname):
+                    log.warning(
+                        "Interface {entity} was not created by this tool, leaving it",
+                        entity=ifname,
+                    )
+                continue
+            unit = "stale"
+        elif _matches(want, actual, snapshot):
+            continue
+        else:
+            unit = want.unit
+        _plan_delete(plan, actual, unit, snapshot)
+        deleted.add(ifname)
+        if actual.kind == "veth":
+            deleted.add(snapshot.name_of(actual.link))
+
+    for ifname in deleted:
+        if ifname in desired:
+            recreate.add(ifname)
+    # veth成对重建
+    for want in desired.values():
+        if want.peer and (want.ifname in recreate or want.ifname not in snapshot.links):
+            recreate.update((want.ifname, want.peer))
+
+    # 2. 按创建顺序补齐缺失的接口，修正master、MAC、状态和地址
+    for want in desired.values():
+        actual = None if want.ifname in recreate else snapshot.links.get(want.ifname)
+
+        if actual is None:
+            if want.create is not None:
+                kind, args = want.create
+                reads = tuple(n for n in (want.master, want.parent) if n)
+                if "vxlan_id" in want.attrs:
+                    reads += (f"vni:{want.attrs['vxlan_id']}",)
+                writes = (want.ifname, want.peer) if want.peer else None
+                plan.add(
+                    kind, want.ifname, want.unit, reads=reads, writes=writes, **args
+                )
+            elif want.peer:
+                # 没有create的veth一端随对端一起创建，IFF_UP需要单独设置
+                plan.add(
+                    "link.up", want.ifname, want.unit, reads=(want.ifname,), writes=()
+                )
+            current_addrs: Set[str] = set()
+        else:
+            current_master = snapshot.name_of(actual.master)
+            # master被删除（包括重建）后，从属关系随之解除
+            if current_master in deleted:
+                current_master = ""
+            if want.master and current_master != want.master:
+                plan.add(
+                    "master.set",
+                    want.ifname,
+                    want.unit,
+                    reads=(want.master,),
+                    master=want.master,
+                )
+            elif not want.master and current_master:
+                plan.add(
+                    "master.unset",
+                    want.ifname,
+                    want.unit,
+                    reads=(current_master,),
+                    master=current_master,
+                )
+            if want.address and actual.address != want.address:
+                plan.add("mac.set", want.ifname, want.unit, address=want.address)
+            if not actual.up:
+                plan.add(
+                    "link.up", want.ifname, want.unit, reads=(want.ifname,), writes=()
+                )
+            current_addrs = actual.addrs
+
+        for ip_addr in sorted(current_addrs - want.addrs):
+            plan.add(
+                "addr.del",
+                want.ifname,
+                want.unit,
+                reads=(want.ifname,),
+                writes=(),
+                address=ip_addr,
+            )
+        for ip_addr in sorted(want.addrs - current_addrs):
+            plan.add(
+                "addr.add",
+                want.ifname,
+                want.unit,
+                reads=(want.ifname,),
+                writes=(),
+                address=ip_addr,
+            )
+
+    return plan
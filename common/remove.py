@@ -1,88 +1,172 @@
+from typing import Optional
 from pyroute2 import IPRoute
 from common.rollback_manager import RollbackManager
+from common.batch import NetlinkBatch, submit
+from common.log import log
 
-def remove_vxlan_interface(ipr: IPRoute, rollback: RollbackManager, vni: int) -> bool:
+
+def _delete_link(
+    ipr: IPRoute, batch: Optional[NetlinkBatch], ifname: str, index: int
+):
+    if batch is not None:
+        # 删除接口时内核会先将其关闭，批量模式下省去单独的set down
+        batch.link(ifname, "del", index=index)
+        return
+    ipr.link("set", index=index, state="down")
+    ipr.link("del", index=index)
+
+
+def remove_vxlan_interface(
+    ipr: IPRoute,
+    rollback: RollbackManager,
+    vni: int,
+    batch: Optional[NetlinkBatch] = None,
+) -> bool:
     ifname = f"vxlan{vni}"
-    print(f"Removing VXLAN interface {ifname}")
+    log.debug("Removing VXLAN interface {entity}", entity=ifname)
     try:
         idx = ipr.link_lookup(ifname=ifname)
         if idx:
-            ipr.link("set", index=idx[0], state="down")
-            ipr.link("del", index=idx[0])
+            _delete_link(ipr, batch, ifname, idx[0])
             rollback.record_remove_interface(ifname)
             return True
     except Exception as e:
-        print(f"Error removing VXLAN interface {ifname}: {str(e)}")
+        log.error(
+            "Failed to remove VXLAN interface {entity}",
+            entity=ifname,
+            op="vxlan.del",
+            error=e,
+        )
     return False
 
 
-def remove_bridge(ipr: IPRoute, rollback: RollbackManager, name: str) -> bool:
-    print(f"Removing bridge {name}")
+def remove_bridge(
+    ipr: IPRoute,
+    rollback: RollbackManager,
+    name: str,
+    batch: Optional[NetlinkBatch] = None,
+) -> bool:
+    log.debug("Removing bridge {entity}", entity=name)
     try:
         idx = ipr.link_lookup(ifname=name)
         if idx:
-            ipr.link("set", index=idx[0], state="down")
-            ipr.link("del", index=idx[0])
+            _delete_link(ipr, batch, name, idx[0])
             rollback.record_remove_bridge(name)
             return True
     except Exception as e:
-        print(f"Error removing bridge {name}: {str(e)}")
+        log.error(
+            "Failed to remove bridge {entity}", entity=name, op="bridge.del", error=e
+        )
     return False
 
 
 def remove_vlan_interface(
-    ipr: IPRoute, rollback: RollbackManager, parent: str, vlan_id: int
+    ipr: IPRoute,
+    rollback: RollbackManager,
+    parent: str,
+    vlan_id: int,
+    batch: Optional[NetlinkBatch] = None,
 ) -> bool:
     ifname = f"{parent}.{vlan_id}"
-    print(f"Removing VLAN interface {ifname}")
+    log.debug("Removing VLAN interface {entity}", entity=ifname)
     try:
         idx = ipr.link_lookup(ifname=ifname)
         if idx:
-            ipr.link("set", index=idx[0], state="down")
-            ipr.link("del", index=idx[0])
+            _delete_link(ipr, batch, ifname, idx[0])
             rollback.record_remove_interface(ifname)
             return True
     except Exception as e:
-        print(f"Error removing VLAN interface {ifname}: {str(e)}")
+        log.error(
+            "Failed to remove VLAN interface {entity}",
+            entity=ifname,
+            op="vlan.del",
+            error=e,
+        )
     return False
 
 
-def remove_vrf(ipr: IPRoute, rollback: RollbackManager, name: str) -> bool:
-    print(f"Removing VRF {name}")
+def remove_vrf(
+    ipr: IPRoute,
+    rollback: RollbackManager,
+    name: str,
+    batch: Optional[NetlinkBatch] = None,
+) -> bool:
+    log.debug("Removing VRF {entity}", entity=name)
     try:
         idx = ipr.link_lookup(ifname=name)
         if idx:
-            ipr.link("set", index=idx[0], state="down")
-            ipr.link("del", index=idx[0])
+            _delete_link(ipr, batch, name, idx[0])
             rollback.record_remove_vrf(name)
             return True
     except Exception as e:
-        print(f"Error removing VRF {name}: {str(e)}")
+        log.error("Failed to remove VRF {entity}", entity=name, op="vrf.del", error=e)
     return False
 
 
-def remove_veth(ipr: IPRoute, rollback: RollbackManager, name: str) -> bool:
-    print(f"Removing VETH interface {name}")
+def remove_veth(
+    ipr: IPRoute,
+    rollback: RollbackManager,
+    name: str,
+    batch: Optional[NetlinkBatch] = None,
+) -> bool:
+    log.debug("Removing VETH interface {entity}", entity=name)
     try:
         idx = ipr.link_lookup(ifname=name)
         if idx:
-            ipr.link("set", index=idx[0], state="down")
-            ipr.link("del", index=idx[0])
+            _delete_link(ipr, batch, name, idx[0])
             rollback.record_remove_veth(name)
             return True
     except Exception as e:
-        print(f"Error removing VETH interface {name}: {str(e)}")
+        log.error(
+            "Failed to remove VETH interface {entity}",
+            entity=name,
+            op="veth.del",
+            error=e,
+        )
+    return False
+
+
+def remove_interface(
+    ipr: IPRoute,
+    rollback: RollbackManager,
+    name: str,
+    batch: Optional[NetlinkBatch] = None,
+) -> bool:
+    """按名字删除任意类型的接口"""
+    log.debug("Removing interface {entity}", entity=name)
+    try:
+        idx = ipr.link_lookup(ifname=name)
+        if idx:
+            _delete_link(ipr, batch, name, idx[0])
+            rollback.record_remove_interface(name)
+            return True
+    except Exception as e:
+        log.error(
+            "Failed to remove interface {entity}", entity=name, op="link.del", error=e
+        )
     return False
 
 
 def unassign_ip_address(
-    ipr: IPRoute, rollback: RollbackManager, interface: str, ip_addr: str
+    ipr: IPRoute,
+    rollback: RollbackManager,
+    interface: str,
+    ip_addr: str,
+    batch: Optional[NetlinkBatch] = None,
 ) -> bool:
-    print(f"Removing IP address {ip_addr} from interface {interface}")
+    log.debug(
+        "Removing IP address {address} from interface {entity}",
+        entity=interface,
+        address=ip_addr,
+    )
     try:
         idx = ipr.link_lookup(ifname=interface)
         if idx:
-            ipr.addr(
+            submit(
+                ipr,
+                batch,
+                f"{ip_addr} on {interface}",
+                "addr",
                 "del",
                 index=idx[0],
                 address=ip_addr.split("/")[0],
@@ -91,20 +175,36 @@ def unassign_ip_address(
             rollback.record_remove_ip_assignment(interface, ip_addr)
             return True
     except Exception as e:
-        print(f"Error removing IP {ip_addr} from {interface}: {str(e)}")
+        log.error(
+            "Failed to remove IP {address} from {entity}",
+            entity=interface,
+            address=ip_addr,
+            op="addr.del",
+            error=e,
+        )
     return False
 
 
 def unset_master(
-    ipr: IPRoute, rollback: RollbackManager, slave: str, master: str
+    ipr: IPRoute,
+    rollback: RollbackManager,
+    slave: str,
+    master: str,
+    batch: Optional[NetlinkBatch] = None,
 ) -> bool:
-    print(f"Unsetting master {master} for {slave}")
+    log.debug("Unsetting master {master} for {entity}", entity=slave, master=master)
     try:
         idx = ipr.link_lookup(ifname=slave)
         if idx:
-            ipr.link("set", index=idx[0], master=0)
+            submit(ipr, batch, slave, "link", "set", index=idx[0], master=0)
             rollback.record_remove_master_relation(slave, master)
             return True
     except Exception as e:
-        print(f"Error unsetting master {master} for {slave}: {str(e)}")
+        log.error(
+            "Failed to unset master {master} for {entity}",
+            entity=slave,
+            master=master,
+            op="master.unset",
+            error=e,
+        )
     return False
@@ -0,0 +1,133 @@
+from common.rollback_manager import RollbackManager
+from common.ifindex_cache import AsyncIfIndexCache
+from common.log import log
+
+# common.remove的asyncio版本
+
+
+async def _remove_link(
+    ipr: AsyncIfIndexCache, ifname: str, description: str, op: str
+) -> bool:
+    log.debug("Removing {description} {entity}", entity=ifname, description=description)
+    try:
+        idx = await ipr.link_lookup(ifname=ifname)
+        if idx:
+            # 删除接口时内核会先将其关闭，省去单独的set down
+            await ipr.link("del", index=idx[0])
+            return True
+    except Exception as e:
+        log.error(
+            "Failed to remove {description} {entity}",
+            entity=ifname,
+            description=description,
+            op=op,
+            error=e,
+        )
+    return False
+
+
+async def remove_vxlan_interface(
+    ipr: AsyncIfIndexCache, rollback: RollbackManager, vni: int
+) -> bool:
+    ifname = f"vxlan{vni}"
+    if not await _remove_link(ipr, ifname, "VXLAN interface", "vxlan.del"):
+        return False
+    rollback.record_remove_interface(ifname)
+    return True
+
+
+async def remove_bridge(
+    ipr: AsyncIfIndexCache, rollback: RollbackManager, name: str
+) -> bool:
+    if not await _remove_link(ipr, name, "bridge", "bridge.del"):
+        return False
+    rollback.record_remove_bridge(name)
+    return True
+
+
+async def remove_vlan_interface(
+    ipr: AsyncIfIndexCache, rollback: RollbackManager, parent: str, vlan_id: int
+) -> bool:
+    ifname = f"{parent}.{vlan_id}"
+    if not await _remove_link(ipr, ifname, "VLAN interface", "vlan.del"):
+        return False
+    rollback.record_remove_interface(ifname)
+    return True
+
+
+async def remove_vrf(
+    ipr: AsyncIfIndexCache, rollback: RollbackManager, name: str
+) -> bool:
+    if not await _remove_link(ipr, name, "VRF", "vrf.del"):
+        return False
+    rollback.record_remove_vrf(name)
+    return True
+
+
+async def remove_veth(
+    ipr: AsyncIfIndexCache, rollback: RollbackManager, name: str
+) -> bool:
+    if not await _remove_link(ipr, name, "VETH interface", "veth.del"):
+        return False
+    rollback.record_remove_veth(name)
+    return True
+
+
+async def remove_interface(
+    ipr: AsyncIfIndexCache, rollback: RollbackManager, name: str
+) -> bool:
+    if not await _remove_link(ipr, name, "interface", "link.del"):
+        return False
+    rollback.record_remove_interface(name)
+    return True
+
+
+async def unassign_ip_address(
+    ipr: AsyncIfIndexCache, rollback: RollbackManager, interface: str, ip_addr: str
+) -> bool:
+    log.debug(
+        "Removing IP address {address} from interface {entity}",
+        entity=interface,
+        address=ip_addr,
+    )
+    try:
+        idx = await ipr.link_lookup(ifname=interface)
+        if idx:
+            await ipr.addr(
+                "del",
+                index=idx[0],
+                address=ip_addr.split("/")[0],
+                mask=int(ip_addr.split("/")[1]),
+            )
+            rollback.record_remove_ip_assignment(interface, ip_addr)
+            return True
+    except Exception as e:
+        log.error(
+            "Failed to remove IP {address} from {entity}",
+            entity=interface,
+            address=ip_addr,
+            op="addr.del",
+            error=e,
+        )
+    return False
+
+
+async def unset_master(
+    ipr: AsyncIfIndexCache, rollback: RollbackManager, slave: str, master: str
+) -> bool:
+    log.debug("Unsetting master {master} for {entity}", entity=slave, master=master)
+    try:
+        idx = await ipr.link_lookup(ifname=slave)
+        if idx:
+            await ipr.link("set", index=idx[0], master=0)
+            rollback.record_remove_master_relation(slave, master)
+            return True
+    except Exception as e:
+        log.error(
+            "Failed to unset master {master} for {entity}",
+            entity=slave,
+            master=master,
+            op="master.unset",
+            error=e,
+        )
+    return False
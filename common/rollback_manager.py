@@ -1,154 +1,425 @@
 import os
 import json
-from typing import TypedDict, Literal, List, Dict, Set, Optional
+import time
+from typing import TypedDict, Literal, List, Dict, Set, Optional, Tuple
 from pyroute2 import IPRoute
 from datetime import datetime
+from common.ifindex_cache import IfIndexCache
+from common.batch import NetlinkBatch
+from common.oplog import OperationLog
+from common.log import log
+from common.metrics import op_type
 
+# 回滚时待删除接口临时使用的接口组（IFLA_GROUP），按组一次删除
+ROLLBACK_GROUP = 0x7E5C0000
 
-class RollbackManager:
-    """增强的回滚管理器，支持增量操作"""
-
-    def __init__(self):
-        self.created_interfaces: Set[str] = set()
-        self.created_bridges: Set[str] = set()
-        self.created_vrfs: Set[str] = set()
-        self.created_veths: Set[str] = set()
-        self.assigned_ips: Dict[str, List[str]] = {}
-        self.master_relations: Dict[str, str] = {}
-        self.operations: Dict[str, List[dict]] = {
-            "interfaces": [],
-            "bridges": [],
-            "vrfs": [],
-            "veths": [],
-            "ip_assignments": [],
-            "master_relations": [],
-        }
+
+class OperationRecorder:
+    """record_*方法的公共实现，子类提供_record(category, entry)
+
+    record_*返回记录的(类别, 操作)，请求被内核拒绝时交给withdraw()撤销。
+    """
 
     def record_interface(
         self, ifname: str, vni: Optional[int] = None, vlan_id: Optional[int] = None
     ):
-        self.created_interfaces.add(ifname)
-        self.operations["interfaces"].append(
-            {"name": ifname, "vni": vni, "vlan_id": vlan_id, "action": "add"}
+        return self._record(
+            "interfaces",
+            {"name": ifname, "vni": vni, "vlan_id": vlan_id, "action": "add"},
         )
 
     def record_bridge(self, brname: str, vni: Optional[int] = None):
-        self.created_bridges.add(brname)
-        self.operations["bridges"].append({"name": brname, "vni": vni, "action": "add"})
+        return self._record("bridges", {"name": brname, "vni": vni, "action": "add"})
 
     def record_vrf(self, vrfname: str, vni: Optional[int] = None):
-        self.created_vrfs.add(vrfname)
-        self.operations["vrfs"].append({"name": vrfname, "vni": vni, "action": "add"})
+        return self._record("vrfs", {"name": vrfname, "vni": vni, "action": "add"})
 
     def record_veth(self, vethname: str, vrf: Optional[str] = None):
-        self.created_veths.add(vethname)
-        self.operations["veths"].append({"name": vethname, "vrf": vrf, "action": "add"})
+        return self._record("veths", {"name": vethname, "vrf": vrf, "action": "add"})
 
     def record_ip_assignment(self, ifname: str, ip: str):
-        if ifname not in self.assigned_ips:
-            self.assigned_ips[ifname] = []
-        self.assigned_ips[ifname].append(ip)
-        self.operations["ip_assignments"].append(
-            {"interface": ifname, "ip": ip, "action": "add"}
+        return self._record(
+            "ip_assignments", {"interface": ifname, "ip": ip, "action": "add"}
         )
 
     def record_master_relation(self, slave: str, master: str):
-        self.master_relations[slave] = master
-        self.operations["master_relations"].append(
-            {"slave": slave, "master": master, "action": "add"}
+        return self._record(
+            "master_relations", {"slave": slave, "master": master, "action": "add"}
+        )
+
+    def record_bridge_vlan(
+        self,
+        dev: str,
+        vlan_id: int,
+        vni: Optional[int] = None,
+        bridge_self: bool = False,
+    ):
+        return self._record(
+            "bridge_vlans",
+            {
+                "dev": dev,
+                "flags": "self" if bridge_self else None,
+                "vni": vni,
+                "vlan_id": vlan_id,
+                "action": "add",
+            },
         )
 
+    def record_bridge_vni(self, dev: str, vni: int):
+        return self._record("bridge_vnis", {"dev": dev, "vni": vni, "action": "add"})
+
     def record_remove_interface(self, ifname: str):
-        self.operations["interfaces"].append({"name": ifname, "action": "del"})
+        self._record("interfaces", {"name": ifname, "action": "del"})
 
     def record_remove_bridge(self, brname: str):
-        self.operations["bridges"].append({"name": brname, "action": "del"})
+        self._record("bridges", {"name": brname, "action": "del"})
 
     def record_remove_vrf(self, vrfname: str):
-        self.operations["vrfs"].append({"name": vrfname, "action": "del"})
+        self._record("vrfs", {"name": vrfname, "action": "del"})
 
     def record_remove_veth(self, vethname: str):
-        self.operations["veths"].append({"name": vethname, "action": "del"})
+        self._record("veths", {"name": vethname, "action": "del"})
 
     def record_remove_ip_assignment(self, ifname: str, ip: str):
-        self.operations["ip_assignments"].append(
-            {"interface": ifname, "ip": ip, "action": "del"}
-        )
+        self._record("ip_assignments", {"interface": ifname, "ip": ip, "action": "del"})
 
     def record_remove_master_relation(self, slave: str, master: str):
-        self.operations["master_relations"].append(
-            {"slave": slave, "master": master, "action": "del"}
+        self._record(
+            "master_relations", {"slave": slave, "master": master, "action": "del"}
+        )
+
+
+class UnitRollback(OperationRecorder):
+    """RollbackManager在一个实体（VRF或L2VNI）内的视图
+
+    执行器把它代替RollbackManager传给各配置函数，记录的每条操作都带上
+    所属实体，失败时可以只回滚失败的实体。asyncio引擎中多个实体的操作
+    交错执行，因此实体随记录对象传递，而不是作为管理器的当前状态。
+    """
+
+    __slots__ = ("manager", "unit")
+
+    def __init__(self, manager: "RollbackManager", unit: str):
+        self.manager = manager
+        self.unit = unit
+
+    def _record(self, category: str, entry: dict) -> Tuple[str, dict]:
+        return self.manager._record(category, {**entry, "unit": self.unit})
+
+    def withdraw(self, records: List[Tuple[str, dict]]):
+        self.manager.withdraw(records)
+
+
+class RollbackManager(OperationRecorder):
+    """增强的回滚管理器，支持增量操作
+
+    scope为"all"时任何失败都回滚本次运行的全部操作；为"unit"时执行器
+    继续执行其他实体，只有失败的实体（及依赖它的实体）被回滚。
+    """
+
+    def __init__(self, journal=None, scope: str = "all"):
+        # 全部操作记录，按列紧凑存放；创建的接口等集合在回滚时由它推导
+        self.log = OperationLog()
+        # 操作日志（StateManager.begin()返回的Journal），每条记录同时追加写入
+        self.journal = journal
+        self.checkpoints: List[str] = []
+        self.scope = scope
+        # 每个实体的执行结果："ok"、"failed"，或因依赖失败而"skipped"
+        self.unit_results: Dict[str, str] = {}
+
+    @classmethod
+    def from_operations(
+        cls, operations: dict, journal=None, scope: str = "all"
+    ) -> "RollbackManager":
+        """由保存的操作记录重建回滚管理器，例如中断的运行的操作日志
+
+        operations可以是OperationLog的紧凑格式，也可以是{类别: [dict, ...]}。
+        给出journal时这些记录也写入新的操作日志，继续执行时一并回滚。
+        """
+        manager = cls(journal, scope)
+        if OperationLog.is_compact(operations):
+            entries = OperationLog.from_compact(operations).entries()
+        else:
+            entries = (
+                (category, entry)
+                for (category, items) in operations.items()
+                for entry in items
+            )
+        for category, entry in entries:
+            if entry.get("action") == "withdraw":
+                manager.withdraw([(category, {**entry, "action": "add"})])
+            else:
+                manager._record(category, entry)
+        return manager
+
+    @property
+    def operations(self) -> Dict[str, List[dict]]:
+        """{类别: [dict, ...]}格式的操作记录"""
+        return self.log.to_json()
+
+    @property
+    def created_interfaces(self) -> Set[str]:
+        return {name for (name, _) in self.log.rows("interfaces")}
+
+    @property
+    def created_bridges(self) -> Set[str]:
+        return {name for (name, _) in self.log.rows("bridges")}
+
+    @property
+    def created_vrfs(self) -> Set[str]:
+        return {name for (name, _) in self.log.rows("vrfs")}
+
+    @property
+    def created_veths(self) -> Set[str]:
+        return {name for (name, _) in self.log.rows("veths")}
+
+    @property
+    def created_names(self) -> Set[str]:
+        """本工具创建的全部接口名"""
+        return (
+            self.created_interfaces
+            | self.created_bridges
+            | self.created_vrfs
+            | self.created_veths
+        )
+
+    @property
+    def assigned_ips(self) -> Dict[str, List[str]]:
+        ips: Dict[str, List[str]] = {}
+        for ifname, ip in self.log.rows("ip_assignments"):
+            ips.setdefault(ifname, []).append(ip)
+        return ips
+
+    @property
+    def master_relations(self) -> Dict[str, str]:
+        return dict(self.log.rows("master_relations"))
+
+    def _bridge_entries(self, cache: IfIndexCache, doomed: Set[int]):
+        """保留下来的设备上添加的桥接VLAN和VNI映射，作为删除的BridgeBatch"""
+        from common.svd import BridgeBatch
+
+        batch = BridgeBatch("del", force=True)
+        for dev, flags, vni, vlan_id in self.log.values("bridge_vlans"):
+            idx = cache.index.get(dev)
+            if idx is not None and idx not in doomed:
+                batch.vlan(dev, vlan_id, vni=vni, bridge_self=flags == "self")
+        for dev, _, vni, _ in self.log.values("bridge_vnis"):
+            idx = cache.index.get(dev)
+            if idx is not None and idx not in doomed:
+                batch.vni(vni)
+        return batch
+
+    def _apply(self, category: str, entry: dict):
+        self.log.append(category, entry)
+
+    def _record(self, category: str, entry: dict) -> Tuple[str, dict]:
+        self._apply(category, entry)
+        if self.journal is not None:
+            self.journal.append({"k": category, **entry})
+        return (category, entry)
+
+    def withdraw(self, records: List[Tuple[str, dict]]):
+        """撤销请求被内核拒绝的记录
+
+        记录在请求发出之前写入；内核拒绝时（例如同名接口已存在，EEXIST）接口、
+        地址或master关系都不是本次运行创建的，回滚不能撤销它们。操作日志中
+        追加action为withdraw的记录，重建时同样撤销。
+        """
+        if not records:
+            return
+        self.log.remove(records)
+        if self.journal is not None:
+            for category, entry in records:
+                self.journal.append({"k": category, **entry, "action": "withdraw"})
+
+    def scoped(self, unit: str) -> UnitRollback:
+        return UnitRollback(self, unit)
+
+    def set_unit_result(self, unit: str, result: str):
+        """记录实体的执行结果；一个实体一旦失败，不会再被记为成功"""
+        if self.unit_results.get(unit, "ok") == "ok":
+            self.unit_results[unit] = result
+
+    def failed_units(self) -> Set[str]:
+        return {u for (u, r) in self.unit_results.items() if r != "ok"}
+
+    def report(self):
+        """打印每个实体的执行结果"""
+        failed = self.failed_units()
+        log.info(
+            "Unit report: {committed} committed, {failed} failed",
+            committed=len(self.unit_results) - len(failed),
+            failed=len(failed),
+        )
+        for unit in sorted(failed):
+            log.info("  {unit}: {result}", unit=unit, result=self.unit_results[unit])
+
+    def rollback_units(self, ipr: IPRoute, units: Set[str]):
+        """只回滚给定实体记录的操作，其余实体的操作保留"""
+        log.info(
+            "Rolling back {count} failed units: {units}",
+            count=len(units),
+            units=", ".join(sorted(units)),
         )
+        manager = RollbackManager()
+        for category, entry in self.log.entries():
+            if entry.get("unit") in units:
+                manager._apply(category, entry)
+        manager.rollback(ipr)
+
+    def checkpoint(self, unit: str):
+        """记录一个实体（VRF或L2VNI）的全部操作已经完成，用于中断后继续执行"""
+        self.checkpoints.append(unit)
+        if self.journal is not None:
+            self.journal.append({"k": "checkpoint", "unit": unit})
+
+    def rollback(self, ipr: IPRoute, pipelined: bool = True):
+        """执行回滚操作
+
+        删除接口时内核会一并清除其上的IP地址和master关系，删除veth的一端会连带
+        删除对端，删除父接口会连带删除其上的VLAN子接口：只计算最小的删除集合，
+        IP和master的撤销只针对保留下来的接口。全部ifindex由一次link dump解析。
+
+        要删除的接口先被放入同一个接口组（与其他撤销请求作为一个批次流水线
+        提交），再由一个按组删除的请求一次删除：内核在同一次注销中处理全部
+        接口，而不是每个接口各等待一次RCU同步。
+
+        SVD模式下添加的桥接VLAN和VNI映射只在保留下来的设备上撤销。
+        """
+        log.info("Starting rollback...")
+        start = time.perf_counter()
+        cache = ipr if isinstance(ipr, IfIndexCache) else IfIndexCache(ipr)
+        links = list(cache.ipr.get_links())
+        cache.seed(links)
 
-    def rollback(self, ipr: IPRoute):
-        """执行回滚操作"""
-        print("Starting rollback...")
+        deletes: Dict[str, str] = {}
+        for names, description in (
+            (self.created_veths, "VETH interface"),
+            (self.created_bridges, "bridge"),
+            (self.created_interfaces, "interface"),
+            (self.created_vrfs, "VRF"),
+        ):
+            for name in names:
+                deletes.setdefault(name, description)
+        # 将被删除的接口（含级联删除的）的ifindex：以将被删除的接口为IFLA_LINK的
+        # veth对端和VLAN子接口由内核一并删除
+        doomed = {cache.index[n] for n in deletes if n in cache.index}
+        pending = list(doomed)
+        while pending:
+            for idx in cache.lowers.get(pending.pop(), ()):
+                if idx not in doomed:
+                    doomed.add(idx)
+                    pending.append(idx)
 
-        # 1. 解除master关系
+        batch = NetlinkBatch()
+        skipped = 0
+
+        # 1. 解除保留下来的接口的master关系
         for slave, master in self.master_relations.items():
-            try:
-                idx = ipr.link_lookup(ifname=slave)
-                if idx:
-                    ipr.link("set", index=idx[0], state="down")
-                    ipr.link("set", index=idx[0], master=0)
-                    print(f"Rollback: Unset master for {slave}")
-            except Exception as e:
-                print(f"Rollback error unsetting master for {slave}: {str(e)}")
+            idx = cache.index.get(slave)
+            if idx is None or idx in doomed or cache.index.get(master) in doomed:
+                skipped += 1
+                continue
+            batch.link(
+                f"Unset master for {slave}", "set", index=idx, state="down", master=0
+            )
 
-        # 2. 删除分配的IP地址
+        # 2. 删除保留下来的接口上分配的IP地址
         for ifname, ips in self.assigned_ips.items():
+            idx = cache.index.get(ifname)
+            if idx is None or idx in doomed:
+                skipped += len(ips)
+                continue
             for ip in ips:
-                try:
-                    idx = ipr.link_lookup(ifname=ifname)
-                    if idx:
-                        ipr.addr(
-                            "del",
-                            index=idx[0],
-                            address=ip.split("/")[0],
-                            mask=int(ip.split("/")[1]),
-                        )
-                        print(f"Rollback: Removed IP {ip} from {ifname}")
-                except Exception as e:
-                    print(f"Rollback error removing IP {ip} from {ifname}: {str(e)}")
-
-        # 3. 删除VETH接口
-        for veth in self.created_veths:
-            try:
-                idx = ipr.link_lookup(ifname=veth)
-                if idx:
-                    ipr.link("del", index=idx[0])
-                    print(f"Rollback: Deleted VETH interface {veth}")
-            except Exception as e:
-                print(f"Rollback error deleting VETH {veth}: {str(e)}")
+                batch.addr(
+                    f"Removed IP {ip} from {ifname}",
+                    "del",
+                    index=idx,
+                    address=ip.split("/")[0],
+                    mask=int(ip.split("/")[1]),
+                )
 
-        # 4. 删除桥接接口
-        for br in self.created_bridges:
-            try:
-                idx = ipr.link_lookup(ifname=br)
-                if idx:
-                    ipr.link("del", index=idx[0])
-                    print(f"Rollback: Deleted bridge {br}")
-            except Exception as e:
-                print(f"Rollback error deleting bridge {br}: {str(e)}")
+        # 3. 撤销保留下来的设备上的桥接VLAN和VNI映射（SVD模式）
+        bridge = self._bridge_entries(cache, doomed)
 
-        # 5. 删除VXLAN/VLAN接口
-        for iface in self.created_interfaces:
-            try:
-                idx = ipr.link_lookup(ifname=iface)
-                if idx:
-                    ipr.link("del", index=idx[0])
-                    print(f"Rollback: Deleted interface {iface}")
-            except Exception as e:
-                print(f"Rollback error deleting interface {iface}: {str(e)}")
+        # 4. 要删除的接口放入回滚专用的接口组；veth对端和父接口将被删除的
+        # 子接口由内核级联删除
+        group = _free_group(links, doomed)
+        grouped: List = []
+        chosen: Set[int] = set()
+        for name, description in deletes.items():
+            idx = cache.index.get(name)
+            if idx is None:
+                continue
+            link = cache.links.get(idx)
+            if link in doomed and (link in chosen or cache.links.get(link) != idx):
+                skipped += 1
+                continue
+            chosen.add(idx)
+            grouped.append(
+                batch.link(
+                    f"Deleted {description} {name}", "set", index=idx, group=group
+                )
+            )
+
+        log.info(
+            "Rollback plan: {requests} requests and 1 group delete, "
+            "{skipped} redundant requests skipped ({seconds:.3f}s)",
+            requests=len(batch),
+            skipped=skipped,
+            seconds=time.perf_counter() - start,
+        )
+        if pipelined:
+            batch.run(cache)
+        else:
+            batch.run_sequential(cache)
+        bridge.run(cache)
 
-        # 6. 删除VRF
-        for vrf in self.created_vrfs:
+        # 5. 按组一次删除；内核不支持时逐个删除
+        members = [op for op in grouped if op.error is None]
+        if members:
             try:
-                idx = ipr.link_lookup(ifname=vrf)
-                if idx:
-                    ipr.link("del", index=idx[0])
-                    print(f"Rollback: Deleted VRF {vrf}")
+                cache.link("del", group=group)
             except Exception as e:
-                print(f"Rollback error deleting VRF {vrf}: {str(e)}")
+                log.warning(
+                    "Rollback: group delete failed, deleting one by one",
+                    op="group.del",
+                    error=e,
+                )
+                fallback = NetlinkBatch()
+                for op in members:
+                    fallback.link(op.label, "del", index=op.kwarg["index"])
+                fallback.run(cache)
+                for op, retry in zip(members, fallback.ops):
+                    op.error = retry.error
+            for op in members:
+                cache.update("del", {"index": op.kwarg["index"]}, None)
+
+        failed = 0
+        for op in batch.ops:
+            if op.error is None:
+                log.debug("Rollback: {label}", label=op.label)
+            else:
+                failed += 1
+                log.error(
+                    "Rollback: {label} failed",
+                    label=op.label,
+                    op=op_type(op.target, op.command, op.kwarg),
+                    error=op.error,
+                )
+
+        log.info(
+            "Rollback completed in {seconds:.3f}s: {ok} succeeded, {failed} failed",
+            seconds=time.perf_counter() - start,
+            ok=len(batch) - failed,
+            failed=failed,
+        )
+
 
-        print("Rollback completed.")
+def _free_group(links, doomed: Set[int]) -> int:
+    """选一个只有待删除接口在使用的接口组号，按组删除不会误删其他接口"""
+    used = {link.get("group") for link in links if link.get("index") not in doomed}
+    group = ROLLBACK_GROUP
+    while group in used:
+        group += 1
+    return group
@@ -1,15 +1,84 @@
+from typing import Dict, Iterable, List, Optional, Tuple
 from pyroute2 import IPRoute
+from pyroute2.netlink.exceptions import NetlinkError
+from common.ifindex_cache import IfIndexCache
 from common.rollback_manager import RollbackManager
+from common.batch import NetlinkBatch, submit
+from common.log import log
+from common import iproute2
+
+
+def _master_kwarg(ipr: IPRoute, master: str) -> dict:
+    """原子创建：master已存在时，直接在RTM_NEWLINK中携带IFLA_MASTER
+
+    ifindex都在写入回滚记录之前解析：master或父接口不存在时（IndexError）
+    请求不会发出，也不能留下记录，否则回滚会删除并非本次创建的同名接口。
+    """
+    if not master:
+        return {}
+    return {"master": ipr.link_lookup(ifname=master)[0]}
+
+
+def with_master_record(
+    rollback: RollbackManager, records: list, ifname: str, master: str
+) -> list:
+    """在records中追加创建时携带的master关系的记录"""
+    if master:
+        records.append(rollback.record_master_relation(ifname, master))
+    return records
+
+
+def _submit_recorded(
+    ipr: IPRoute,
+    rollback: RollbackManager,
+    batch: Optional[NetlinkBatch],
+    records: list,
+    label: str,
+    target: str,
+    command: str,
+    **kwarg,
+):
+    """发出已写入回滚记录records的请求
+
+    内核拒绝请求时（例如同名接口已存在，EEXIST）撤销这些记录，回滚不会删除
+    并非本次创建的接口；批量模式下记录随请求保存，由执行器在批次完成后撤销。
+    """
+    try:
+        op = submit(ipr, batch, label, target, command, **kwarg)
+    except NetlinkError:
+        rollback.withdraw(records)
+        raise
+    if batch is not None:
+        op.records = records
+    return op
+
 
 def create_vxlan_interface(
-    ipr: IPRoute, rollback: RollbackManager, vni: int, local_ip: str, group: str = None
+    ipr: IPRoute,
+    rollback: RollbackManager,
+    vni: int,
+    local_ip: str,
+    group: str = None,
+    master: str = "",
+    batch: Optional[NetlinkBatch] = None,
 ) -> str:
     ifname = f"vxlan{vni}"
-    print(f"Creating VXLAN interface {ifname} with VNI {vni}")
+    log.debug(
+        "Creating VXLAN interface {entity} with VNI {vni}", entity=ifname, vni=vni
+    )
 
     try:
-        rollback.record_interface(ifname)
-        ipr.link(
+        kwarg = _master_kwarg(ipr, master)
+        records = with_master_record(
+            rollback, [rollback.record_interface(ifname)], ifname, master
+        )
+        _submit_recorded(
+            ipr,
+            rollback,
+            batch,
+            records,
+            ifname,
+            "link",
             "add",
             ifname=ifname,
             kind="vxlan",
@@ -18,97 +87,450 @@ def create_vxlan_interface(
             vxlan_port=4789,
             vxlan_learning=0,
             vxlan_ttl=64,
+            state="up",
+            **kwarg,
         )
-        ipr.link("set", index=ipr.link_lookup(ifname=ifname)[0], state="up")
         return ifname
     except Exception as e:
-        print(f"Error creating VXLAN interface {ifname}: {str(e)}")
+        log.error(
+            "Failed to create VXLAN interface {entity}",
+            entity=ifname,
+            op="vxlan.add",
+            error=e,
+        )
+        return ""
+
+
+# SVD模式VXLAN设备的iproute2参数；pyroute2不支持IFLA_VXLAN_VNIFILTER，
+# 设备由ip命令创建，之后的master和up仍通过netlink设置
+SVD_VXLAN_ARGS = ("dstport", "4789", "external", "vnifilter", "nolearning", "ttl", "64")
+
+
+def svd_vxlan_argv(name: str, local_ip: str) -> List[str]:
+    return ["ip", "link", "add", name, "type", "vxlan", "local", local_ip] + list(
+        SVD_VXLAN_ARGS
+    )
+
+
+def create_svd_vxlan(
+    ipr: IPRoute,
+    rollback: RollbackManager,
+    name: str,
+    local_ip: str,
+    master: str = "",
+    batch: Optional[NetlinkBatch] = None,
+) -> str:
+    """创建external（collect_metadata）且开启vnifilter的VXLAN设备"""
+    log.debug("Creating SVD VXLAN interface {entity}", entity=name)
+    try:
+        records = [rollback.record_interface(name)]
+        (returncode, stderr) = iproute2.run(ipr, svd_vxlan_argv(name, local_ip))
+        if returncode:
+            rollback.withdraw(records)
+            log.error(
+                "Failed to create SVD VXLAN interface {entity}",
+                entity=name,
+                op="svd.vxlan.add",
+                error=stderr.strip(),
+            )
+            return ""
+        # 接口不是经由缓存创建的，查询时回源内核
+        if isinstance(ipr, IfIndexCache):
+            ipr.unresolved.add(name)
+        # 设备已经创建，此后的失败只撤销master关系的记录
+        index = ipr.link_lookup(ifname=name)[0]
+        kwarg = _master_kwarg(ipr, master)
+        _submit_recorded(
+            ipr,
+            rollback,
+            batch,
+            with_master_record(rollback, [], name, master),
+            name,
+            "link",
+            "set",
+            index=index,
+            state="up",
+            **kwarg,
+        )
+        return name
+    except Exception as e:
+        log.error(
+            "Failed to create SVD VXLAN interface {entity}",
+            entity=name,
+            op="svd.vxlan.add",
+            error=e,
+        )
         return ""
 
 
-def create_bridge(ipr: IPRoute, rollback: RollbackManager, name: str) -> str:
-    print(f"Creating bridge {name}")
+def create_bridge(
+    ipr: IPRoute,
+    rollback: RollbackManager,
+    name: str,
+    master: str = "",
+    address: str = "",
+    vlan_filtering: bool = False,
+    batch: Optional[NetlinkBatch] = None,
+) -> str:
+    log.debug("Creating bridge {entity}", entity=name)
     try:
-        rollback.record_bridge(name)
-        ipr.link("add", ifname=name, kind="bridge")
-        ipr.link("set", index=ipr.link_lookup(ifname=name)[0], state="up")
+        kwarg = _master_kwarg(ipr, master)
+        records = with_master_record(
+            rollback, [rollback.record_bridge(name)], name, master
+        )
+        if address:
+            kwarg["address"] = address
+        if vlan_filtering:
+            kwarg["br_vlan_filtering"] = 1
+        _submit_recorded(
+            ipr,
+            rollback,
+            batch,
+            records,
+            name,
+            "link",
+            "add",
+            ifname=name,
+            kind="bridge",
+            state="up",
+            **kwarg,
+        )
         return name
     except Exception as e:
-        print(f"Error creating bridge {name}: {str(e)}")
+        log.error(
+            "Failed to create bridge {entity}", entity=name, op="bridge.add", error=e
+        )
         return ""
 
 
 def create_vlan_interface(
-    ipr: IPRoute, rollback: RollbackManager, parent: str, vlan_id: int
+    ipr: IPRoute,
+    rollback: RollbackManager,
+    parent: str,
+    vlan_id: int,
+    master: str = "",
+    batch: Optional[NetlinkBatch] = None,
 ) -> str:
     ifname = f"{parent}.{vlan_id}"
-    print(f"Creating VLAN interface {ifname} on {parent}")
+    log.debug(
+        "Creating VLAN interface {entity} on {parent}", entity=ifname, parent=parent
+    )
     try:
-        rollback.record_interface(ifname)
-        ipr.link(
+        link = ipr.link_lookup(ifname=parent)[0]
+        kwarg = _master_kwarg(ipr, master)
+        records = with_master_record(
+            rollback, [rollback.record_interface(ifname)], ifname, master
+        )
+        _submit_recorded(
+            ipr,
+            rollback,
+            batch,
+            records,
+            ifname,
+            "link",
             "add",
             ifname=ifname,
             kind="vlan",
-            link=ipr.link_lookup(ifname=parent)[0],
+            link=link,
             vlan_id=vlan_id,
+            state="up",
+            **kwarg,
         )
-        ipr.link("set", index=ipr.link_lookup(ifname=ifname)[0], state="up")
         return ifname
     except Exception as e:
-        print(f"Error creating VLAN interface {ifname}: {str(e)}")
+        log.error(
+            "Failed to create VLAN interface {entity}",
+            entity=ifname,
+            op="vlan.add",
+            error=e,
+        )
         return ""
 
 
 def create_vrf(
-    ipr: IPRoute, rollback: RollbackManager, name: str, table_id: int
+    ipr: IPRoute,
+    rollback: RollbackManager,
+    name: str,
+    table_id: int,
+    batch: Optional[NetlinkBatch] = None,
 ) -> str:
-    print(f"Creating VRF {name} with table ID {table_id}")
+    log.debug(
+        "Creating VRF {entity} with table ID {table}", entity=name, table=table_id
+    )
     try:
-        rollback.record_vrf(name)
-        ipr.link("add", ifname=name, kind="vrf", vrf_table=table_id)
-        ipr.link("set", index=ipr.link_lookup(ifname=name)[0], state="up")
+        records = [rollback.record_vrf(name)]
+        _submit_recorded(
+            ipr,
+            rollback,
+            batch,
+            records,
+            name,
+            "link",
+            "add",
+            ifname=name,
+            kind="vrf",
+            vrf_table=table_id,
+            state="up",
+        )
         return name
     except Exception as e:
-        print(f"Error creating VRF {name}: {str(e)}")
+        log.error("Failed to create VRF {entity}", entity=name, op="vrf.add", error=e)
         return ""
 
 
-def create_veth(ipr: IPRoute, rollback: RollbackManager, name: str, peername: str):
-    print(f"Creating VETH interface {name}")
+def create_veth(
+    ipr: IPRoute,
+    rollback: RollbackManager,
+    name: str,
+    peername: str,
+    master: str = "",
+    batch: Optional[NetlinkBatch] = None,
+):
+    log.debug("Creating VETH interface {entity}", entity=name)
     try:
-        rollback.record_veth(name)
-        ipr.link("add", ifname=name, peer=peername, kind="veth")
-        ipr.link("set", index=ipr.link_lookup(ifname=name)[0], state="up")
-        ipr.link("set", index=ipr.link_lookup(ifname=peername)[0], state="up")
+        kwarg = _master_kwarg(ipr, master)
+        records = with_master_record(
+            rollback, [rollback.record_veth(name)], name, master
+        )
+        _submit_recorded(
+            ipr,
+            rollback,
+            batch,
+            records,
+            name,
+            "link",
+            "add",
+            ifname=name,
+            peer=peername,
+            kind="veth",
+            state="up",
+            **kwarg,
+        )
+        # 内核不会应用对端的IFF_UP，对端仍需单独设置；
+        # 批量模式下对端尚未创建，由调用方在下一批次调用set_link_up
+        if batch is None:
+            set_link_up(ipr, peername)
         return (name, peername)
     except Exception as e:
-        print(f"Error creating VETH interface {name}: {str(e)}")
+        log.error(
+            "Failed to create VETH interface {entity}",
+            entity=name,
+            op="veth.add",
+            error=e,
+        )
         return ("", "")
 
 
+def set_link_up(
+    ipr: IPRoute, interface: str, batch: Optional[NetlinkBatch] = None
+) -> bool:
+    try:
+        idx = ipr.link_lookup(ifname=interface)[0]
+        submit(ipr, batch, interface, "link", "set", index=idx, state="up")
+        return True
+    except Exception as e:
+        log.error("Failed to set {entity} up", entity=interface, op="link.up", error=e)
+        return False
+
+
+# IFLA_BRIDGE_VLAN_INFO/IFLA_BRIDGE_VLAN_TUNNEL_INFO的flags
+BRIDGE_FLAGS_SELF = 2
+BRIDGE_VLAN_INFO_RANGE_BEGIN = 0x8
+BRIDGE_VLAN_INFO_RANGE_END = 0x10
+# 每条消息携带的VLAN区间上限，4094个互不连续的VLAN也只需几条消息
+VLAN_RANGES_PER_MESSAGE = 512
+
+
+def vlan_ranges(vids: Iterable[int]) -> List[Tuple[int, int]]:
+    """把VLAN ID压缩为连续区间[(起点, 终点), ...]"""
+    ranges: List[Tuple[int, int]] = []
+    for vid in sorted(set(vids)):
+        if ranges and ranges[-1][1] == vid - 1:
+            ranges[-1] = (ranges[-1][0], vid)
+        else:
+            ranges.append((vid, vid))
+    return ranges
+
+
+def tunnel_ranges(tunnels: Dict[int, int]) -> List[Tuple[int, int, int]]:
+    """把VLAN到VNI的映射压缩为[(VLAN起点, VLAN终点, VNI起点), ...]
+
+    VLAN和VNI同时连续的映射（例如VNI=10000+VLAN）合并为一个区间。
+    """
+    ranges: List[Tuple[int, int, int]] = []
+    for vid in sorted(tunnels):
+        vni = tunnels[vid]
+        if ranges:
+            (first, last, first_vni) = ranges[-1]
+            if last == vid - 1 and first_vni + vid - first == vni:
+                ranges[-1] = (first, vid, first_vni)
+                continue
+        ranges.append((vid, vid, vni))
+    return ranges
+
+
+def _vlan_ranges_attrs(
+    vids: Iterable[int], tunnels: Dict[int, int], command: str
+) -> List[list]:
+    """IFLA_AF_SPEC（AF_BRIDGE）中的区间属性，每项为一个区间的1或2个属性"""
+    vlans = []
+    for first, last in vlan_ranges(vids):
+        if first == last:
+            vlans.append([["IFLA_BRIDGE_VLAN_INFO", {"flags": 0, "vid": first}]])
+            continue
+        vlans.append(
+            [
+                [
+                    "IFLA_BRIDGE_VLAN_INFO",
+                    {"flags": BRIDGE_VLAN_INFO_RANGE_BEGIN, "vid": first},
+                ],
+                [
+                    "IFLA_BRIDGE_VLAN_INFO",
+                    {"flags": BRIDGE_VLAN_INFO_RANGE_END, "vid": last},
+                ],
+            ]
+        )
+
+    def tunnel(vid: int, vni: int, flags: int) -> list:
+        attrs = [
+            ["IFLA_BRIDGE_VLAN_TUNNEL_ID", vni],
+            ["IFLA_BRIDGE_VLAN_TUNNEL_VID", vid],
+        ]
+        if flags:
+            attrs.append(["IFLA_BRIDGE_VLAN_TUNNEL_FLAGS", flags])
+        return ["IFLA_BRIDGE_VLAN_TUNNEL_INFO", {"attrs": attrs}]
+
+    maps = []
+    for first, last, vni in tunnel_ranges(tunnels):
+        if first == last:
+            maps.append([tunnel(first, vni, 0)])
+        else:
+            maps.append(
+                [
+                    tunnel(first, vni, BRIDGE_VLAN_INFO_RANGE_BEGIN),
+                    tunnel(last, vni + last - first, BRIDGE_VLAN_INFO_RANGE_END),
+                ]
+            )
+    # 隧道映射要求VLAN已存在：添加时先VLAN后映射，删除时相反
+    return vlans + maps if command == "add" else maps + vlans
+
+
+def vlan_messages(
+    vids: Iterable[int],
+    tunnels: Optional[Dict[int, int]] = None,
+    command: str = "add",
+    bridge_self: bool = False,
+) -> List[dict]:
+    """批量设置VLAN所需的各条消息的IFLA_AF_SPEC，区间不会被拆到两条消息中"""
+    ranges = _vlan_ranges_attrs(vids, tunnels or {}, command)
+    messages = []
+    for i in range(0, len(ranges), VLAN_RANGES_PER_MESSAGE):
+        attrs = [["IFLA_BRIDGE_FLAGS", BRIDGE_FLAGS_SELF]] if bridge_self else []
+        for attr in ranges[i : i + VLAN_RANGES_PER_MESSAGE]:
+            attrs += attr
+        messages.append({"attrs": attrs})
+    return messages
+
+
+def set_bridge_vlans(
+    ipr: IPRoute,
+    interface: str,
+    vids: Iterable[int],
+    tunnels: Optional[Dict[int, int]] = None,
+    command: str = "add",
+    bridge_self: bool = False,
+    batch: Optional[NetlinkBatch] = None,
+) -> bool:
+    """批量设置桥接端口（bridge_self时为桥接自身）的VLAN及VLAN到VNI的映射
+
+    连续的VLAN合并为区间，通过AF_BRIDGE的RTM_SETLINK/RTM_DELLINK一次提交，
+    上千个VLAN只需几条消息。VLAN随端口离开桥接或设备删除而消失，不需要回滚记录。
+    """
+    messages = vlan_messages(vids, tunnels, command, bridge_self)
+    log.debug(
+        "Setting VLANs ({command}) on {entity} in {messages} messages",
+        entity=interface,
+        command=command,
+        messages=len(messages),
+    )
+    try:
+        idx = ipr.link_lookup(ifname=interface)[0]
+        for af_spec in messages:
+            submit(
+                ipr,
+                batch,
+                interface,
+                "vlan_filter",
+                command,
+                index=idx,
+                IFLA_AF_SPEC=af_spec,
+            )
+        return True
+    except Exception as e:
+        log.error(
+            "Failed to set VLANs on {entity}",
+            entity=interface,
+            op=f"bridge_vlan.{command}",
+            error=e,
+        )
+        return False
+
+
 def add_interface_to_bridge(
     ipr: IPRoute, rollback: RollbackManager, bridge: str, interface: str
 ) -> bool:
-    print(f"Adding interface {interface} to bridge {bridge}")
+    log.debug(
+        "Adding interface {entity} to bridge {bridge}", entity=interface, bridge=bridge
+    )
     try:
-        rollback.record_master_relation(interface, bridge)
         bridge_idx = ipr.link_lookup(ifname=bridge)[0]
         iface_idx = ipr.link_lookup(ifname=interface)[0]
-        ipr.link("set", index=iface_idx, master=bridge_idx)
+        records = [rollback.record_master_relation(interface, bridge)]
+        _submit_recorded(
+            ipr,
+            rollback,
+            None,
+            records,
+            interface,
+            "link",
+            "set",
+            index=iface_idx,
+            master=bridge_idx,
+        )
         return True
     except Exception as e:
-        print(f"Error adding {interface} to bridge {bridge}: {str(e)}")
+        log.error(
+            "Failed to add {entity} to bridge {bridge}",
+            entity=interface,
+            bridge=bridge,
+            op="master.set",
+            error=e,
+        )
         return False
 
 
 def assign_ip_address(
-    ipr: IPRoute, rollback: RollbackManager, interface: str, ip_addr: str
+    ipr: IPRoute,
+    rollback: RollbackManager,
+    interface: str,
+    ip_addr: str,
+    batch: Optional[NetlinkBatch] = None,
 ) -> bool:
-    print(f"Assigning IP address {ip_addr} to interface {interface}")
+    log.debug(
+        "Assigning IP address {address} to interface {entity}",
+        entity=interface,
+        address=ip_addr,
+    )
     try:
-        rollback.record_ip_assignment(interface, ip_addr)
         idx = ipr.link_lookup(ifname=interface)[0]
-        ipr.addr(
+        records = [rollback.record_ip_assignment(interface, ip_addr)]
+        _submit_recorded(
+            ipr,
+            rollback,
+            batch,
+            records,
+            f"{ip_addr} on {interface}",
+            "addr",
             "add",
             index=idx,
             address=ip_addr.split("/")[0],
@@ -116,33 +538,72 @@ def assign_ip_address(
         )
         return True
     except Exception as e:
-        print(f"Error assigning IP {ip_addr} to {interface}: {str(e)}")
+        log.error(
+            "Failed to assign IP {address} to {entity}",
+            entity=interface,
+            address=ip_addr,
+            op="addr.add",
+            error=e,
+        )
         return False
 
 
 def set_mac_address(
-    ipr: IPRoute, rollback: RollbackManager, interface: str, mac_addr: str
+    ipr: IPRoute,
+    rollback: RollbackManager,
+    interface: str,
+    mac_addr: str,
+    batch: Optional[NetlinkBatch] = None,
 ) -> bool:
-    print(f"Setting MAC address {mac_addr} for interface {interface}")
+    log.debug(
+        "Setting MAC address {address} for interface {entity}",
+        entity=interface,
+        address=mac_addr,
+    )
     try:
         idx = ipr.link_lookup(ifname=interface)[0]
-        ipr.link("set", index=idx, address=mac_addr)
+        submit(ipr, batch, interface, "link", "set", index=idx, address=mac_addr)
         return True
     except Exception as e:
-        print(f"Error setting MAC address for {interface}: {str(e)}")
+        log.error(
+            "Failed to set MAC address for {entity}",
+            entity=interface,
+            op="mac.set",
+            error=e,
+        )
         return False
 
 
 def set_master(
-    ipr: IPRoute, rollback: RollbackManager, interface: str, master: str
+    ipr: IPRoute,
+    rollback: RollbackManager,
+    interface: str,
+    master: str,
+    batch: Optional[NetlinkBatch] = None,
 ) -> bool:
-    print(f"Setting {interface} master to {master}")
+    log.debug("Setting {entity} master to {master}", entity=interface, master=master)
     try:
-        rollback.record_master_relation(interface, master)
         iface_idx = ipr.link_lookup(ifname=interface)[0]
         master_idx = ipr.link_lookup(ifname=master)[0]
-        ipr.link("set", index=iface_idx, master=master_idx)
+        records = [rollback.record_master_relation(interface, master)]
+        _submit_recorded(
+            ipr,
+            rollback,
+            batch,
+            records,
+            interface,
+            "link",
+            "set",
+            index=iface_idx,
+            master=master_idx,
+        )
         return True
     except Exception as e:
-        print(f"Error setting {interface} master to {master}: {str(e)}")
+        log.error(
+            "Failed to set {entity} master to {master}",
+            entity=interface,
+            master=master,
+            op="master.set",
+            error=e,
+        )
         return False
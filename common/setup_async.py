@@ -0,0 +1,407 @@
+from pyroute2.netlink.exceptions import NetlinkError
+from common.rollback_manager import RollbackManager
+from common.ifindex_cache import AsyncIfIndexCache
+from common.log import log
+from common import iproute2
+from common.setup import svd_vxlan_argv, vlan_messages, with_master_record
+
+# common.setup的asyncio版本。与同步版本一样，回滚记录总是在请求发出之前写入：
+# 并发任务被取消或失败时，已发出的请求一定有对应的记录可以回滚；只有内核明确
+# 拒绝的请求（NetlinkError）撤销其记录。
+
+
+async def _master_kwarg(ipr: AsyncIfIndexCache, master: str) -> dict:
+    """与common.setup._master_kwarg一样，在写入回滚记录之前解析master"""
+    if not master:
+        return {}
+    return {"master": (await ipr.link_lookup(ifname=master))[0]}
+
+
+async def _submit_recorded(
+    ipr: AsyncIfIndexCache,
+    rollback: RollbackManager,
+    records: list,
+    target: str,
+    command: str,
+    **kwarg,
+):
+    """common.setup._submit_recorded的asyncio版本：内核拒绝请求时撤销records"""
+    try:
+        return await getattr(ipr, target)(command, **kwarg)
+    except NetlinkError:
+        rollback.withdraw(records)
+        raise
+
+
+async def create_vxlan_interface(
+    ipr: AsyncIfIndexCache,
+    rollback: RollbackManager,
+    vni: int,
+    local_ip: str,
+    group: str = None,
+    master: str = "",
+) -> str:
+    ifname = f"vxlan{vni}"
+    log.debug(
+        "Creating VXLAN interface {entity} with VNI {vni}", entity=ifname, vni=vni
+    )
+
+    try:
+        kwarg = await _master_kwarg(ipr, master)
+        records = with_master_record(
+            rollback, [rollback.record_interface(ifname)], ifname, master
+        )
+        await _submit_recorded(
+            ipr,
+            rollback,
+            records,
+            "link",
+            "add",
+            ifname=ifname,
+            kind="vxlan",
+            vxlan_id=vni,
+            vxlan_local=local_ip,
+            vxlan_port=4789,
+            vxlan_learning=0,
+            vxlan_ttl=64,
+            state="up",
+            **kwarg,
+        )
+        return ifname
+    except Exception as e:
+        log.error(
+            "Failed to create VXLAN interface {entity}",
+            entity=ifname,
+            op="vxlan.add",
+            error=e,
+        )
+        return ""
+
+
+async def create_svd_vxlan(
+    ipr: AsyncIfIndexCache,
+    rollback: RollbackManager,
+    name: str,
+    local_ip: str,
+    master: str = "",
+) -> str:
+    log.debug("Creating SVD VXLAN interface {entity}", entity=name)
+    try:
+        records = [rollback.record_interface(name)]
+        (returncode, stderr) = await iproute2.run_async(
+            ipr, svd_vxlan_argv(name, local_ip)
+        )
+        if returncode:
+            rollback.withdraw(records)
+            log.error(
+                "Failed to create SVD VXLAN interface {entity}",
+                entity=name,
+                op="svd.vxlan.add",
+                error=stderr.strip(),
+            )
+            return ""
+        ipr.unresolved.add(name)
+        # 设备已经创建，此后的失败只撤销master关系的记录
+        index = (await ipr.link_lookup(ifname=name))[0]
+        kwarg = await _master_kwarg(ipr, master)
+        await _submit_recorded(
+            ipr,
+            rollback,
+            with_master_record(rollback, [], name, master),
+            "link",
+            "set",
+            index=index,
+            state="up",
+            **kwarg,
+        )
+        return name
+    except Exception as e:
+        log.error(
+            "Failed to create SVD VXLAN interface {entity}",
+            entity=name,
+            op="svd.vxlan.add",
+            error=e,
+        )
+        return ""
+
+
+async def create_bridge(
+    ipr: AsyncIfIndexCache,
+    rollback: RollbackManager,
+    name: str,
+    master: str = "",
+    address: str = "",
+    vlan_filtering: bool = False,
+) -> str:
+    log.debug("Creating bridge {entity}", entity=name)
+    try:
+        kwarg = await _master_kwarg(ipr, master)
+        records = with_master_record(
+            rollback, [rollback.record_bridge(name)], name, master
+        )
+        if address:
+            kwarg["address"] = address
+        if vlan_filtering:
+            kwarg["br_vlan_filtering"] = 1
+        await _submit_recorded(
+            ipr,
+            rollback,
+            records,
+            "link",
+            "add",
+            ifname=name,
+            kind="bridge",
+            state="up",
+            **kwarg,
+        )
+        return name
+    except Exception as e:
+        log.error(
+            "Failed to create bridge {entity}", entity=name, op="bridge.add", error=e
+        )
+        return ""
+
+
+async def create_vlan_interface(
+    ipr: AsyncIfIndexCache,
+    rollback: RollbackManager,
+    parent: str,
+    vlan_id: int,
+    master: str = "",
+) -> str:
+    ifname = f"{parent}.{vlan_id}"
+    log.debug(
+        "Creating VLAN interface {entity} on {parent}", entity=ifname, parent=parent
+    )
+    try:
+        link = (await ipr.link_lookup(ifname=parent))[0]
+        kwarg = await _master_kwarg(ipr, master)
+        records = with_master_record(
+            rollback, [rollback.record_interface(ifname)], ifname, master
+        )
+        await _submit_recorded(
+            ipr,
+            rollback,
+            records,
+            "link",
+            "add",
+            ifname=ifname,
+            kind="vlan",
+            link=link,
+            vlan_id=vlan_id,
+            state="up",
+            **kwarg,
+        )
+        return ifname
+    except Exception as e:
+        log.error(
+            "Failed to create VLAN interface {entity}",
+            entity=ifname,
+            op="vlan.add",
+            error=e,
+        )
+        return ""
+
+
+async def create_vrf(
+    ipr: AsyncIfIndexCache, rollback: RollbackManager, name: str, table_id: int
+) -> str:
+    log.debug(
+        "Creating VRF {entity} with table ID {table}", entity=name, table=table_id
+    )
+    try:
+        records = [rollback.record_vrf(name)]
+        await _submit_recorded(
+            ipr,
+            rollback,
+            records,
+            "link",
+            "add",
+            ifname=name,
+            kind="vrf",
+            vrf_table=table_id,
+            state="up",
+        )
+        return name
+    except Exception as e:
+        log.error("Failed to create VRF {entity}", entity=name, op="vrf.add", error=e)
+        return ""
+
+
+async def create_veth(
+    ipr: AsyncIfIndexCache,
+    rollback: RollbackManager,
+    name: str,
+    peername: str,
+    master: str = "",
+):
+    log.debug("Creating VETH interface {entity}", entity=name)
+    try:
+        kwarg = await _master_kwarg(ipr, master)
+        records = with_master_record(
+            rollback, [rollback.record_veth(name)], name, master
+        )
+        await _submit_recorded(
+            ipr,
+            rollback,
+            records,
+            "link",
+            "add",
+            ifname=name,
+            peer=peername,
+            kind="veth",
+            state="up",
+            **kwarg,
+        )
+        return (name, peername)
+    except Exception as e:
+        log.error(
+            "Failed to create VETH interface {entity}",
+            entity=name,
+            op="veth.add",
+            error=e,
+        )
+        return ("", "")
+
+
+async def set_link_up(ipr: AsyncIfIndexCache, interface: str) -> bool:
+    try:
+        idx = (await ipr.link_lookup(ifname=interface))[0]
+        await ipr.link("set", index=idx, state="up")
+        return True
+    except Exception as e:
+        log.error("Failed to set {entity} up", entity=interface, op="link.up", error=e)
+        return False
+
+
+async def set_bridge_vlans(
+    ipr: AsyncIfIndexCache,
+    interface: str,
+    vids,
+    tunnels=None,
+    command: str = "add",
+    bridge_self: bool = False,
+) -> bool:
+    messages = vlan_messages(vids, tunnels, command, bridge_self)
+    log.debug(
+        "Setting VLANs ({command}) on {entity} in {messages} messages",
+        entity=interface,
+        command=command,
+        messages=len(messages),
+    )
+    try:
+        idx = (await ipr.link_lookup(ifname=interface))[0]
+        for af_spec in messages:
+            await ipr.vlan_filter(command, index=idx, IFLA_AF_SPEC=af_spec)
+        return True
+    except Exception as e:
+        log.error(
+            "Failed to set VLANs on {entity}",
+            entity=interface,
+            op=f"bridge_vlan.{command}",
+            error=e,
+        )
+        return False
+
+
+async def add_interface_to_bridge(
+    ipr: AsyncIfIndexCache, rollback: RollbackManager, bridge: str, interface: str
+) -> bool:
+    log.debug(
+        "Adding interface {entity} to bridge {bridge}", entity=interface, bridge=bridge
+    )
+    try:
+        bridge_idx = (await ipr.link_lookup(ifname=bridge))[0]
+        iface_idx = (await ipr.link_lookup(ifname=interface))[0]
+        records = [rollback.record_master_relation(interface, bridge)]
+        await _submit_recorded(
+            ipr, rollback, records, "link", "set", index=iface_idx, master=bridge_idx
+        )
+        return True
+    except Exception as e:
+        log.error(
+            "Failed to add {entity} to bridge {bridge}",
+            entity=interface,
+            bridge=bridge,
+            op="master.set",
+            error=e,
+        )
+        return False
+
+
+async def assign_ip_address(
+    ipr: AsyncIfIndexCache, rollback: RollbackManager, interface: str, ip_addr: str
+) -> bool:
+    log.debug(
+        "Assigning IP address {address} to interface {entity}",
+        entity=interface,
+        address=ip_addr,
+    )
+    try:
+        idx = (await ipr.link_lookup(ifname=interface))[0]
+        records = [rollback.record_ip_assignment(interface, ip_addr)]
+        await _submit_recorded(
+            ipr,
+            rollback,
+            records,
+            "addr",
+            "add",
+            index=idx,
+            address=ip_addr.split("/")[0],
+            mask=int(ip_addr.split("/")[1]),
+        )
+        return True
+    except Exception as e:
+        log.error(
+            "Failed to assign IP {address} to {entity}",
+            entity=interface,
+            address=ip_addr,
+            op="addr.add",
+            error=e,
+        )
+        return False
+
+
+async def set_mac_address(
+    ipr: AsyncIfIndexCache, rollback: RollbackManager, interface: str, mac_addr: str
+) -> bool:
+    log.debug(
+        "Setting MAC address {address} for interface {entity}",
+        entity=interface,
+        address=mac_addr,
+    )
+    try:
+        idx = (await ipr.link_lookup(ifname=interface))[0]
+        await ipr.link("set", index=idx, address=mac_addr)
+        return True
+    except Exception as e:
+        log.error(
+            "Failed to set MAC address for {entity}",
+            entity=interface,
+            op="mac.set",
+            error=e,
+        )
+        return False
+
+
+async def set_master(
+    ipr: AsyncIfIndexCache, rollback: RollbackManager, interface: str, master: str
+) -> bool:
+    log.debug("Setting {entity} master to {master}", entity=interface, master=master)
+    try:
+        iface_idx = (await ipr.link_lookup(ifname=interface))[0]
+        master_idx = (await ipr.link_lookup(ifname=master))[0]
+        records = [rollback.record_master_relation(interface, master)]
+        await _submit_recorded(
+            ipr, rollback, records, "link", "set", index=iface_idx, master=master_idx
+        )
+        return True
+    except Exception as e:
+        log.error(
+            "Failed to set {entity} master to {master}",
+            entity=interface,
+            master=master,
+            op="master.set",
+            error=e,
+        )
+        return False
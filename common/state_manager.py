@@ -1,39 +1,258 @@
 import os
 import json
+import time
 from typing import TypedDict, Literal, List, Dict, Set, Optional
-from pyroute2 import IPRoute
 from datetime import datetime
+from common.types import CompiledConf, compile_config
+from common.state_sqlite import SqliteStateStore
+from common.log import log
 
-STATE_FILE = os.path.join(
+# 可以通过环境变量把状态文件放到源码目录之外，例如/var/lib下
+STATE_FILE = os.environ.get("VXLANBGP_STATE_FILE") or os.path.join(
     os.path.dirname(os.path.abspath(__file__)), "vxlan_bgp_evpn_state.json"
 )
+JOURNAL_FILE = STATE_FILE + ".journal"
+# 状态后端：json为单个状态文件（默认），sqlite为保留历史的数据库STATE_DB
+STATE_BACKEND = os.environ.get("VXLANBGP_STATE_BACKEND", "json")
+STATE_DB = os.environ.get("VXLANBGP_STATE_DB") or (
+    os.path.splitext(STATE_FILE)[0] + ".db"
+)
+
+
+class Journal:
+    """追加写的操作日志（write-ahead log）
+
+    每条操作在对应的netlink请求发出之前写成一行紧凑的JSON，并立即write()
+    到内核：进程崩溃或被OOM杀掉时，已记录的操作不会丢失。fsync按批进行
+    （每sync_every条或每sync_interval秒一次），只在掉电时可能丢失最后一批。
+    """
+
+    def __init__(self, path: str, sync_every: int = 64, sync_interval: float = 0.1):
+        self.path = path
+        self.sync_every = sync_every
+        self.sync_interval = sync_interval
+        self.pending = 0
+        self.last_sync = time.monotonic()
+        self.fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+
+    def append(self, record: dict):
+        os.write(self.fd, (json.dumps(record, separators=(",", ":")) + "\n").encode())
+        self.pending += 1
+        if (
+            self.pending >= self.sync_every
+            or time.monotonic() - self.last_sync >= self.sync_interval
+        ):
+            self.sync()
+
+    def sync(self):
+        if self.pending:
+            os.fsync(self.fd)
+            self.pending = 0
+        self.last_sync = time.monotonic()
+
+    def close(self):
+        if self.fd is not None:
+            self.sync()
+            os.close(self.fd)
+            self.fd = None
+
+    @staticmethod
+    def replay(path: str) -> List[dict]:
+        """读取日志中的全部记录；崩溃时写了一半的最后一行被忽略"""
+        records: List[dict] = []
+        try:
+            with open(path, "r") as f:
+                for line in f:
+                    try:
+                        records.append(json.loads(line))
+                    except ValueError:
+                        break
+        except FileNotFoundError:
+            pass
+        return records
+
+
+def write_atomic(path: str, data: str):
+    """先写临时文件并fsync，再rename覆盖：读者只会看到完整的旧文件或新文件"""
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    dir_fd = os.open(os.path.dirname(path) or ".", os.O_RDONLY)
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
 
 
 class StateManager:
-    """状态管理器，用于记录和读取执行状态"""
+    """状态管理器，用于记录和读取执行状态
+
+    状态由两部分组成：上次完成的运行的快照（STATE_FILE），以及当前运行的
+    操作日志（JOURNAL_FILE）。运行结束时快照被原子地替换，日志随之删除；
+    启动时日志仍然存在，说明上次运行在中途中断。STATE_BACKEND为sqlite时
+    快照改为追加到SQLite数据库，保留每次运行的历史。
+    """
 
     @staticmethod
     def load_state() -> Optional[dict]:
-        """加载上次执行的状态"""
+        """加载上次执行的状态
+
+        上次运行中断时，返回由日志重建的状态：success为False，interrupted为True，
+        operations为中断前已经记录（并可能已经发出）的全部操作，checkpoints为
+        已完成的实体，previous为中断之前最后一次保存的快照。
+        """
+        snapshot = StateManager._load_snapshot()
+        records = Journal.replay(JOURNAL_FILE)
+        if not records or records[0].get("k") != "begin":
+            return snapshot
+
+        operations: Dict[str, List[dict]] = {}
+        checkpoints: List[str] = []
+        for record in records[1:]:
+            record = dict(record)
+            kind = record.pop("k")
+            if kind == "checkpoint":
+                checkpoints.append(record["unit"])
+            else:
+                operations.setdefault(kind, []).append(record)
+        return {
+            "timestamp": records[0].get("timestamp"),
+            "config": records[0].get("config", {}),
+            "success": False,
+            "interrupted": True,
+            "operations": operations,
+            "checkpoints": checkpoints,
+            "previous": snapshot,
+        }
+
+    @staticmethod
+    def _load_snapshot() -> Optional[dict]:
         try:
+            if STATE_BACKEND == "sqlite":
+                if not os.path.exists(STATE_DB):
+                    return None
+                store = SqliteStateStore(STATE_DB)
+                try:
+                    return store.load_state()
+                finally:
+                    store.close()
             if os.path.exists(STATE_FILE):
                 with open(STATE_FILE, "r") as f:
                     return json.load(f)
         except Exception as e:
-            print(f"Warning: Failed to load state file: {str(e)}")
+            log.warning("Failed to load state file", error=e)
         return None
 
     @staticmethod
-    def save_state(config: dict, success: bool, operations: dict):
-        """保存当前执行状态"""
+    def last_config(
+        last_state: Optional[dict], conf: CompiledConf
+    ) -> Optional[CompiledConf]:
+        """上次运行的配置，编译时复用保存的摘要
+
+        SQLite后端的状态不含配置，只从数据库读取与本次配置不同的条目。
+        """
+        if not last_state:
+            return None
+        if "config" in last_state:
+            return compile_config(
+                last_state["config"], conf.overlay_eth, last_state.get("digests")
+            )
+        if "run_id" in last_state:
+            store = SqliteStateStore(STATE_DB)
+            try:
+                return store.last_config(last_state["run_id"], conf)
+            finally:
+                store.close()
+        return None
+
+    @staticmethod
+    def created_names(last_state: Optional[dict]) -> Set[str]:
+        """上次运行的操作记录中由本工具创建的接口名
+
+        上次运行中断时同时包括中断之前的快照的记录。
+        """
+        from common.rollback_manager import RollbackManager
+
+        names: Set[str] = set()
+        for state in (last_state, (last_state or {}).get("previous")):
+            if not state:
+                continue
+            if "operations" in state:
+                operations = RollbackManager.from_operations(state["operations"])
+                names |= operations.created_names
+            elif "run_id" in state:
+                store = SqliteStateStore(STATE_DB)
+                try:
+                    names |= store.created_names(state["run_id"])
+                finally:
+                    store.close()
+        return names
+
+    @staticmethod
+    def begin(config: dict) -> Optional[Journal]:
+        """开始一次运行：创建操作日志并写入本次的配置"""
+        try:
+            journal = Journal(JOURNAL_FILE)
+            journal.append(
+                {"k": "begin", "timestamp": datetime.now().isoformat(), "config": config}
+            )
+            journal.sync()
+            return journal
+        except Exception as e:
+            log.warning("Failed to open journal file", error=e)
+            return None
+
+    @staticmethod
+    def save_state(
+        config: dict,
+        success: bool,
+        operations: dict,
+        digests: Optional[dict] = None,
+        kernel_marker: Optional[str] = None,
+        journal: Optional[Journal] = None,
+        failed_units: Optional[List[str]] = None,
+        duration: Optional[float] = None,
+    ):
+        """保存当前执行状态，同时保存配置及其每个条目的摘要
+
+        kernel_marker为成功执行后的内核状态标记，供下次运行判断能否跳过。
+        部分成功时config只包含已提交的实体，failed_units为已回滚的实体。
+        duration为本次执行的耗时（秒）。
+        快照写入成功后关闭并删除本次运行的操作日志。
+        """
         state = {
             "timestamp": datetime.now().isoformat(),
             "config": config,
+            "digests": digests or compile_config(config).digests(),
             "success": success,
             "operations": operations,
+            "kernel_marker": kernel_marker,
+            "duration": duration,
         }
+        if failed_units:
+            state["partial"] = True
+            state["failed_units"] = failed_units
+        try:
+            if STATE_BACKEND == "sqlite":
+                store = SqliteStateStore(STATE_DB)
+                try:
+                    store.save_state(state)
+                finally:
+                    store.close()
+            else:
+                write_atomic(STATE_FILE, json.dumps(state, separators=(",", ":")))
+        except Exception as e:
+            log.warning("Failed to save state file", error=e)
+            return
+
+        if journal is not None:
+            journal.close()
         try:
-            with open(STATE_FILE, "w") as f:
-                json.dump(state, f, indent=2)
+            os.remove(JOURNAL_FILE)
+        except FileNotFoundError:
+            pass
         except Exception as e:
-            print(f"Warning: Failed to save state file: {str(e)}")
+            log.warning("Failed to remove journal file", error=e)
@@ -0,0 +1,305 @@
+"""SQLite状态存储：保留每次运行的历史，按VNI、接口名和运行编号建立索引
+
+查询某个接口最近一次被改动的时间，以及每次运行的耗时：
+
+    python -m common.state_sqlite --last-changed br-vsi10100
+    python -m common.state_sqlite --history 20
+"""
+
+import json
+import sqlite3
+from typing import List, Optional, Set
+from common.types import CompiledConf, EnvConf, compile_config
+from common.oplog import OperationLog
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    timestamp TEXT NOT NULL,
+    mode TEXT,
+    underlay_eth TEXT,
+    overlay_eth TEXT,
+    config_digest TEXT,
+    success INTEGER NOT NULL,
+    kernel_marker TEXT,
+    failed_units TEXT,
+    duration REAL
+);
+-- 配置条目按摘要去重保存，内容不变的条目在多次运行之间只存一份
+CREATE TABLE IF NOT EXISTS entries (
+    digest TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    vni INTEGER,
+    body TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_vni ON entries(vni);
+-- 每次运行的配置由哪些条目组成
+CREATE TABLE IF NOT EXISTS run_entries (
+    run_id INTEGER NOT NULL,
+    kind TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    digest TEXT NOT NULL,
+    PRIMARY KEY (run_id, kind, position)
+);
+CREATE INDEX IF NOT EXISTS run_entries_digest ON run_entries(run_id, digest);
+CREATE TABLE IF NOT EXISTS operations (
+    run_id INTEGER NOT NULL,
+    seq INTEGER NOT NULL,
+    category TEXT NOT NULL,
+    action TEXT NOT NULL,
+    name TEXT,
+    peer TEXT,
+    vni INTEGER,
+    vlan_id INTEGER,
+    unit TEXT,
+    PRIMARY KEY (run_id, seq)
+);
+CREATE INDEX IF NOT EXISTS operations_name ON operations(name);
+CREATE INDEX IF NOT EXISTS operations_vni ON operations(vni);
+"""
+
+# 每个类别中作为接口名和对端（IP、master、VRF）保存的字段
+NAME_FIELDS = {
+    "interfaces": ("name", None),
+    "bridges": ("name", None),
+    "vrfs": ("name", None),
+    "veths": ("name", "vrf"),
+    "ip_assignments": ("interface", "ip"),
+    "master_relations": ("slave", "master"),
+    "bridge_vlans": ("dev", "flags"),
+    "bridge_vnis": ("dev", None),
+}
+
+
+class SqliteStateStore:
+    """StateManager的SQLite后端
+
+    与JSON状态文件不同，每次运行追加一条记录而不是覆盖；加载时只读取最近
+    一次运行的摘要和标记，上次的配置由last_config()按需取出变化的条目。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=FULL")
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def load_state(self) -> Optional[dict]:
+        """最近一次运行的状态，不含配置和操作记录"""
+        row = self.db.execute(
+            "SELECT id, timestamp, config_digest, success, kernel_marker, "
+            "failed_units, duration FROM runs ORDER BY id DESC LIMIT 1"
+        ).fetchone()
+        if row is None:
+            return None
+        (run_id, timestamp, digest, success, marker, failed_units, duration) = row
+        state = {
+            "run_id": run_id,
+            "timestamp": timestamp,
+            "digests": {"config": digest},
+            "success": bool(success),
+            "kernel_marker": marker,
+            "duration": duration,
+        }
+        if failed_units:
+            state["partial"] = True
+            state["failed_units"] = json.loads(failed_units)
+        return state
+
+    def last_config(self, run_id: int, conf: CompiledConf) -> CompiledConf:
+        """重建运行run_id的配置，只从数据库读取与conf不同的条目
+
+        摘要相同的条目内容必然相同，直接取自conf；其余条目按摘要从entries表
+        读取。结果与完整加载上次的配置等价。
+        """
+        (mode, underlay_eth, overlay_eth, digest) = self.db.execute(
+            "SELECT mode, underlay_eth, overlay_eth, config_digest "
+            "FROM runs WHERE id = ?",
+            (run_id,),
+        ).fetchone()
+
+        current = {v.digest: v for v in conf.vrfs}
+        current.update({v.digest: v for v in conf.vlans})
+        self.db.execute("CREATE TEMP TABLE IF NOT EXISTS current (digest TEXT)")
+        self.db.execute("DELETE FROM current")
+        self.db.executemany("INSERT INTO current VALUES (?)", ((d,) for d in current))
+        kept = {
+            d
+            for (d,) in self.db.execute(
+                "SELECT digest FROM run_entries WHERE run_id = ? "
+                "AND digest IN (SELECT digest FROM current)",
+                (run_id,),
+            )
+        }
+        changed = self.db.execute(
+            "SELECT r.kind, r.digest, e.body FROM run_entries r "
+            "JOIN entries e ON e.digest = r.digest WHERE r.run_id = ? "
+            "AND r.digest NOT IN (SELECT digest FROM current) "
+            "ORDER BY r.kind, r.position",
+            (run_id,),
+        ).fetchall()
+
+        raw: EnvConf = {
+            "Mode": mode,
+            "UnderlayEth": underlay_eth,
+            "OverlayEth": overlay_eth,
+            "VRFMapL3VNI": [v.raw for v in conf.vrfs if v.digest in kept],
+            "VlanMapVNI": [v.raw for v in conf.vlans if v.digest in kept],
+        }
+        digests: dict = {
+            "config": digest,
+            "vrfs": {v.name: v.digest for v in conf.vrfs if v.digest in kept},
+            "vlans": {str(v.vlan_id): v.digest for v in conf.vlans if v.digest in kept},
+        }
+        for kind, entry_digest, body in changed:
+            entry = json.loads(body)
+            if kind == "vrf":
+                raw["VRFMapL3VNI"].append(entry)
+                digests["vrfs"][entry["VRFName"]] = entry_digest
+            else:
+                raw["VlanMapVNI"].append(entry)
+                digests["vlans"][str(entry["VlanID"])] = entry_digest
+        return compile_config(raw, conf.overlay_eth, digests)
+
+    def save_state(self, state: dict):
+        """追加一次运行：运行记录、配置条目和操作在同一个事务中写入"""
+        config = state["config"]
+        compiled = compile_config(config, digests=state.get("digests"))
+        failed_units = state.get("failed_units")
+        with self.db:
+            cursor = self.db.execute(
+                "INSERT INTO runs (timestamp, mode, underlay_eth, overlay_eth, "
+                "config_digest, success, kernel_marker, failed_units, duration) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    state["timestamp"],
+                    compiled.mode,
+                    compiled.underlay_eth,
+                    compiled.overlay_eth,
+                    compiled.digest,
+                    int(state["success"]),
+                    state.get("kernel_marker"),
+                    json.dumps(failed_units) if failed_units else None,
+                    state.get("duration"),
+                ),
+            )
+            run_id = cursor.lastrowid
+
+            entries = [("vrf", v, v.l3_vni) for v in compiled.vrfs]
+            entries += [("vlan", v, v.l2_vni) for v in compiled.vlans]
+            self.db.executemany(
+                "INSERT OR IGNORE INTO entries VALUES (?, ?, ?, ?)",
+                (
+                    (v.digest, kind, vni, json.dumps(v.raw, sort_keys=True))
+                    for (kind, v, vni) in entries
+                ),
+            )
+            self.db.executemany(
+                "INSERT INTO run_entries VALUES (?, ?, ?, ?)",
+                [(run_id, "vrf", i, v.digest) for (i, v) in enumerate(compiled.vrfs)]
+                + [
+                    (run_id, "vlan", i, v.digest)
+                    for (i, v) in enumerate(compiled.vlans)
+                ],
+            )
+            self.db.executemany(
+                "INSERT INTO operations VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    (run_id, seq) + _operation_row(category, entry)
+                    for (seq, (category, entry)) in enumerate(
+                        _operations(state["operations"])
+                    )
+                ),
+            )
+
+    def created_names(self, run_id: int) -> Set[str]:
+        """运行run_id创建的接口名"""
+        rows = self.db.execute(
+            "SELECT DISTINCT name FROM operations WHERE run_id = ? AND action = 'add' "
+            "AND category IN ('interfaces', 'bridges', 'vrfs', 'veths')",
+            (run_id,),
+        )
+        return {name for (name,) in rows}
+
+    def last_changed(self, ifname: str) -> Optional[dict]:
+        """最近一次改动接口ifname（创建、删除、IP、master）的运行"""
+        row = self.db.execute(
+            "SELECT r.id, r.timestamp, o.category, o.action FROM operations o "
+            "JOIN runs r ON r.id = o.run_id WHERE o.name = ? "
+            "ORDER BY o.run_id DESC, o.seq DESC LIMIT 1",
+            (ifname,),
+        ).fetchone()
+        if row is None:
+            return None
+        (run_id, timestamp, category, action) = row
+        return {
+            "run_id": run_id,
+            "timestamp": timestamp,
+            "category": category,
+            "action": action,
+        }
+
+    def history(self, limit: int = 20) -> List[dict]:
+        """最近的运行及其耗时，用于观察趋势"""
+        rows = self.db.execute(
+            "SELECT r.id, r.timestamp, r.success, r.duration, "
+            "(SELECT COUNT(*) FROM operations o WHERE o.run_id = r.id) "
+            "FROM runs r ORDER BY r.id DESC LIMIT ?",
+            (limit,),
+        ).fetchall()
+        return [
+            {
+                "run_id": run_id,
+                "timestamp": timestamp,
+                "success": bool(success),
+                "duration": duration,
+                "operations": operations,
+            }
+            for (run_id, timestamp, success, duration, operations) in rows
+        ]
+
+
+def _operations(operations: dict):
+    """兼容OperationLog的紧凑格式和{类别: [dict, ...]}格式"""
+    if OperationLog.is_compact(operations):
+        yield from OperationLog.from_compact(operations).entries()
+        return
+    for category, entries in operations.items():
+        for entry in entries:
+            yield (category, entry)
+
+
+def _operation_row(category: str, entry: dict) -> tuple:
+    (name_field, peer_field) = NAME_FIELDS[category]
+    return (
+        category,
+        entry.get("action", "add"),
+        entry.get(name_field),
+        entry.get(peer_field) if peer_field else None,
+        entry.get("vni"),
+        entry.get("vlan_id"),
+        entry.get("unit"),
+    )
+
+
+if __name__ == "__main__":
+    import argparse
+    from common.state_manager import STATE_DB
+
+    parser = argparse.ArgumentParser(description="Query the SQLite state store")
+    parser.add_argument("--db", default=STATE_DB)
+    parser.add_argument("--last-changed", metavar="IFNAME")
+    parser.add_argument("--history", type=int, metavar="N")
+    args = parser.parse_args()
+
+    store = SqliteStateStore(args.db)
+    if args.last_changed:
+        print(json.dumps(store.last_changed(args.last_changed)))
+    if args.history:
+        for run in store.history(args.history):
+            print(json.dumps(run))
+    store.close()
@@ -0,0 +1,339 @@
+import asyncio
+from typing import Dict, List, Optional, Tuple
+from common import iproute2, setup_async
+from common.types import CompiledConf, SVD_BRIDGE, SVD_VXLAN, VlanEntry, VRFEntry
+from common.batch import NetlinkBatch
+from common.log import ERROR, WARNING, log
+from common.metrics import op_type
+from common.setup import set_bridge_vlans, vlan_ranges
+from common.diff_analyzer import DiffAnalyzer
+from common.planner import Plan, _plan_veth_add, _plan_veth_remove
+
+# SVD模式共用设备（桥接、VXLAN设备、Overlay接口入桥）所属的实体
+SVD_UNIT = "svd"
+
+
+class BridgeBatch:
+    """在netlink操作DAG之外提交的桥接VLAN配置
+
+    VLAN成员和VLAN到VNI的隧道映射按设备收集，连续的VLAN合并为区间，通过
+    AF_BRIDGE的RTM_SETLINK/RTM_DELLINK批量提交，上千个VLAN只需几条消息。
+    VNI过滤表项（同样按区间合并）和端口选项没有对应的pyroute2接口，作为
+    `bridge -batch`的标准输入经由common.iproute2提交。force为True时（删除可能已不存在的表项）失败只作为警告。
+    """
+
+    def __init__(self, command: str = "add", force: bool = False):
+        self.command = command
+        self.force = force
+        # (设备, 是否为桥接自身) -> {vid: (实体, VNI或None)}
+        self.vlans: Dict[Tuple[str, bool], Dict[int, Tuple[str, Optional[int]]]] = {}
+        # VXLAN设备的VNI过滤表项：{vni: 实体}
+        self.vnis: Dict[int, str] = {}
+        self.commands: List[str] = []
+        self.units: List[str] = []
+
+    def __len__(self):
+        return (
+            sum(len(v) for v in self.vlans.values())
+            + len(self.vnis)
+            + len(self.commands)
+        )
+
+    def vlan(
+        self,
+        dev: str,
+        vid: int,
+        unit: str = SVD_UNIT,
+        vni: Optional[int] = None,
+        bridge_self: bool = False,
+    ):
+        self.vlans.setdefault((dev, bridge_self), {})[vid] = (unit, vni)
+
+    def vni(self, vni: int, unit: str = SVD_UNIT):
+        self.vnis[vni] = unit
+
+    def add(self, command: str, unit: str = SVD_UNIT):
+        self.commands.append(command)
+        self.units.append(unit)
+
+    def without_units(self, units) -> "BridgeBatch":
+        """去掉属于units（已失败并回滚的实体）的VLAN和命令"""
+        batch = BridgeBatch(self.command, self.force)
+        for (dev, bridge_self), vids in self.vlans.items():
+            for vid, (unit, vni) in vids.items():
+                if unit not in units:
+                    batch.vlan(dev, vid, unit, vni, bridge_self)
+        for vni, unit in self.vnis.items():
+            if unit not in units:
+                batch.vni(vni, unit)
+        for command, unit in zip(self.commands, self.units):
+            if unit not in units:
+                batch.add(command, unit)
+        return batch
+
+    def record(self, rollback):
+        """添加之前把每个映射写入回滚记录，运行失败时由回滚撤销"""
+        for (dev, bridge_self), vids in self.vlans.items():
+            for vid, (unit, vni) in vids.items():
+                rollback.scoped(unit).record_bridge_vlan(dev, vid, vni, bridge_self)
+        for vni, unit in self.vnis.items():
+            rollback.scoped(unit).record_bridge_vni(SVD_VXLAN, vni)
+
+    def _bridge_commands(self) -> List[str]:
+        """bridge命令，VNI过滤表项同样按连续区间合并"""
+        commands = list(self.commands)
+        # bridge vni只接受完整的delete
+        action = "delete" if self.command == "del" else self.command
+        for first, last in vlan_ranges(self.vnis):
+            vnis = str(first) if first == last else f"{first}-{last}"
+            commands.append(f"vni {action} dev {SVD_VXLAN} vni {vnis}")
+        return commands
+
+    def _vlan_requests(self):
+        for (dev, bridge_self), vids in self.vlans.items():
+            tunnels = {vid: vni for vid, (_, vni) in vids.items() if vni is not None}
+            yield (dev, list(vids), tunnels, bridge_self)
+
+    def _argv(self) -> List[str]:
+        if self.force:
+            return ["bridge", "-force", "-batch", "-"]
+        return ["bridge", "-batch", "-"]
+
+    def _level(self) -> int:
+        # force模式下的失败（例如删除已经不存在的条目）只作为警告
+        return WARNING if self.force else ERROR
+
+    def _failed(self, message: str, **fields) -> bool:
+        log.log(self._level(), message, **fields)
+        return self.force
+
+    def _report(self, vlans_ok: bool, returncode: int, stderr: str) -> bool:
+        log.info(
+            "Bridge {command}: {vlans} VLANs on {devices} devices, "
+            "{vnis} VNI filter entries",
+            command=self.command,
+            vlans=sum(len(v) for v in self.vlans.values()),
+            devices=len(self.vlans),
+            vnis=len(self.vnis),
+        )
+        ok = vlans_ok or self._failed(
+            "Bridge VLAN {command} failed", command=self.command
+        )
+        if returncode:
+            ok = (
+                self._failed(
+                    "Bridge batch {command} failed",
+                    command=self.command,
+                    error=stderr.strip(),
+                )
+                and ok
+            )
+        return ok
+
+    def run(self, ipr) -> bool:
+        if not len(self):
+            return True
+        batch = NetlinkBatch()
+        vlans_ok = all(
+            [
+                set_bridge_vlans(
+                    ipr, dev, vids, tunnels, self.command, bridge_self, batch
+                )
+                for (dev, vids, tunnels, bridge_self) in self._vlan_requests()
+            ]
+        )
+        for op in batch.run(ipr):
+            log.log(
+                self._level(),
+                "VLAN {command} on {entity} failed",
+                entity=op.label,
+                command=self.command,
+                op=op_type(op.target, op.command, op.kwarg),
+                error=op.error,
+            )
+            vlans_ok = False
+        (returncode, stderr) = (0, "")
+        commands = self._bridge_commands()
+        if commands:
+            (returncode, stderr) = iproute2.run(
+                ipr, self._argv(), "\n".join(commands) + "\n"
+            )
+        return self._report(vlans_ok, returncode, stderr)
+
+    async def run_async(self, ipr) -> bool:
+        if not len(self):
+            return True
+        results = await asyncio.gather(
+            *(
+                setup_async.set_bridge_vlans(
+                    ipr, dev, vids, tunnels, self.command, bridge_self
+                )
+                for (dev, vids, tunnels, bridge_self) in self._vlan_requests()
+            )
+        )
+        (returncode, stderr) = (0, "")
+        commands = self._bridge_commands()
+        if commands:
+            (returncode, stderr) = await iproute2.run_async(
+                ipr, self._argv(), "\n".join(commands) + "\n"
+            )
+        return self._report(all(results), returncode, stderr)
+
+
+def _map_vni(
+    batch: BridgeBatch, unit: str, vid: int, vni: int, access: Optional[str] = None
+):
+    """VLAN vid与VNI互相映射；access为该VLAN的Overlay侧trunk端口
+
+    batch为删除（command为del）的BridgeBatch时即解除映射。
+    """
+    if access:
+        batch.vlan(access, vid, unit)
+    batch.vlan(SVD_BRIDGE, vid, unit, bridge_self=True)
+    batch.vlan(SVD_VXLAN, vid, unit, vni)
+    batch.vni(vni, unit)
+
+
+def plan_svd_base(plan: Plan, batch: BridgeBatch, conf: CompiledConf, underlay_ip: str):
+    """共用设备：vlan-aware桥接、external+vnifilter的VXLAN设备，Overlay接口作为trunk入桥"""
+    plan.add("bridge.add", SVD_BRIDGE, SVD_UNIT, vlan_filtering=True)
+    plan.add(
+        "svd.vxlan.add",
+        SVD_VXLAN,
+        SVD_UNIT,
+        reads=(SVD_BRIDGE,),
+        local_ip=underlay_ip,
+        master=SVD_BRIDGE,
+    )
+    plan.add(
+        "master.set",
+        conf.overlay_eth,
+        SVD_UNIT,
+        reads=(SVD_BRIDGE,),
+        master=SVD_BRIDGE,
+    )
+    # 按VLAN查找目的VTEP，关闭VXLAN端口上的学习，ARP/ND由EVPN抑制
+    batch.add(f"link set dev {SVD_VXLAN} vlan_tunnel on neigh_suppress on learning off")
+
+
+def plan_svd_vrf_add(plan: Plan, batch: BridgeBatch, vrf: VRFEntry):
+    unit = f"vrf:{vrf.name}"
+
+    plan.add("vrf.add", vrf.name, unit, table=vrf.table)
+    plan.add(
+        "vlan.add",
+        vrf.svi,
+        unit,
+        reads=(vrf.name, SVD_BRIDGE),
+        parent=SVD_BRIDGE,
+        vlan_id=vrf.l3_vlan_id,
+        master=vrf.name,
+    )
+    if vrf.veth_require:
+        _plan_veth_add(plan, vrf, unit)
+    _map_vni(batch, unit, vrf.l3_vlan_id, vrf.l3_vni)
+
+
+def plan_svd_vrf_remove(plan: Plan, batch: BridgeBatch, vrf: VRFEntry):
+    unit = f"vrf:{vrf.name}"
+
+    if vrf.veth_require:
+        _plan_veth_remove(plan, vrf, unit)
+    plan.add("vlan.del", vrf.svi, unit, parent=SVD_BRIDGE, vlan_id=vrf.l3_vlan_id)
+    plan.add("vrf.del", vrf.name, unit)
+    _map_vni(batch, unit, vrf.l3_vlan_id, vrf.l3_vni)
+
+
+def plan_svd_vlan_add(
+    plan: Plan, batch: BridgeBatch, vlan: VlanEntry, vrf_name: str, overlay_eth: str
+):
+    unit = f"l2vni:{vlan.l2_vni}"
+
+    plan.add(
+        "vlan.add",
+        vlan.svi,
+        unit,
+        reads=(vrf_name, SVD_BRIDGE),
+        parent=SVD_BRIDGE,
+        vlan_id=vlan.vlan_id,
+        master=vrf_name,
+    )
+    if vlan.mac:
+        plan.add(
+            "mac.set", vlan.svi, unit, reads=(vlan.svi,), writes=(), address=vlan.mac
+        )
+    if vlan.ip:
+        plan.add(
+            "addr.add", vlan.svi, unit, reads=(vlan.svi,), writes=(), address=vlan.ip
+        )
+    _map_vni(batch, unit, vlan.vlan_id, vlan.l2_vni, overlay_eth)
+
+
+def plan_svd_vlan_remove(
+    plan: Plan, batch: BridgeBatch, vlan: VlanEntry, overlay_eth: str
+):
+    unit = f"l2vni:{vlan.l2_vni}"
+
+    plan.add("vlan.del", vlan.svi, unit, parent=SVD_BRIDGE, vlan_id=vlan.vlan_id)
+    _map_vni(batch, unit, vlan.vlan_id, vlan.l2_vni, overlay_eth)
+
+
+def build_svd_plan(
+    conf: CompiledConf, underlay_ip: str, last_conf: Optional[CompiledConf] = None
+) -> Tuple[BridgeBatch, Plan, BridgeBatch]:
+    """SVD模式的计划：(先执行的bridge命令, netlink操作DAG, 后执行的bridge命令)
+
+    删除映射在DAG之前提交，新增映射在DAG之后提交（此时VXLAN设备和端口都已存在）。
+    每个VLAN只有一个SVI，设备数不随VNI增加而成倍增长；给出last_conf时只包含差异。
+    """
+    unmap = BridgeBatch("del", force=True)
+    plan = Plan()
+    remap = BridgeBatch()
+
+    if last_conf is None:
+        plan_svd_base(plan, remap, conf, underlay_ip)
+        for vrf in conf.vrfs:
+            plan_svd_vrf_add(plan, remap, vrf)
+        for vlan in conf.vlans:
+            plan_svd_vlan_add(
+                plan, remap, vlan, conf.vrf_for(vlan).name, conf.overlay_eth
+            )
+        return (unmap, plan, remap)
+
+    if last_conf.digest == conf.digest:
+        return (unmap, plan, remap)
+
+    vrf_diff = DiffAnalyzer.compare_vrf_entries(last_conf, conf)
+    vlan_diff = DiffAnalyzer.compare_vlan_entries(last_conf, conf)
+
+    # 1. 删除的VLAN，以及修改的VLAN的旧条目
+    for vlan in vlan_diff["removed"] + [c["old"] for c in vlan_diff["changed"]]:
+        plan_svd_vlan_remove(plan, unmap, vlan, last_conf.overlay_eth)
+
+    # 2. 删除的VRF，以及修改的VRF的旧条目：VRF重建后，未变化的VLAN的SVI重新挂接
+    touched_vlans = {v.vlan_id for v in vlan_diff["added"]} | {
+        c["vlan_id"] for c in vlan_diff["changed"]
+    }
+    for vrf in vrf_diff["removed"] + [c["old"] for c in vrf_diff["changed"]]:
+        plan_svd_vrf_remove(plan, unmap, vrf)
+
+    # 3. 新增的VRF和修改的VRF的新条目
+    for vrf in vrf_diff["added"] + [c["new"] for c in vrf_diff["changed"]]:
+        plan_svd_vrf_add(plan, remap, vrf)
+    for vrf_change_info in vrf_diff["changed"]:
+        vrf = vrf_change_info["new"]
+        for vlan in conf.vlans_by_l3_vni.get(vrf.l3_vni, []):
+            if vlan.vlan_id not in touched_vlans:
+                plan.add(
+                    "master.set",
+                    vlan.svi,
+                    f"vrf:{vrf.name}",
+                    reads=(vrf.name,),
+                    master=vrf.name,
+                )
+
+    # 4. 新增的VLAN，以及修改的VLAN的新条目
+    for vlan in vlan_diff["added"] + [c["new"] for c in vlan_diff["changed"]]:
+        plan_svd_vlan_add(plan, remap, vlan, conf.vrf_for(vlan).name, conf.overlay_eth)
+
+    return (unmap, plan, remap)
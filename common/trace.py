@@ -0,0 +1,100 @@
+"""运行阶段的追踪span，导出为Chrome trace-event JSON
+
+启用后（main.py --trace），span()记录嵌套的阶段（配置解析、校验、状态加载、
+差异分析、计划构建、执行的各层、回滚、状态保存），执行器为每个VRF/L2VNI
+实体记录从第一个操作开始到检查点的区间，instrument()的代理记录每个netlink
+请求的在途时间。输出文件可以在chrome://tracing或ui.perfetto.dev中打开：
+
+    X   同步阶段，按时间嵌套
+    b/e 实体和netlink请求：彼此重叠，每个占一条异步轨道
+
+未启用时span()不做任何记录。
+"""
+
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+
+class Tracer:
+    def __init__(self):
+        self.enabled = False
+        self.events: List[dict] = []
+        self.origin = time.perf_counter()
+        self.pid = os.getpid()
+        # 异步区间的id，每个区间唯一
+        self._next_id = 0
+        # 进行中的实体区间：unit -> 开始时间
+        self._units: Dict[str, float] = {}
+
+    def _ts(self, t: float) -> float:
+        return round((t - self.origin) * 1e6, 3)
+
+    def complete(self, name: str, start: float, end: float, cat: str, args: dict):
+        self.events.append(
+            {
+                "name": name,
+                "cat": cat,
+                "ph": "X",
+                "ts": self._ts(start),
+                "dur": round((end - start) * 1e6, 3),
+                "pid": self.pid,
+                "tid": threading.get_ident(),
+                "args": args,
+            }
+        )
+
+    def interval(
+        self, name: str, start: float, end: float, cat: str, args: Optional[dict] = None
+    ):
+        """记录一个可能与其他区间重叠的异步区间"""
+        self._next_id += 1
+        for (ph, t) in (("b", start), ("e", end)):
+            self.events.append(
+                {
+                    "name": name,
+                    "cat": cat,
+                    "ph": ph,
+                    "id": self._next_id,
+                    "ts": self._ts(t),
+                    "pid": self.pid,
+                    "tid": threading.get_ident(),
+                    "args": (args or {}) if ph == "b" else {},
+                }
+            )
+
+    @contextmanager
+    def span(self, name: str, cat: str = "phase", **args):
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.complete(name, start, time.perf_counter(), cat, args)
+
+    def unit_started(self, unit: str):
+        """实体的第一个操作开始执行"""
+        if self.enabled and unit not in self._units:
+            self._units[unit] = time.perf_counter()
+
+    def unit_finished(self, unit: str, result: str):
+        """实体完成（检查点）、失败或被跳过"""
+        start = self._units.pop(unit, None) if self.enabled else None
+        if start is not None:
+            self.interval(unit, start, time.perf_counter(), "unit", {"result": result})
+
+    def write(self, path: str):
+        # 中途失败而没有结束的实体也输出，截止到写出时刻
+        for unit in list(self._units):
+            self.unit_finished(unit, "unfinished")
+        with open(path, "w") as f:
+            json.dump({"traceEvents": self.events, "displayTimeUnit": "ms"}, f)
+
+
+TRACER = Tracer()
+span = TRACER.span
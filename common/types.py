@@ -1,4 +1,7 @@
-from typing import TypedDict, Literal
+import json
+import hashlib
+from typing import Dict, List, Optional, Set, TypedDict, Literal
+from common.log import log
 
 
 # 定义类型提示
@@ -18,131 +21,490 @@ class VRFMapL3VNIList(TypedDict):
     InOutVethRequire: bool
     InVRFVethIPAddr: str
     ExternalVRFVethIPAddr: str
+    # 仅distribute-symmetric-svd模式：L3VNI在vlan-aware桥接上对应的VLAN
+    L3VNIVlanID: int
 
 
 class EnvConf(TypedDict):
-    Mode: Literal["central", "distribute-asymmetric", "distribute-symmetric"]
+    Mode: Literal[
+        "central",
+        "distribute-asymmetric",
+        "distribute-symmetric",
+        "distribute-symmetric-svd",
+    ]
     VlanMapVNI: list[VlanMapVNIList]
     VRFMapL3VNI: list[VRFMapL3VNIList]
     UnderlayEth: str
     OverlayEth: str
 
 
-def validate_config(conf: EnvConf) -> bool:
-    """验证配置的完整性"""
+def entry_digest(entry: dict) -> str:
+    """条目内容的稳定摘要，与字段顺序无关"""
+    data = json.dumps(entry, sort_keys=True, separators=(",", ":"))
+    return hashlib.blake2b(data.encode(), digest_size=16).hexdigest()
+
+
+def config_digest(conf: EnvConf, entry_digests) -> str:
+    """整个配置的摘要：顶层字段加上全部条目摘要，与条目顺序无关"""
+    h = hashlib.blake2b(digest_size=16)
+    for key in ("Mode", "UnderlayEth", "OverlayEth"):
+        h.update(f"{key}={conf.get(key)}\n".encode())
+    for digest in sorted(entry_digests):
+        h.update(digest.encode())
+    return h.hexdigest()
+
+
+# SVD（single VXLAN device）模式：所有VNI共用一个VXLAN设备和一个vlan-aware桥接，
+# VLAN与VNI通过桥接的vlan tunnel映射，每个VLAN/L3VNI只有一个SVI接口
+SVD_MODE = "distribute-symmetric-svd"
+SVD_BRIDGE = "br-svd"
+SVD_VXLAN = "vxlan-svd"
+
+
+class VRFEntry:
+    """编译后的VRF条目，接口名预先计算"""
+
+    __slots__ = (
+        "name",
+        "l3_vni",
+        "table",
+        "veth_require",
+        "veth_prefix",
+        "in_veth_ip",
+        "ext_veth_ip",
+        "bridge",
+        "vxlan",
+        "in_veth",
+        "ext_veth",
+        "l3_vlan_id",
+        "svi",
+        "digest",
+        "raw",
+    )
+
+    def __init__(self, raw: VRFMapL3VNIList, digest: Optional[str] = None):
+        self.raw = raw
+        self.digest = digest or entry_digest(raw)
+        self.name: str = raw["VRFName"]
+        self.l3_vni: int = raw["VxLANL3VNI"]
+        self.table: int = raw.get("VRFRouteTableID", self.l3_vni)
+        self.veth_require: bool = raw.get("InOutVethRequire", False)
+        self.veth_prefix = raw.get("VxLANInOutDomainVethPrefix", self.l3_vni)
+        self.in_veth_ip: str = raw.get("InVRFVethIPAddr", "")
+        self.ext_veth_ip: str = raw.get("ExternalVRFVethIPAddr", "")
+        self.bridge = f"br-vsi{self.l3_vni}"
+        self.vxlan = f"vxlan{self.l3_vni}"
+        self.in_veth = f"{self.veth_prefix}-in"
+        self.ext_veth = f"{self.veth_prefix}-ext"
+        self.l3_vlan_id: Optional[int] = raw.get("L3VNIVlanID")
+        self.svi = f"{SVD_BRIDGE}.{self.l3_vlan_id}"
+
+    def __repr__(self):
+        return f"VRF {self.name} (L3 VNI {self.l3_vni})"
+
+
+class VlanEntry:
+    """编译后的VLAN条目；vrf为按L3VNI解析出的所属VRF，找不到时为None"""
+
+    __slots__ = (
+        "vlan_id",
+        "l2_vni",
+        "l3_vni",
+        "ip",
+        "mac",
+        "parent",
+        "vrf",
+        "bridge",
+        "vxlan",
+        "subif",
+        "svi",
+        "digest",
+        "raw",
+    )
+
+    def __init__(
+        self,
+        raw: VlanMapVNIList,
+        overlay_eth: str,
+        vrf: Optional[VRFEntry],
+        digest: Optional[str] = None,
+    ):
+        self.raw = raw
+        self.digest = digest or entry_digest(raw)
+        self.vlan_id: int = raw["VlanID"]
+        self.l2_vni: int = raw["L2VxLANVNI"]
+        self.l3_vni: int = raw["L3VxLANVNI"]
+        self.ip: str = raw.get("L2VxLANVNIIPAddr", "")
+        self.mac: str = raw.get("L2VxLANVNIMacAddr", "")
+        self.parent = overlay_eth
+        self.vrf = vrf
+        self.bridge = f"br-vsi{self.l2_vni}"
+        self.vxlan = f"vxlan{self.l2_vni}"
+        self.subif = f"{overlay_eth}.{self.vlan_id}"
+        self.svi = f"{SVD_BRIDGE}.{self.vlan_id}"
+
+    def __repr__(self):
+        return f"VLAN {self.vlan_id} (L2 VNI {self.l2_vni})"
+
+
+class CompiledConf:
+    """一次性编译的配置：条目、索引和接口名都在构造时生成，之后只读"""
+
+    __slots__ = (
+        "raw",
+        "mode",
+        "underlay_eth",
+        "overlay_eth",
+        "vrfs",
+        "vlans",
+        "vrf_by_name",
+        "vrf_by_l3_vni",
+        "vlan_by_id",
+        "vlan_by_l2_vni",
+        "vlans_by_l3_vni",
+        "digest",
+    )
+
+    def __init__(
+        self, conf: EnvConf, overlay_eth: str = "", digests: Optional[dict] = None
+    ):
+        self.raw = conf
+        self.mode = conf.get("Mode")
+        self.underlay_eth: str = conf.get("UnderlayEth", "")
+        self.overlay_eth: str = conf.get("OverlayEth") or overlay_eth
+
+        # 状态文件中保存的摘要与配置一同写入，加载时直接复用，不再重新计算
+        digests = digests or {}
+        vrf_digests = digests.get("vrfs", {})
+        vlan_digests = digests.get("vlans", {})
+
+        self.vrfs: List[VRFEntry] = [
+            VRFEntry(v, vrf_digests.get(v["VRFName"]))
+            for v in conf.get("VRFMapL3VNI", [])
+        ]
+        self.vrf_by_name: Dict[str, VRFEntry] = {v.name: v for v in self.vrfs}
+        self.vrf_by_l3_vni: Dict[int, VRFEntry] = {v.l3_vni: v for v in self.vrfs}
+
+        self.vlans: List[VlanEntry] = [
+            VlanEntry(
+                v,
+                self.overlay_eth,
+                self.vrf_by_l3_vni.get(v["L3VxLANVNI"]),
+                vlan_digests.get(str(v["VlanID"])),
+            )
+            for v in conf.get("VlanMapVNI", [])
+        ]
+        self.vlan_by_id: Dict[int, VlanEntry] = {v.vlan_id: v for v in self.vlans}
+        self.vlan_by_l2_vni: Dict[int, VlanEntry] = {v.l2_vni: v for v in self.vlans}
+        self.vlans_by_l3_vni: Dict[int, List[VlanEntry]] = {}
+        for v in self.vlans:
+            self.vlans_by_l3_vni.setdefault(v.l3_vni, []).append(v)
+
+        self.digest: str = digests.get("config") or config_digest(
+            conf, [v.digest for v in self.vrfs] + [v.digest for v in self.vlans]
+        )
+
+    def digests(self) -> dict:
+        """写入状态文件的摘要：整个配置一个，每个VRF/VLAN条目各一个"""
+        return {
+            "config": self.digest,
+            "vrfs": {v.name: v.digest for v in self.vrfs},
+            "vlans": {str(v.vlan_id): v.digest for v in self.vlans},
+        }
+
+    def ifnames(self) -> List[str]:
+        """配置创建的全部接口名"""
+        names: List[str] = []
+        if self.mode == SVD_MODE:
+            names += [SVD_BRIDGE, SVD_VXLAN, self.overlay_eth]
+            for v in self.vrfs:
+                names += [v.name, v.svi]
+                if v.veth_require:
+                    names += [v.in_veth, v.ext_veth]
+            names += [v.svi for v in self.vlans]
+            return names
+        for v in self.vrfs:
+            names += [v.name, v.bridge, v.vxlan]
+            if v.veth_require:
+                names += [v.in_veth, v.ext_veth]
+        for v in self.vlans:
+            names += [v.bridge, v.vxlan, v.subif]
+        return names
+
+    def without_units(self, units: Set[str]) -> EnvConf:
+        """去掉给定实体（"vrf:NAME"、"l2vni:VNI"）后的原始配置，用于部分成功时保存状态"""
+        conf = dict(self.raw)
+        conf["VRFMapL3VNI"] = [v.raw for v in self.vrfs if f"vrf:{v.name}" not in units]
+        conf["VlanMapVNI"] = [
+            v.raw for v in self.vlans if f"l2vni:{v.l2_vni}" not in units
+        ]
+        return conf
+
+    def vrf_for(self, vlan: VlanEntry) -> VRFEntry:
+        """VLAN所属的VRF，按本配置的L3VNI索引查找"""
+        vrf = self.vrf_by_l3_vni.get(vlan.l3_vni)
+        if vrf is None:
+            raise ValueError(f"No VRF configuration found for L3 VNI {vlan.l3_vni}")
+        return vrf
+
+
+def compile_config(
+    conf: EnvConf, overlay_eth: str = "", digests: Optional[dict] = None
+) -> CompiledConf:
+    """编译配置；overlay_eth用于缺少OverlayEth字段的旧配置，
+    digests为状态文件中与该配置一同保存的摘要"""
+    return CompiledConf(conf, overlay_eth, digests)
+
+
+# 接口名最大长度（IFNAMSIZ为16，含结尾的NUL）
+IFNAMSIZ = 16
+
+# 内核保留的路由表：default、main、local
+RESERVED_TABLES = (253, 254, 255)
+
+VLAN_FIELDS = (
+    "VlanID",
+    "L2VxLANVNI",
+    "L2VxLANVNIIPAddr",
+    "L2VxLANVNIMacAddr",
+    "L3VxLANVNI",
+)
+
+VRF_FIELDS = (
+    "VRFName",
+    "VxLANL3VNI",
+    "VRFRouteTableID",
+    "VxLANInOutDomainVethPrefix",
+    "InOutVethRequire",
+    "InVRFVethIPAddr",
+    "ExternalVRFVethIPAddr",
+)
+
+
+def _is_int(value) -> bool:
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def config_errors(conf: EnvConf) -> List[str]:
+    """一次遍历检查配置，返回全部错误
+
+    除单个条目的字段外，还检查条目之间的关系：重复的VlanID、L2VNI、VRF名、
+    L3VNI和路由表，没有对应VRF的L3VxLANVNI，L2与L3 VNI冲突，以及超过
+    IFNAMSIZ的接口名。所有检查都基于集合和字典，耗时与条目数成线性。
+    """
+    if not isinstance(conf, dict):
+        return ["Error: Configuration must be a JSON object"]
+    errors: List[str] = []
+
+    def check_ifname(ifname: str, where: str):
+        if not isinstance(ifname, str):
+            errors.append(
+                f"Error: Interface name {ifname!r} for {where} must be a string"
+            )
+        elif len(ifname) >= IFNAMSIZ:
+            errors.append(
+                f"Error: Interface name {ifname} for {where} is longer than "
+                f"{IFNAMSIZ - 1} characters"
+            )
+
     # 检查Mode字段
     if conf.get("Mode") not in [
         "central",
         "distribute-asymmetric",
         "distribute-symmetric",
+        SVD_MODE,
     ]:
-        print("Error: Invalid or missing 'Mode' in configuration")
-        return False
+        errors.append("Error: Invalid or missing 'Mode' in configuration")
+    svd = conf.get("Mode") == SVD_MODE
 
     # 检查Underlay和Overlay接口
     if not conf.get("UnderlayEth"):
-        print("Error: 'UnderlayEth' is required in configuration")
-        return False
+        errors.append("Error: 'UnderlayEth' is required in configuration")
+    else:
+        check_ifname(conf["UnderlayEth"], "UnderlayEth")
 
-    if not conf.get("OverlayEth"):
-        print("Error: 'OverlayEth' is required in configuration")
-        return False
+    overlay_eth = conf.get("OverlayEth")
+    if not overlay_eth:
+        errors.append("Error: 'OverlayEth' is required in configuration")
+        overlay_eth = ""
+    elif not isinstance(overlay_eth, str):
+        check_ifname(overlay_eth, "OverlayEth")
+        overlay_eth = ""
 
-    # 检查VlanMapVNI
-    if not conf.get("VlanMapVNI") or not isinstance(conf["VlanMapVNI"], list):
-        print("Error: 'VlanMapVNI' must be a non-empty list")
-        return False
-
-    for vlan_conf in conf["VlanMapVNI"]:
-        if not all(
-            key in vlan_conf
-            for key in [
-                "VlanID",
-                "L2VxLANVNI",
-                "L2VxLANVNIIPAddr",
-                "L2VxLANVNIMacAddr",
-                "L3VxLANVNI",
-            ]
-        ):
-            print("Error: Missing required fields in VlanMapVNI configuration")
-            return False
-
-        if not (1 <= vlan_conf["VlanID"] <= 4094):
-            print(f"Error: Invalid VlanID {vlan_conf['VlanID']} (must be 1-4094)")
-            return False
-
-        if not (1 <= vlan_conf["L2VxLANVNI"] <= 16777215):
-            print(
-                f"Error: Invalid L2VxLANVNI {vlan_conf['L2VxLANVNI']} (must be 1-16777215)"
-            )
-            return False
+    # 检查VRFMapL3VNI，同时建立VRF索引供VLAN的交叉检查使用
+    vrfs = conf.get("VRFMapL3VNI")
+    if not vrfs or not isinstance(vrfs, list):
+        errors.append("Error: 'VRFMapL3VNI' must be a non-empty list")
+        vrfs = []
 
-        if not (1 <= vlan_conf["L3VxLANVNI"] <= 16777215):
-            print(
-                f"Error: Invalid L3VxLANVNI {vlan_conf['L3VxLANVNI']} (must be 1-16777215)"
+    vrf_names: Set[str] = set()
+    l3_vnis: Set[int] = set()
+    tables: Dict[int, str] = {}
+    veth_names: Dict[str, str] = {}
+    # SVD模式下L3VNI占用的VLAN，VLAN条目不能再使用
+    l3_vlan_ids: Dict[int, str] = {}
+    for vrf_conf in vrfs:
+        if not isinstance(vrf_conf, dict):
+            errors.append(f"Error: VRFMapL3VNI entry {vrf_conf!r} must be an object")
+            continue
+        missing = [key for key in VRF_FIELDS if key not in vrf_conf]
+        if missing:
+            errors.append(
+                f"Error: Missing required fields {', '.join(missing)} "
+                f"in VRFMapL3VNI configuration"
             )
-            return False
-
-        # if (
-        #     not vlan_conf["L2VxLANVNIIPAddr"]
-        #     or "/" not in vlan_conf["L2VxLANVNIIPAddr"]
-        # ):
-        #     print(f"Error: Invalid L2VxLANVNIIPAddr {vlan_conf['L2VxLANVNIIPAddr']}")
-        #     return False
-
-        # if (
-        #     not vlan_conf["L2VxLANVNIMacAddr"]
-        #     or len(vlan_conf["L2VxLANVNIMacAddr"].split(":")) != 6
-        # ):
-        #     print(f"Error: Invalid L2VxLANVNIMacAddr {vlan_conf['L2VxLANVNIMacAddr']}")
-        #     return False
-
-    # 检查VRFMapL3VNI
-    if not conf.get("VRFMapL3VNI") or not isinstance(conf["VRFMapL3VNI"], list):
-        print("Error: 'VRFMapL3VNI' must be a non-empty list")
-        return False
-
-    for vrf_conf in conf["VRFMapL3VNI"]:
-        if not all(
-            key in vrf_conf
-            for key in [
-                "VRFName",
-                "VxLANL3VNI",
-                "VRFRouteTableID",
-                "VxLANInOutDomainVethPrefix",
-                "InOutVethRequire",
-                "InVRFVethIPAddr",
-                "ExternalVRFVethIPAddr",
-            ]
-        ):
-            print("Error: Missing required fields in VRFMapL3VNI configuration")
-            return False
-
-        if not vrf_conf["VRFName"]:
-            print("Error: VRFName cannot be empty")
-            return False
+            continue
+
+        vrf_name = vrf_conf["VRFName"]
+        l3_vni = vrf_conf["VxLANL3VNI"]
+        if not vrf_name:
+            errors.append("Error: VRFName cannot be empty")
+        elif not isinstance(vrf_name, str):
+            check_ifname(vrf_name, "VRFName")
+        elif vrf_name in vrf_names:
+            errors.append(f"Error: Duplicate VRFName {vrf_name}")
+        else:
+            vrf_names.add(vrf_name)
+            check_ifname(vrf_name, f"VRF {vrf_name}")
 
         if type(vrf_conf["InOutVethRequire"]) is not bool:
-            print("Error: InOutVethRequire cannot be empty")
-            return False
+            errors.append("Error: InOutVethRequire cannot be empty")
 
-        if not (1 <= vrf_conf["VxLANL3VNI"] <= 16777215):
-            print(
-                f"Error: Invalid VxLANL3VNI {vrf_conf['VxLANL3VNI']} (must be 1-16777215)"
+        if not _is_int(l3_vni) or not (1 <= l3_vni <= 16777215):
+            errors.append(
+                f"Error: Invalid VxLANL3VNI {l3_vni} (must be 1-16777215)"
             )
-            return False
+        elif l3_vni in l3_vnis:
+            errors.append(f"Error: Duplicate VxLANL3VNI {l3_vni}")
+        else:
+            l3_vnis.add(l3_vni)
 
-        if not vrf_conf["InVRFVethIPAddr"] or "/" not in vrf_conf["InVRFVethIPAddr"]:
-            print(f"Error: Invalid InVRFVethIPAddr {vrf_conf['InVRFVethIPAddr']}")
-            return False
+        table = vrf_conf["VRFRouteTableID"]
+        if not _is_int(table) or table <= 0 or table in RESERVED_TABLES:
+            errors.append(f"Error: Invalid VRFRouteTableID {table} for VRF {vrf_name}")
+        elif table in tables:
+            errors.append(
+                f"Error: VRFRouteTableID {table} is used by both VRF "
+                f"{tables[table]} and VRF {vrf_name}"
+            )
+        else:
+            tables[table] = vrf_name
+
+        in_ip = vrf_conf["InVRFVethIPAddr"]
+        if not isinstance(in_ip, str) or "/" not in in_ip:
+            errors.append(
+                f"Error: Invalid InVRFVethIPAddr {vrf_conf['InVRFVethIPAddr']}"
+            )
 
-        if (
-            not vrf_conf["ExternalVRFVethIPAddr"]
-            or "/" not in vrf_conf["ExternalVRFVethIPAddr"]
-        ):
-            print(
+        ext_ip = vrf_conf["ExternalVRFVethIPAddr"]
+        if not isinstance(ext_ip, str) or "/" not in ext_ip:
+            errors.append(
                 f"Error: Invalid ExternalVRFVethIPAddr {vrf_conf['ExternalVRFVethIPAddr']}"
             )
-            return False
 
-    return True
+        if svd:
+            l3_vlan_id = vrf_conf.get("L3VNIVlanID")
+            if not _is_int(l3_vlan_id) or not (1 <= l3_vlan_id <= 4094):
+                errors.append(
+                    f"Error: Invalid L3VNIVlanID {l3_vlan_id} for VRF {vrf_name} "
+                    f"(must be 1-4094 in {SVD_MODE} mode)"
+                )
+            elif l3_vlan_id in l3_vlan_ids:
+                errors.append(
+                    f"Error: L3VNIVlanID {l3_vlan_id} is used by both VRF "
+                    f"{l3_vlan_ids[l3_vlan_id]} and VRF {vrf_name}"
+                )
+            else:
+                l3_vlan_ids[l3_vlan_id] = vrf_name
+
+        if vrf_conf["InOutVethRequire"] is True:
+            prefix = vrf_conf["VxLANInOutDomainVethPrefix"]
+            if not isinstance(prefix, str) or not prefix:
+                errors.append(
+                    f"Error: Invalid VxLANInOutDomainVethPrefix {prefix!r} "
+                    f"for VRF {vrf_name}"
+                )
+                continue
+            for ifname in (f"{prefix}-in", f"{prefix}-ext"):
+                if ifname in veth_names:
+                    errors.append(
+                        f"Error: VETH interface {ifname} is used by both VRF "
+                        f"{veth_names[ifname]} and VRF {vrf_name}"
+                    )
+                else:
+                    veth_names[ifname] = vrf_name
+                    check_ifname(ifname, f"VRF {vrf_name}")
+
+    # 检查VlanMapVNI
+    vlans = conf.get("VlanMapVNI")
+    if not vlans or not isinstance(vlans, list):
+        errors.append("Error: 'VlanMapVNI' must be a non-empty list")
+        vlans = []
+
+    vlan_ids: Set[int] = set()
+    l2_vnis: Set[int] = set()
+    for vlan_conf in vlans:
+        if not isinstance(vlan_conf, dict):
+            errors.append(f"Error: VlanMapVNI entry {vlan_conf!r} must be an object")
+            continue
+        missing = [key for key in VLAN_FIELDS if key not in vlan_conf]
+        if missing:
+            errors.append(
+                f"Error: Missing required fields {', '.join(missing)} "
+                f"in VlanMapVNI configuration"
+            )
+            continue
+
+        vlan_id = vlan_conf["VlanID"]
+        l2_vni = vlan_conf["L2VxLANVNI"]
+        l3_vni = vlan_conf["L3VxLANVNI"]
+
+        if not _is_int(vlan_id) or not (1 <= vlan_id <= 4094):
+            errors.append(f"Error: Invalid VlanID {vlan_id} (must be 1-4094)")
+        elif vlan_id in vlan_ids:
+            errors.append(f"Error: Duplicate VlanID {vlan_id}")
+        elif vlan_id in l3_vlan_ids:
+            errors.append(
+                f"Error: VlanID {vlan_id} collides with the L3VNIVlanID of VRF "
+                f"{l3_vlan_ids[vlan_id]}"
+            )
+        else:
+            vlan_ids.add(vlan_id)
+            if not svd:
+                check_ifname(f"{overlay_eth}.{vlan_id}", f"VLAN {vlan_id}")
+
+        if not _is_int(l2_vni) or not (1 <= l2_vni <= 16777215):
+            errors.append(
+                f"Error: Invalid L2VxLANVNI {l2_vni} (must be 1-16777215)"
+            )
+        elif l2_vni in l2_vnis:
+            errors.append(f"Error: Duplicate L2VxLANVNI {l2_vni}")
+        elif l2_vni in l3_vnis:
+            errors.append(
+                f"Error: L2VxLANVNI {l2_vni} of VLAN {vlan_id} collides with an "
+                f"L3 VNI"
+            )
+        else:
+            l2_vnis.add(l2_vni)
+
+        if not _is_int(l3_vni) or not (1 <= l3_vni <= 16777215):
+            errors.append(
+                f"Error: Invalid L3VxLANVNI {l3_vni} (must be 1-16777215)"
+            )
+        elif l3_vni not in l3_vnis:
+            errors.append(
+                f"Error: No VRF configuration found for L3VxLANVNI {l3_vni} "
+                f"of VLAN {vlan_id}"
+            )
+
+    return errors
+
+
+def validate_config(conf: EnvConf) -> bool:
+    """验证配置的完整性，打印发现的全部错误"""
+    errors = config_errors(conf)
+    for error in errors:
+        log.error(error.removeprefix("Error: "))
+    if errors:
+        log.info("Configuration has {count} error(s)", count=len(errors))
+    return not errors
@@ -0,0 +1,67 @@
+from typing import Optional
+from pyroute2 import AsyncIPRoute
+from common.types import EnvConf
+from common.rollback_manager import RollbackManager
+from common.ifindex_cache import AsyncIfIndexCache
+from common.log import log
+from common.metrics import instrument
+from common.trace import span
+from common.query_async import get_interface_ip
+from common.reconcile import KernelSnapshot
+from common.executor import execute_plan_async
+from distribute.sdr.sdr import prepare_run, select_plan, underlay_address
+
+
+async def configure_vxlan_bgp_evpn_distribute_sdr(
+    conf: EnvConf,
+    rollback: RollbackManager,
+    last_state: Optional[dict] = None,
+    concurrency: int = 64,
+    reconcile: bool = False,
+    resume: bool = False,
+    ipr: Optional[AsyncIPRoute] = None,
+) -> bool:
+    """distribute.sdr.sdr中主配置函数的asyncio版本，按依赖并发执行"""
+    prepared = prepare_run(conf, last_state, reconcile, resume)
+    if prepared is None:
+        return False
+    (compiled, reconcile, resuming) = prepared
+
+    # 传入的ipr（例如common.fake_iproute.FakeAsyncIPRoute）由调用方关闭
+    owned = ipr is None
+    ipr = AsyncIfIndexCache(instrument(AsyncIPRoute(nlm_echo=True) if owned else ipr))
+
+    try:
+        snapshot = None
+        with span("kernel.dump"):
+            if reconcile or resuming:
+                snapshot = await KernelSnapshot.capture_async(ipr)
+            else:
+                await ipr.seed()
+
+        underlay_ip = underlay_address(
+            conf,
+            await ipr.link_lookup(ifname=conf["UnderlayEth"]),
+            await ipr.link_lookup(ifname=conf["OverlayEth"]),
+            await get_interface_ip(ipr, conf["UnderlayEth"]),
+        )
+        if underlay_ip is None:
+            return False
+
+        plan = select_plan(
+            compiled, rollback, underlay_ip, last_state, snapshot, resuming
+        )
+        with span("execute", operations=len(plan)):
+            return await execute_plan_async(ipr, rollback, plan, concurrency)
+
+    except Exception as e:
+        log.error("Configuration aborted", error=e)
+        return False
+    finally:
+        log.info(
+            "Interface index cache: {hits} hits, {misses} misses",
+            hits=ipr.hits,
+            misses=ipr.misses,
+        )
+        if owned:
+            ipr.close()
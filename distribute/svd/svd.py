@@ -0,0 +1,122 @@
+from typing import Optional
+from pyroute2 import IPRoute
+from common.types import SVD_MODE, EnvConf, compile_config, validate_config
+from common.rollback_manager import RollbackManager
+from common.state_manager import StateManager
+from common.ifindex_cache import IfIndexCache
+from common.log import log
+from common.metrics import instrument
+from common.trace import span
+from common.query import get_interface_ip
+from common.svd import build_svd_plan
+from common.executor import execute_plan
+
+
+def svd_last_config(last_state: Optional[dict], compiled):
+    """上次成功运行的SVD配置；上次不是SVD模式时返回None，按完整计划执行
+
+    上次运行中断时（其操作已按日志回滚）取中断之前的快照。
+    """
+    if last_state and last_state.get("interrupted"):
+        last_state = last_state.get("previous")
+    if not last_state or not last_state.get("success", False):
+        return None
+    last_config = StateManager.last_config(last_state, compiled)
+    if last_config is not None and last_config.mode != SVD_MODE:
+        log.warning(
+            "Last run used mode {mode}, its devices are not removed by SVD mode",
+            mode=last_config.mode,
+        )
+        return None
+    return last_config
+
+
+def configure_vxlan_bgp_evpn_distribute_svd(
+    conf: EnvConf,
+    rollback: RollbackManager,
+    last_state: Optional[dict] = None,
+    reconcile: bool = False,
+    resume: bool = False,
+    ipr: Optional[IPRoute] = None,
+) -> bool:
+    """单VXLAN设备（SVD）模式的主配置函数
+
+    所有VNI共用一个external+vnifilter的VXLAN设备和一个vlan-aware桥接，
+    VLAN与VNI的映射通过bridge vlan tunnel_info完成，每个VLAN只保留一个SVI。
+    """
+    if not validate_config(conf):
+        log.error("Configuration validation failed")
+        return False
+    if reconcile or resume:
+        log.error("SVD mode does not support --reconcile/--resume")
+        return False
+    compiled = compile_config(conf)
+
+    # 传入的ipr（例如common.fake_iproute.FakeIPRoute）由调用方关闭
+    owned = ipr is None
+    ipr = IfIndexCache(instrument(IPRoute(nlm_echo=True) if owned else ipr))
+
+    try:
+        with span("kernel.dump"):
+            ipr.seed()
+
+        # 检查物理接口
+        if not ipr.link_lookup(ifname=conf["UnderlayEth"]):
+            log.error(
+                "Underlay interface {entity} not found", entity=conf["UnderlayEth"]
+            )
+            return False
+
+        if not ipr.link_lookup(ifname=conf["OverlayEth"]):
+            log.error("Overlay interface {entity} not found", entity=conf["OverlayEth"])
+            return False
+
+        # 获取Underlay IP
+        underlayEthIPAddr = get_interface_ip(ipr, conf["UnderlayEth"])
+        if not underlayEthIPAddr or not underlayEthIPAddr.get("ipv4"):
+            log.error(
+                "Underlay interface {entity} has no IPv4 address",
+                entity=conf["UnderlayEth"],
+            )
+            return False
+
+        underlay_ip = underlayEthIPAddr["ipv4"][0]
+        if not underlay_ip:
+            log.error("Underlay interface IP address is empty")
+            return False
+
+        last_config = svd_last_config(last_state, compiled)
+        with span("plan.build"):
+            (unmap, plan, remap) = build_svd_plan(compiled, underlay_ip, last_config)
+        log.info(
+            "SVD plan: {unmap} bridge entries to remove, {operations} operations, "
+            "{remap} bridge entries to add",
+            unmap=len(unmap),
+            operations=len(plan),
+            remap=len(remap),
+        )
+
+        # 先删除旧映射，再执行netlink操作，最后为已成功的实体写入新映射
+        with span("bridge.unmap", entries=len(unmap)):
+            unmap.run(ipr)
+        with span("execute", operations=len(plan)):
+            success = execute_plan(ipr, rollback, plan)
+        failed_units = rollback.failed_units()
+        if not success and not failed_units:
+            return False
+        remap = remap.without_units(failed_units)
+        remap.record(rollback)
+        with span("bridge.remap", entries=len(remap)):
+            return remap.run(ipr) and success
+
+    except Exception as e:
+        log.error("Configuration aborted", error=e)
+        return False
+    finally:
+        log.info(
+            "Interface index cache: {hits} hits, {misses} misses",
+            hits=ipr.hits,
+            misses=ipr.misses,
+        )
+        if owned:
+            ipr.close()
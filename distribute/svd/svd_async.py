@@ -0,0 +1,99 @@
+from typing import Optional
+from pyroute2 import AsyncIPRoute
+from common.types import EnvConf, compile_config, validate_config
+from common.rollback_manager import RollbackManager
+from common.ifindex_cache import AsyncIfIndexCache
+from common.log import log
+from common.metrics import instrument
+from common.trace import span
+from common.query_async import get_interface_ip
+from common.svd import build_svd_plan
+from common.executor import execute_plan_async
+from distribute.svd.svd import svd_last_config
+
+
+async def configure_vxlan_bgp_evpn_distribute_svd(
+    conf: EnvConf,
+    rollback: RollbackManager,
+    last_state: Optional[dict] = None,
+    concurrency: int = 64,
+    reconcile: bool = False,
+    resume: bool = False,
+    ipr: Optional[AsyncIPRoute] = None,
+) -> bool:
+    """distribute.svd.svd中主配置函数的asyncio版本，按依赖并发执行"""
+    if not validate_config(conf):
+        log.error("Configuration validation failed")
+        return False
+    if reconcile or resume:
+        log.error("SVD mode does not support --reconcile/--resume")
+        return False
+    compiled = compile_config(conf)
+
+    # 传入的ipr（例如common.fake_iproute.FakeAsyncIPRoute）由调用方关闭
+    owned = ipr is None
+    ipr = AsyncIfIndexCache(instrument(AsyncIPRoute(nlm_echo=True) if owned else ipr))
+
+    try:
+        with span("kernel.dump"):
+            await ipr.seed()
+
+        # 检查物理接口
+        if not await ipr.link_lookup(ifname=conf["UnderlayEth"]):
+            log.error(
+                "Underlay interface {entity} not found", entity=conf["UnderlayEth"]
+            )
+            return False
+
+        if not await ipr.link_lookup(ifname=conf["OverlayEth"]):
+            log.error("Overlay interface {entity} not found", entity=conf["OverlayEth"])
+            return False
+
+        # 获取Underlay IP
+        underlayEthIPAddr = await get_interface_ip(ipr, conf["UnderlayEth"])
+        if not underlayEthIPAddr or not underlayEthIPAddr.get("ipv4"):
+            log.error(
+                "Underlay interface {entity} has no IPv4 address",
+                entity=conf["UnderlayEth"],
+            )
+            return False
+
+        underlay_ip = underlayEthIPAddr["ipv4"][0]
+        if not underlay_ip:
+            log.error("Underlay interface IP address is empty")
+            return False
+
+        last_config = svd_last_config(last_state, compiled)
+        with span("plan.build"):
+            (unmap, plan, remap) = build_svd_plan(compiled, underlay_ip, last_config)
+        log.info(
+            "SVD plan: {unmap} bridge entries to remove, {operations} operations, "
+            "{remap} bridge entries to add",
+            unmap=len(unmap),
+            operations=len(plan),
+            remap=len(remap),
+        )
+
+        with span("bridge.unmap", entries=len(unmap)):
+            await unmap.run_async(ipr)
+        with span("execute", operations=len(plan)):
+            success = await execute_plan_async(ipr, rollback, plan, concurrency)
+        failed_units = rollback.failed_units()
+        if not success and not failed_units:
+            return False
+        remap = remap.without_units(failed_units)
+        remap.record(rollback)
+        with span("bridge.remap", entries=len(remap)):
+            return await remap.run_async(ipr) and success
+
+    except Exception as e:
+        log.error("Configuration aborted", error=e)
+        return False
+    finally:
+        log.info(
+            "Interface index cache: {hits} hits, {misses} misses",
+            hits=ipr.hits,
+            misses=ipr.misses,
+        )
+        if owned:
+            ipr.close()
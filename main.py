@@ -1,51 +1,334 @@
 import os
+import sys
 import json
-from pyroute2 import IPRoute
-from common.types import EnvConf
-from common.rollback_manager import RollbackManager
+import time
+import argparse
+from common.types import SVD_MODE, EnvConf, compile_config, validate_config
 from common.state_manager import StateManager
-from distribute.sdr.sdr import configure_vxlan_bgp_evpn_distribute_sdr
+from common.fastpath import is_unchanged, kernel_marker
+from common.metrics import METRICS, instrument
+from common.trace import TRACER, span
+from common.log import LEVELS, log
 
+# pyroute2和各配置模块在确认需要改动内核之后才导入，见下方快速路径
 
-if __name__ == "__main__":
-    print("Starting VXLAN BGP EVPN configuration...")
+
+def apply_config(MainEnvConfRaw: str, args: argparse.Namespace) -> dict:
+    """在当前网络命名空间中应用一份配置，返回结果摘要
+
+    status为unchanged（走快速路径）、invalid、ok、partial（按实体回滚了
+    failed_units）、failed（已全部回滚）或error；operations为本次记录的操作数。
+    """
+    log.info("Starting VXLAN BGP EVPN configuration...")
+    result = {"status": "error", "success": False}
+    rollback = None
     try:
         # 加载配置
-        MainEnvConfRaw = os.environ.get("VXLANBGP_MAIN_CONF", "")
         if not MainEnvConfRaw:
             raise ValueError("VXLANBGP_MAIN_CONF environment variable not set")
 
-        MainEnvConf: EnvConf = json.loads(MainEnvConfRaw)
-
-        # 初始化回滚管理器
-        rollback = RollbackManager()
+        with span("config.parse"):
+            MainEnvConf: EnvConf = json.loads(MainEnvConfRaw)
 
         # 加载上次执行状态
-        last_state = StateManager.load_state()
+        with span("state.load"):
+            last_state = StateManager.load_state()
+
+        # 快速路径：配置摘要与上次成功的状态一致，且内核标记未变时直接退出，
+        # 不打开netlink socket，也不重写状态文件
+        compiled = None
+        if not args.force and not args.reconcile:
+            try:
+                with span("fastpath"):
+                    compiled = compile_config(MainEnvConf)
+                    unchanged = is_unchanged(compiled, last_state)
+                if unchanged:
+                    log.info("Configuration and kernel state unchanged, nothing to do.")
+                    return {"status": "unchanged", "success": True}
+            except (AttributeError, KeyError, TypeError):
+                # 配置不完整或不是对象，交给下面的校验报告
+                compiled = None
+
+        # 在打开任何netlink socket之前完成校验：错误的配置不会改动内核，也无需回滚
+        with span("validate"):
+            valid = validate_config(MainEnvConf)
+        if not valid:
+            log.error("Configuration validation failed")
+            return {"status": "invalid", "success": False}
+        if compiled is None:
+            compiled = compile_config(MainEnvConf)
+        # SVD模式不支持按内核快照协调和继续执行：在改动内核之前拒绝
+        if MainEnvConf.get("Mode") == SVD_MODE and (args.reconcile or args.resume):
+            log.error("SVD mode does not support --reconcile/--resume")
+            return {"status": "invalid", "success": False}
+
+        # --plan：在内核的内存副本上执行，只输出将要发出的请求和耗时估计
+        if args.plan:
+            from common.dry_run import plan_config
+
+            return plan_config(MainEnvConf, last_state, args)
+
+        import asyncio
+        from pyroute2 import IPRoute
+        from common.rollback_manager import RollbackManager
+        from distribute.sdr.sdr import configure_vxlan_bgp_evpn_distribute_sdr
+        from distribute.sdr.sdr_async import (
+            configure_vxlan_bgp_evpn_distribute_sdr as configure_vxlan_bgp_evpn_distribute_sdr_async,
+        )
+        from distribute.svd.svd import configure_vxlan_bgp_evpn_distribute_svd
+        from distribute.svd.svd_async import (
+            configure_vxlan_bgp_evpn_distribute_svd as configure_vxlan_bgp_evpn_distribute_svd_async,
+        )
+
+        # 上次运行中途中断：--resume时从检查点继续，其已记录的操作并入本次运行；
+        # 否则按操作日志回滚它已经发出的操作。中断之前的快照保持不变，本次以它
+        # 为上次的配置，按内核快照协调（见distribute.sdr.sdr.prepare_run）
+        interrupted_operations = None
+        if last_state and last_state.get("interrupted") and args.resume:
+            log.info("Resuming interrupted run from its checkpoints...")
+            interrupted_operations = last_state["operations"]
+        elif last_state and last_state.get("interrupted"):
+            log.warning(
+                "Last run was interrupted, rolling back its journaled operations..."
+            )
+            interrupted = RollbackManager.from_operations(last_state["operations"])
+            with span("rollback"), instrument(IPRoute()) as ipr:
+                interrupted.rollback(ipr)
+
+        # 初始化回滚管理器，每条操作在发出之前写入操作日志
+        journal = StateManager.begin(MainEnvConf)
+        if interrupted_operations is not None:
+            rollback = RollbackManager.from_operations(
+                interrupted_operations, journal, args.rollback_scope
+            )
+        else:
+            rollback = RollbackManager(journal, args.rollback_scope)
 
         success = False
+        start = time.perf_counter()
 
         match MainEnvConf.get("Mode"):
+            case "distribute-symmetric" if args.engine == "async":
+                success = asyncio.run(
+                    configure_vxlan_bgp_evpn_distribute_sdr_async(
+                        MainEnvConf,
+                        rollback,
+                        last_state,
+                        args.concurrency,
+                        args.reconcile,
+                        args.resume,
+                    )
+                )
             case "distribute-symmetric":
-                success = configure_vxlan_bgp_evpn_distribute_sdr(MainEnvConf, rollback, last_state)
+                success = configure_vxlan_bgp_evpn_distribute_sdr(
+                    MainEnvConf, rollback, last_state, args.reconcile, args.resume
+                )
+            case "distribute-symmetric-svd" if args.engine == "async":
+                success = asyncio.run(
+                    configure_vxlan_bgp_evpn_distribute_svd_async(
+                        MainEnvConf,
+                        rollback,
+                        last_state,
+                        args.concurrency,
+                        args.reconcile,
+                        args.resume,
+                    )
+                )
+            case "distribute-symmetric-svd":
+                success = configure_vxlan_bgp_evpn_distribute_svd(
+                    MainEnvConf, rollback, last_state, args.reconcile, args.resume
+                )
             case _:
                 raise Exception("Imple me")
+        duration = time.perf_counter() - start
+        if TRACER.enabled:
+            TRACER.complete(
+                "configure",
+                start,
+                start + duration,
+                "phase",
+                {"mode": MainEnvConf.get("Mode")},
+            )
+        result["duration"] = round(duration, 3)
+        result["operations"] = len(rollback.log)
 
-        # 保存当前状态
-        StateManager.save_state(MainEnvConf, success, rollback.operations)
+        if rollback.unit_results:
+            rollback.report()
 
-        if success:
-            print("Configuration completed successfully.")
+        # 按实体回滚：执行器已跳过失败的实体，只回滚它们，其余实体作为部分成功提交
+        failed_units = rollback.failed_units()
+        if not success and args.rollback_scope == "unit" and failed_units:
+            log.info("Configuration partially failed, rolling back failed units...")
+            with span("rollback"), instrument(IPRoute()) as ipr:
+                rollback.rollback_units(ipr, failed_units)
+            with span("state.save"):
+                StateManager.save_state(
+                    compiled.without_units(failed_units),
+                    True,
+                    rollback.log.to_compact(),
+                    journal=journal,
+                    failed_units=sorted(failed_units),
+                    duration=duration,
+                )
+            log.info("Rollback of failed units completed.")
+            result.update(status="partial", failed_units=sorted(failed_units))
         else:
-            print("Configuration failed, initiating rollback...")
-            with IPRoute() as ipr:
-                rollback.rollback(ipr)
-            print("Rollback completed.")
-    except json.JSONDecodeError:
-        print("Error: Invalid JSON configuration")
+            # 保存当前状态；成功时同时记录内核标记，供下次运行走快速路径
+            with span("state.save"):
+                StateManager.save_state(
+                    MainEnvConf,
+                    success,
+                    rollback.log.to_compact(),
+                    digests=compiled.digests(),
+                    kernel_marker=(
+                        kernel_marker(compiled.ifnames()) if success else None
+                    ),
+                    journal=journal,
+                    duration=duration,
+                )
+
+            if success:
+                log.info("Configuration completed successfully.")
+                result.update(status="ok", success=True)
+            else:
+                log.info("Configuration failed, initiating rollback...")
+                with span("rollback"), instrument(IPRoute()) as ipr:
+                    rollback.rollback(ipr)
+                log.info("Rollback completed.")
+                result["status"] = "failed"
+    except json.JSONDecodeError as e:
+        log.error("Invalid JSON configuration", error=e)
     except Exception as e:
-        print(f"Error: {str(e)}")
+        log.error("Unexpected error", error=e)
         # 如果配置过程中发生异常，也执行回滚
-        with IPRoute() as ipr:
-            rollback.rollback(ipr)
-        print("Rollback completed due to unexpected error.")
+        if rollback is not None:
+            with span("rollback"), instrument(IPRoute()) as ipr:
+                rollback.rollback(ipr)
+            log.info("Rollback completed due to unexpected error.")
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="VXLAN BGP EVPN configuration")
+    parser.add_argument(
+        "--engine",
+        choices=["batch", "async"],
+        default="batch",
+        help="batch: 逐层流水线批量提交; async: asyncio按依赖并发执行",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=64,
+        help="async引擎同时在途的netlink请求数上限",
+    )
+    parser.add_argument(
+        "--reconcile",
+        action="store_true",
+        help="不依赖状态文件，对比内核当前状态生成最小变更（SVD模式不支持）",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="上次运行中断时，从检查点继续执行而不是回滚（SVD模式不支持）",
+    )
+    parser.add_argument(
+        "--rollback-scope",
+        choices=["all", "unit"],
+        default="all",
+        help="all: 失败时回滚本次全部操作; unit: 只回滚失败的VRF/L2VNI，提交其余实体",
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="跳过快速路径，按正常流程执行",
+    )
+    parser.add_argument(
+        "--plan",
+        action="store_true",
+        help="不改动内核：输出将要发出的netlink请求、各类操作的数量、往返次数和耗时估计",
+    )
+    parser.add_argument(
+        "--plan-latency",
+        metavar="FILE",
+        help="--plan估计耗时所用的延迟：之前--metrics写出的PREFIX.json，默认测量本机的往返",
+    )
+    parser.add_argument(
+        "--targets",
+        metavar="FILE",
+        help="多命名空间模式：按FILE中列出的netns及各自的配置并行执行",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=0,
+        help="多命名空间模式同时执行的工作进程数，默认为CPU数",
+    )
+    parser.add_argument(
+        "--report",
+        metavar="FILE",
+        help="多命名空间模式：把汇总结果写入FILE（JSON）",
+    )
+    parser.add_argument(
+        "--metrics",
+        metavar="PREFIX",
+        help="统计每次netlink调用，结束时写出PREFIX.prom（Prometheus）和PREFIX.json",
+    )
+    parser.add_argument(
+        "--trace",
+        metavar="FILE",
+        help="把各阶段、每个VRF/L2VNI和每个netlink请求的耗时写入FILE（Chrome trace JSON）",
+    )
+    parser.add_argument(
+        "--profile",
+        metavar="FILE",
+        help="用cProfile运行，把统计写入FILE（python -m pstats FILE查看）",
+    )
+    parser.add_argument(
+        "--log-level",
+        choices=list(LEVELS),
+        default="info",
+        help="日志级别；debug时输出每个操作",
+    )
+    parser.add_argument(
+        "--log-format",
+        choices=["text", "json"],
+        default="text",
+        help="json: 每行一个带entity/op/errno等字段的JSON对象",
+    )
+    parser.add_argument("--result", metavar="FILE", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    log.configure(args.log_level, args.log_format, os.environ.get("VXLANBGP_NETNS"))
+
+    if args.targets:
+        from common.netns_pool import apply_targets
+
+        results = apply_targets(args.targets, args)
+        sys.exit(0 if all(r["success"] for r in results) else 1)
+
+    METRICS.enabled = bool(args.metrics)
+    TRACER.enabled = bool(args.trace)
+    profiler = None
+    if args.profile:
+        import cProfile
+
+        profiler = cProfile.Profile()
+        profiler.enable()
+    with span("apply"):
+        result = apply_config(os.environ.get("VXLANBGP_MAIN_CONF", ""), args)
+    if profiler is not None:
+        profiler.disable()
+        profiler.dump_stats(args.profile)
+    if args.trace:
+        TRACER.write(args.trace)
+    if args.metrics:
+        netns = os.environ.get("VXLANBGP_NETNS")
+        METRICS.write(args.metrics, {"netns": netns} if netns else {}, result)
+    log.flush()
+    # 多命名空间模式的工作进程通过--result把结果交给父进程汇总
+    if args.result:
+        with open(args.result, "w") as f:
+            json.dump(result, f)
+    # 与--targets一致：只有ok、unchanged（以及预计会成功的--plan）以0退出，
+    # failed、partial、invalid和error以1退出，cron或systemd据此发现失败的运行
+    sys.exit(0 if result["success"] else 1)
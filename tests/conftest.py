@@ -0,0 +1,211 @@
+"""测试共用的夹具：在common.fake_iproute的模拟内核上运行main.apply_config
+
+apply_config和各配置函数打开的IPRoute/AsyncIPRoute被换成作用于同一个
+FakeKernel的FakeIPRoute/FakeAsyncIPRoute，状态文件和操作日志写到tmp_path，
+因此测试不需要root，也不会改动本机的网络配置。make_conf生成的合成配置与
+bench/scale_bench.py的相同，但测试不依赖基准脚本。
+"""
+
+import os
+import sys
+import json
+import argparse
+from typing import Optional
+
+import pytest
+from pyroute2.netlink.exceptions import NetlinkError
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common import state_manager
+from common.log import log
+from common.fake_iproute import FakeAsyncIPRoute, FakeIPRoute, FakeKernel
+from common.rollback_manager import RollbackManager
+from distribute.sdr import sdr, sdr_async
+from distribute.svd import svd, svd_async
+
+UNDERLAY = "ul0"
+OVERLAY = "ol0"
+UNDERLAY_IP = "192.0.2.1"
+
+
+def make_conf(vlans: int, vrfs: int) -> dict:
+    """合成配置：VLAN按顺序轮流分配到各VRF"""
+    return {
+        "Mode": "distribute-symmetric",
+        "UnderlayEth": UNDERLAY,
+        "OverlayEth": OVERLAY,
+        "VRFMapL3VNI": [
+            {
+                "VRFName": f"vrf{i}",
+                "VxLANL3VNI": 100000 + i,
+                "VRFRouteTableID": 1000 + i,
+                "VxLANInOutDomainVethPrefix": f"vt{i}",
+                "InOutVethRequire": False,
+                "InVRFVethIPAddr": f"169.254.{i >> 6}.{(i & 63) * 4 + 1}/30",
+                "ExternalVRFVethIPAddr": f"169.254.{i >> 6}.{(i & 63) * 4 + 2}/30",
+            }
+            for i in range(1, vrfs + 1)
+        ],
+        "VlanMapVNI": [
+            {
+                "VlanID": j,
+                "L2VxLANVNI": 10000 + j,
+                "L2VxLANVNIIPAddr": f"10.{j >> 8}.{j & 255}.1/24",
+                "L2VxLANVNIMacAddr": f"02:00:00:00:{j >> 8:02x}:{j & 255:02x}",
+                "L3VxLANVNI": 100000 + (j - 1) % vrfs + 1,
+            }
+            for j in range(1, vlans + 1)
+        ],
+    }
+
+
+def change_one_percent(conf: dict) -> dict:
+    """修改1%（至少一个）VLAN的IP地址"""
+    conf = json.loads(json.dumps(conf))
+    vlans = conf["VlanMapVNI"]
+    for vlan in vlans[: max(1, len(vlans) // 100)]:
+        j = vlan["VlanID"]
+        vlan["L2VxLANVNIIPAddr"] = f"11.{j >> 8}.{j & 255}.1/24"
+    return conf
+
+
+def make_kernel() -> FakeKernel:
+    """带有已启用的underlay/overlay接口和underlay地址的模拟内核"""
+    kernel = FakeKernel()
+    with FakeIPRoute(kernel) as ipr:
+        for ifname in (UNDERLAY, OVERLAY):
+            ipr.link("add", ifname=ifname, kind="dummy", state="up")
+        ipr.addr(
+            "add",
+            index=ipr.link_lookup(ifname=UNDERLAY)[0],
+            address=UNDERLAY_IP,
+            mask=24,
+        )
+    return kernel
+
+
+class Interrupted(KeyboardInterrupt):
+    """模拟进程在运行中途被中断：apply_config和事件循环都不会捕获它"""
+
+
+@pytest.fixture(autouse=True)
+def flush_log():
+    """日志缓冲在每个测试结束时写出，由pytest随该测试捕获"""
+    yield
+    log.flush()
+
+
+def make_args(**kwarg) -> argparse.Namespace:
+    args = {
+        "engine": "batch",
+        "concurrency": 64,
+        "reconcile": False,
+        "resume": False,
+        "rollback_scope": "all",
+        "force": True,
+        "plan": False,
+        "plan_latency": None,
+    }
+    args.update(kwarg)
+    return argparse.Namespace(**args)
+
+
+@pytest.fixture
+def kernel(monkeypatch) -> FakeKernel:
+    """带有ul0/ol0和underlay地址的模拟内核，apply_config打开的socket都作用于它"""
+    kernel = make_kernel()
+    monkeypatch.setattr(
+        "pyroute2.IPRoute", lambda *args, **kwarg: FakeIPRoute(kernel, **kwarg)
+    )
+    for module in (sdr, svd):
+        monkeypatch.setattr(
+            module, "IPRoute", lambda *args, **kwarg: FakeIPRoute(kernel, **kwarg)
+        )
+    for module in (sdr_async, svd_async):
+        monkeypatch.setattr(
+            module,
+            "AsyncIPRoute",
+            lambda *args, **kwarg: FakeAsyncIPRoute(kernel, **kwarg),
+        )
+    return kernel
+
+
+@pytest.fixture
+def state(monkeypatch, tmp_path):
+    """把状态文件和操作日志放到tmp_path"""
+    path = str(tmp_path / "state.json")
+    monkeypatch.setattr(state_manager, "STATE_FILE", path)
+    monkeypatch.setattr(state_manager, "JOURNAL_FILE", path + ".journal")
+    monkeypatch.setattr(state_manager, "STATE_BACKEND", "json")
+    return path
+
+
+@pytest.fixture
+def apply(kernel, state):
+    """apply(conf, **args)：在模拟内核上运行一次apply_config，返回结果摘要"""
+    from main import apply_config
+
+    def run(conf: dict, **kwarg) -> dict:
+        return apply_config(json.dumps(conf), make_args(**kwarg))
+
+    return run
+
+
+@pytest.fixture
+def interrupt(kernel, monkeypatch):
+    """interrupt(n)：模拟内核在第n+1个修改请求时使进程中断；interrupt(None)取消"""
+    request = kernel.request
+
+    def arm(after: Optional[int]):
+        count = 0
+
+        def crash(method, *args, **kwarg):
+            nonlocal count
+            if method in ("link", "addr") and args[0] in ("add", "set", "del"):
+                count += 1
+                if count > after:
+                    raise Interrupted()
+            return request(method, *args, **kwarg)
+
+        monkeypatch.setattr(kernel, "request", request if after is None else crash)
+
+    return arm
+
+
+@pytest.fixture
+def reject(kernel, monkeypatch):
+    """reject(ifname, code)：模拟内核以错误码code拒绝创建接口ifname"""
+    request = kernel.request
+
+    def arm(ifname: str, code: int):
+        def failing(method, *args, **kwarg):
+            if method == "link" and args[0] == "add" and kwarg.get("ifname") == ifname:
+                kernel.requests += 1
+                raise NetlinkError(code, os.strerror(code))
+            return request(method, *args, **kwarg)
+
+        monkeypatch.setattr(kernel, "request", failing)
+
+    return arm
+
+
+def topology(kernel: FakeKernel) -> dict:
+    """接口名 -> (类型, master名, 父接口名, 地址, 是否启用)，用于比较两个内核"""
+    result = {}
+    for link in kernel.links.values():
+        master = kernel.links[link.master].ifname if link.master else None
+        parent = kernel.links[link.link].ifname if link.link in kernel.links else None
+        addrs = tuple(sorted(kernel.addrs.get(link.index, ())))
+        result[link.ifname] = (link.kind, master, parent, addrs, bool(link.flags & 1))
+    return result
+
+
+def expected(conf: dict) -> dict:
+    """在空的模拟内核上直接完整应用conf得到的结果"""
+    kernel = make_kernel()
+    with FakeIPRoute(kernel, nlm_echo=True) as ipr:
+        assert sdr.configure_vxlan_bgp_evpn_distribute_sdr(
+            conf, RollbackManager(), ipr=ipr
+        )
+    return topology(kernel)
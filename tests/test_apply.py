@@ -0,0 +1,98 @@
+import json
+
+import pytest
+
+from common.fake_iproute import FakeIPRoute
+from common.state_manager import StateManager
+from conftest import change_one_percent, expected, make_conf, topology
+
+ENGINES = ["batch", "async"]
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_full_apply(apply, kernel, engine):
+    conf = make_conf(8, 3)
+    conf["VRFMapL3VNI"][0]["InOutVethRequire"] = True
+
+    result = apply(conf, engine=engine)
+
+    assert result["status"] == "ok"
+    links = topology(kernel)
+    assert links["vrf1"][0] == "vrf"
+    assert links["vxlan100001"][1] == "br-vsi100001"
+    assert links["ol0.5"][1:3] == ("br-vsi10005", "ol0")
+    assert links["br-vsi10005"][1] == "vrf2"
+    assert links["br-vsi10005"][3] == (("10.0.5.1", 24),)
+    assert links["vt1-in"][1] == "vrf1"
+    assert links["vt1-ext"][3] == (("169.254.0.6", 30),)
+    assert all(up for (*_, up) in links.values())
+    assert links == expected(conf)
+
+    last_state = StateManager.load_state()
+    assert last_state["success"]
+    assert last_state["config"] == conf
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_incremental_apply(apply, kernel, engine):
+    conf = make_conf(8, 3)
+    assert apply(conf, engine=engine)["status"] == "ok"
+    index = dict(kernel.names)
+
+    changed = change_one_percent(conf)
+    changed["VlanMapVNI"] = (
+        changed["VlanMapVNI"][1:] + make_conf(10, 3)["VlanMapVNI"][8:]
+    )
+    kernel.requests = 0
+    result = apply(changed, engine=engine)
+
+    assert result["status"] == "ok"
+    assert topology(kernel) == expected(changed)
+    # 只改动差异：删除VLAN 1，修改VLAN 2，新增VLAN 9和10
+    assert "br-vsi10001" not in kernel.names
+    assert kernel.requests < 40
+    for name in ("vrf1", "vrf2", "vrf3", "vxlan10003", "br-vsi10008"):
+        assert kernel.names[name] == index[name]
+
+
+def test_unchanged_config_issues_no_requests(apply, kernel):
+    conf = make_conf(4, 2)
+    assert apply(conf)["status"] == "ok"
+
+    kernel.requests = 0
+    assert apply(conf)["status"] == "ok"
+    # 只有link dump和接口查询，没有修改请求
+    assert kernel.requests <= 4
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_failed_apply_rolls_back(apply, kernel, engine):
+    conf = make_conf(4, 2)
+    conf["VRFMapL3VNI"][1]["InOutVethRequire"] = True
+    # 占用vrf2的veth对端名，使本次运行在创建veth时失败
+    with FakeIPRoute(kernel) as ipr:
+        ipr.link("add", ifname="vt2-ext", kind="dummy")
+    baseline = topology(kernel)
+
+    result = apply(conf, engine=engine)
+
+    assert result["status"] == "failed"
+    assert topology(kernel) == baseline
+
+
+def test_validation_failure_touches_nothing(apply, kernel):
+    conf = make_conf(2, 1)
+    conf["VlanMapVNI"][0]["L3VxLANVNI"] = 424242
+    kernel.requests = 0
+
+    assert apply(conf)["status"] == "invalid"
+    assert kernel.requests == 0
+    assert StateManager.load_state() is None
+
+
+def test_state_file_is_compact_json(apply, state):
+    apply(make_conf(2, 1))
+    with open(state) as f:
+        saved = json.load(f)
+    assert saved["success"]
+    assert "strings" in saved["operations"]
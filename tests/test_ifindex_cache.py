@@ -0,0 +1,40 @@
+from common.fake_iproute import FakeIPRoute
+from common.ifindex_cache import IfIndexCache
+from conftest import make_kernel
+
+
+def assert_consistent(cache: IfIndexCache):
+    """lowers是links的反向索引"""
+    lowers = {}
+    for index, link in cache.links.items():
+        lowers.setdefault(link, set()).add(index)
+    assert cache.lowers == lowers
+
+
+def test_lowers_follow_adds_and_deletes():
+    kernel = make_kernel()
+    cache = IfIndexCache(FakeIPRoute(kernel, nlm_echo=True)).seed()
+    ol0 = cache.index["ol0"]
+    for vlan in (7, 8):
+        cache.link("add", ifname=f"ol0.{vlan}", kind="vlan", link=ol0, vlan_id=vlan)
+    cache.link("add", ifname="vt-in", kind="veth", peer="vt-ext")
+    cache.link_lookup(ifname="vt-ext")
+    assert cache.lowers[ol0] == {cache.index["ol0.7"], cache.index["ol0.8"]}
+    assert_consistent(cache)
+
+    cache.link("del", index=cache.index["ol0.7"])
+    assert cache.lowers[ol0] == {cache.index["ol0.8"]}
+    assert_consistent(cache)
+
+    # 删除veth一端：对端由内核一并删除，其名字交给内核确认
+    cache.link("del", index=cache.index["vt-in"])
+    assert "vt-ext" not in cache.index
+    assert "vt-ext" in cache.unresolved
+    assert cache.link_lookup(ifname="vt-ext") == []
+    assert_consistent(cache)
+
+    # 删除父接口：其上的VLAN子接口一并删除
+    cache.link("del", index=ol0)
+    assert "ol0.8" not in cache.index
+    assert ol0 not in cache.lowers
+    assert_consistent(cache)
@@ -0,0 +1,122 @@
+import gc
+import errno
+
+import pytest
+
+from common.state_manager import StateManager
+from distribute.sdr import sdr
+from conftest import Interrupted, expected, make_conf, topology
+
+ENGINES = ["batch", "async"]
+
+# 中断时批次中尚未发出的请求的协程被丢弃
+pytestmark = pytest.mark.filterwarnings("ignore:coroutine .* was never awaited")
+
+
+def interrupted_run(apply, interrupt, conf: dict, after: int, **kwarg):
+    """运行conf，在第after个修改请求时中断，返回中断后重建的状态"""
+    interrupt(after)
+    with pytest.raises(Interrupted):
+        apply(conf, **kwarg)
+    # 被中断的事件循环中的任务在这里回收，其日志由pytest随本测试捕获
+    gc.collect()
+    last_state = StateManager.load_state()
+    assert last_state["interrupted"]
+    return last_state
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_interrupted_first_run_is_rolled_back(apply, kernel, interrupt, engine):
+    baseline = topology(kernel)
+    conf = make_conf(6, 2)
+    interrupted_run(apply, interrupt, conf, 5, engine=engine)
+    assert topology(kernel) != baseline
+    interrupt(None)
+
+    result = apply(conf, engine=engine)
+
+    assert result["status"] == "ok"
+    assert topology(kernel) == expected(conf)
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_interrupted_run_keeps_previous_config(apply, kernel, interrupt, engine):
+    previous = make_conf(4, 3)
+    assert apply(previous, engine=engine)["status"] == "ok"
+    index = {name: kernel.names[name] for name in ("vrf1", "vrf2", "vrf3")}
+    conf = make_conf(8, 3)
+    last_state = interrupted_run(apply, interrupt, conf, 3, engine=engine)
+    # 中断之前的快照仍是上次成功的运行
+    assert last_state["previous"]["success"]
+    assert last_state["previous"]["config"] == previous
+    interrupt(None)
+
+    result = apply(conf, engine=engine)
+
+    assert result["status"] == "ok"
+    assert topology(kernel) == expected(conf)
+    # 上次配置的设备没有被删除重建
+    for name, idx in index.items():
+        assert kernel.names[name] == idx
+
+
+def test_rollback_of_interrupted_run_keeps_snapshot(
+    apply, kernel, interrupt, monkeypatch
+):
+    previous = make_conf(4, 3)
+    assert apply(previous)["status"] == "ok"
+    interrupted_run(apply, interrupt, make_conf(8, 3), 3)
+    interrupt(None)
+
+    # 回滚中断的运行之后，本次运行在改动内核之前再次中断
+    def crash(*args, **kwarg):
+        raise Interrupted()
+
+    monkeypatch.setattr(sdr, "prepare_run", crash)
+    with pytest.raises(Interrupted):
+        apply(make_conf(8, 3))
+
+    last_state = StateManager.load_state()
+    assert last_state["interrupted"]
+    assert last_state["previous"]["success"]
+    assert last_state["previous"]["config"] == previous
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_resume_interrupted_run(apply, kernel, interrupt, engine):
+    previous = make_conf(4, 3)
+    assert apply(previous, engine=engine)["status"] == "ok"
+    conf = make_conf(12, 4)
+    # 中断在最后一层：之前各层完成的实体已经记录了检查点
+    last_state = interrupted_run(apply, interrupt, conf, 40, engine=engine)
+    assert last_state["checkpoints"]
+    index = dict(kernel.names)
+    interrupt(None)
+
+    result = apply(conf, engine=engine, resume=True)
+
+    assert result["status"] == "ok"
+    assert topology(kernel) == expected(conf)
+    # 已完成的实体没有重做
+    for unit in last_state["checkpoints"]:
+        if unit.startswith("l2vni:"):
+            name = f"br-vsi{unit.split(':')[1]}"
+            assert kernel.names[name] == index[name]
+    assert StateManager.load_state()["success"]
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_resume_then_fail_rolls_back_both_runs(
+    apply, kernel, interrupt, reject, engine
+):
+    baseline = topology(kernel)
+    conf = make_conf(6, 2)
+    interrupted_run(apply, interrupt, conf, 5, engine=engine)
+    interrupt(None)
+    # 继续执行时失败：中断的运行和本次运行的操作一起回滚
+    reject("ol0.6", errno.EBUSY)
+
+    result = apply(conf, engine=engine, resume=True)
+
+    assert result["status"] == "failed"
+    assert topology(kernel) == baseline
@@ -0,0 +1,84 @@
+from common.oplog import OperationLog
+from common.rollback_manager import RollbackManager
+
+
+def filled() -> RollbackManager:
+    rollback = RollbackManager()
+    unit = rollback.scoped("l2vni:10005")
+    unit.record_bridge("br-vsi10005", 10005)
+    unit.record_interface("vxlan10005", 10005)
+    unit.record_master_relation("vxlan10005", "br-vsi10005")
+    unit.record_interface("ol0.5", vlan_id=5)
+    unit.record_ip_assignment("br-vsi10005", "10.0.5.1/24")
+    rollback.record_remove_interface("ol0.4")
+    return rollback
+
+
+def test_compact_round_trip():
+    rollback = filled()
+    log = OperationLog.from_compact(rollback.log.to_compact())
+
+    assert list(log.entries()) == list(rollback.log.entries())
+    assert log.to_json() == rollback.operations
+    assert rollback.operations["interfaces"][1] == {
+        "name": "ol0.5",
+        "vni": None,
+        "vlan_id": 5,
+        "action": "add",
+        "unit": "l2vni:10005",
+    }
+
+
+def test_remove_marks_rows_without_rebuilding_columns():
+    rollback = filled()
+    log = rollback.log
+    columns = [log.cat, log.act, log.s1, log.s2, log.n1, log.n2, log.unit]
+    record = ("interfaces", {"name": "vxlan10005", "vni": 10005, "vlan_id": None})
+
+    assert log.remove([(record[0], {**record[1], "unit": "l2vni:10005"})]) == 1
+
+    after = [log.cat, log.act, log.s1, log.s2, log.n1, log.n2, log.unit]
+    assert all(a is b for (a, b) in zip(columns, after))
+    assert len(log) == 5
+    assert rollback.created_interfaces == {"ol0.5"}
+    assert "vxlan10005" not in {e.get("name") for (_, e) in log.entries()}
+    compact = log.to_compact()
+    assert len(compact["cat"]) == 5
+    assert list(OperationLog.from_compact(compact).entries()) == list(log.entries())
+
+
+def test_remove_matches_integer_fields():
+    rollback = RollbackManager()
+    first = rollback.record_bridge_vlan("br0", 10, vni=10010)
+    rollback.record_bridge_vlan("br0", 11, vni=10011)
+    rollback.record_interface("vxlan0", 10, 5)
+
+    # 只有VLAN不同的记录不是同一条操作
+    assert rollback.log.remove([first]) == 1
+    assert [v[3] for v in rollback.log.values("bridge_vlans")] == [11]
+    assert rollback.log.remove([("interfaces", {"name": "vxlan0", "vni": 10})]) == 0
+    assert rollback.log.remove([("interfaces", {"name": "vxlan1", "vni": 10})]) == 0
+    assert len(rollback.log) == 2
+
+
+def test_remove_takes_the_last_match_once():
+    rollback = RollbackManager()
+    records = [rollback.record_interface("vxlan1") for _ in range(3)]
+
+    assert rollback.log.remove(records[:2]) == 2
+    assert rollback.log.remove(records[:2]) == 1
+    assert len(rollback.log) == 0
+    assert rollback.log.remove(records) == 0
+
+
+def test_withdraw_is_replayed_from_the_journal():
+    rollback = filled()
+    withdrawn = rollback.record_interface("vxlan10006", 10006)
+    operations = rollback.operations
+    # 操作日志中被拒绝的请求的记录之后是action为withdraw的同一条记录
+    operations["interfaces"].append({**withdrawn[1], "action": "withdraw"})
+
+    replayed = RollbackManager.from_operations(operations)
+
+    assert replayed.created_interfaces == {"vxlan10005", "ol0.5"}
+    assert len(replayed.log) == len(filled().log)
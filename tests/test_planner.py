@@ -0,0 +1,73 @@
+import copy
+
+import pytest
+
+from common.planner import build_plan
+from common.types import compile_config
+from conftest import UNDERLAY_IP, expected, make_conf, topology
+
+ENGINES = ["batch", "async"]
+
+
+def rename_vrf(conf: dict, old: str, new: str) -> dict:
+    """只修改VRF的名字，L3VNI和路由表不变"""
+    conf = copy.deepcopy(conf)
+    for vrf in conf["VRFMapL3VNI"]:
+        if vrf["VRFName"] == old:
+            vrf["VRFName"] = new
+    return conf
+
+
+def test_full_plan_orders_masters_before_slaves():
+    plan = build_plan(compile_config(make_conf(4, 2)), UNDERLAY_IP)
+
+    assert plan.counts() == {
+        "vrf.add": 2,
+        "bridge.add": 6,
+        "vxlan.add": 6,
+        "addr.add": 4,
+        "vlan.add": 4,
+    }
+    # 第0层只有VRF，VLAN桥接依赖其VRF，VXLAN和VLAN子接口依赖其桥接
+    assert {op.kind for op in plan.levels()[0]} == {"vrf.add"}
+    by_name = {(op.kind, op.ifname): op for op in plan.ops}
+    assert by_name[("vrf.add", "vrf1")] in by_name[("bridge.add", "br-vsi10001")].deps
+    assert by_name[("bridge.add", "br-vsi10001")] in by_name[("vlan.add", "ol0.1")].deps
+
+
+def test_unchanged_config_plans_nothing():
+    conf = compile_config(make_conf(4, 2))
+    assert len(build_plan(conf, UNDERLAY_IP, compile_config(make_conf(4, 2)))) == 0
+
+
+def test_vrf_rename_reattaches_unchanged_bridges():
+    last_conf = compile_config(make_conf(6, 2))
+    conf = compile_config(rename_vrf(make_conf(6, 2), "vrf1", "red"))
+
+    plan = build_plan(conf, UNDERLAY_IP, last_conf)
+
+    reattach = [op for op in plan.ops if op.kind == "master.set"]
+    assert sorted(op.ifname for op in reattach) == [
+        "br-vsi10001",
+        "br-vsi10003",
+        "br-vsi10005",
+    ]
+    for op in reattach:
+        assert op.args["master"] == "red"
+        assert [dep.kind for dep in op.deps] == ["vrf.add"]
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_vrf_rename_apply(apply, kernel, engine):
+    previous = make_conf(6, 2)
+    assert apply(previous, engine=engine)["status"] == "ok"
+    index = dict(kernel.names)
+    conf = rename_vrf(previous, "vrf1", "red")
+
+    result = apply(conf, engine=engine)
+
+    assert result["status"] == "ok"
+    assert topology(kernel) == expected(conf)
+    # VLAN桥接没有重建，只挂到新的VRF上
+    for vni in (10001, 10003, 10005):
+        assert kernel.names[f"br-vsi{vni}"] == index[f"br-vsi{vni}"]
@@ -0,0 +1,73 @@
+import pytest
+
+from common.fake_iproute import FakeIPRoute
+from common.reconcile import KernelSnapshot, reconcile_plan
+from common.rollback_manager import RollbackManager
+from common.types import compile_config
+from distribute.sdr.sdr import configure_vxlan_bgp_evpn_distribute_sdr
+from conftest import UNDERLAY_IP, expected, make_conf, topology
+
+ENGINES = ["batch", "async"]
+
+
+def changes(kernel) -> list:
+    """模拟内核记录的修改请求"""
+    return [
+        (entry["op"], entry["entity"])
+        for entry in kernel.journal
+        if entry["op"].split(".")[1] in ("add", "set", "del")
+    ]
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_reconcile_converged_kernel_is_noop(apply, kernel, engine):
+    conf = make_conf(6, 2)
+    for vrf in conf["VRFMapL3VNI"]:
+        vrf["InOutVethRequire"] = True
+    assert apply(conf, engine=engine)["status"] == "ok"
+    kernel.journal = []
+
+    result = apply(conf, engine=engine, reconcile=True)
+
+    # veth地址在169.254.0.0/16中，同样属于配置，不能当作内核生成的地址忽略
+    assert result["status"] == "ok"
+    assert result["operations"] == 0
+    assert changes(kernel) == []
+    assert topology(kernel) == expected(conf)
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_reconcile_keeps_foreign_devices_matching_names(apply, kernel, engine):
+    previous = make_conf(6, 2)
+    assert apply(previous, engine=engine)["status"] == "ok"
+    # 运维人员自己创建的、符合命名规则的接口
+    with FakeIPRoute(kernel) as ipr:
+        for ifname in ("vxlan100", "br-vsi7", "ol0.99"):
+            ipr.link("add", ifname=ifname, kind="dummy")
+    foreign = {name: kernel.names[name] for name in ("vxlan100", "br-vsi7", "ol0.99")}
+    conf = make_conf(4, 2)
+
+    result = apply(conf, engine=engine, reconcile=True)
+
+    # 上次配置中的VLAN 5和6被删除，其他接口不是本工具创建的，保留
+    assert result["status"] == "ok"
+    links = topology(kernel)
+    for name, idx in foreign.items():
+        assert kernel.names[name] == idx
+        del links[name]
+    assert links == expected(conf)
+
+
+def test_reconcile_deletes_devices_from_operation_log(kernel):
+    conf = compile_config(make_conf(4, 2))
+    with FakeIPRoute(kernel, nlm_echo=True) as ipr:
+        assert configure_vxlan_bgp_evpn_distribute_sdr(
+            make_conf(5, 2), RollbackManager(), ipr=ipr
+        )
+        snapshot = KernelSnapshot.capture(ipr)
+
+    # 没有上次的配置时，只有操作记录中本工具创建过的接口被删除
+    plan = reconcile_plan(conf, UNDERLAY_IP, snapshot, created={"br-vsi10005"})
+    assert [(op.kind, op.ifname) for op in plan.ops] == [("bridge.del", "br-vsi10005")]
+    plan = reconcile_plan(conf, UNDERLAY_IP, snapshot)
+    assert len(plan) == 0
@@ -0,0 +1,124 @@
+import gc
+import errno
+
+import pytest
+
+from common.fake_iproute import FakeIPRoute
+from common.rollback_manager import RollbackManager
+from common.state_manager import StateManager
+from conftest import Interrupted, expected, make_conf, topology
+
+ENGINES = ["batch", "async"]
+
+
+def add_foreign(kernel, ifname: str) -> int:
+    """在运行之前创建一个同名的外来接口，返回其ifindex"""
+    with FakeIPRoute(kernel) as ipr:
+        ipr.link("add", ifname=ifname, kind="dummy")
+    return kernel.names[ifname]
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_unit_rollback_keeps_other_units(apply, kernel, engine):
+    conf = make_conf(6, 2)
+    foreign = add_foreign(kernel, "vxlan10002")
+
+    result = apply(conf, engine=engine, rollback_scope="unit")
+
+    assert result["status"] == "partial"
+    assert result["failed_units"] == ["l2vni:10002"]
+    links = topology(kernel)
+    # 只回滚失败的实体：其桥和VLAN子接口被删除，外来的vxlan10002保留
+    assert "br-vsi10002" not in links
+    assert "ol0.2" not in links
+    assert kernel.names["vxlan10002"] == foreign
+    assert links["vxlan10002"][0] == "dummy"
+    # 其余实体作为部分成功提交
+    for vni in (10001, 10003, 10004, 10005, 10006):
+        assert links[f"vxlan{vni}"][1] == f"br-vsi{vni}"
+    last_state = StateManager.load_state()
+    assert last_state["success"]
+    assert last_state["failed_units"] == ["l2vni:10002"]
+    assert len(last_state["config"]["VlanMapVNI"]) == 5
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_rerun_after_unit_rollback_completes(apply, kernel, engine):
+    conf = make_conf(6, 2)
+    add_foreign(kernel, "ol0.3")
+    assert apply(conf, engine=engine, rollback_scope="unit")["status"] == "partial"
+    index = dict(kernel.names)
+    with FakeIPRoute(kernel) as ipr:
+        ipr.link("del", index=kernel.names["ol0.3"])
+
+    result = apply(conf, engine=engine, rollback_scope="unit")
+
+    # 上次有失败的实体时按内核快照协调，只补齐失败的实体
+    assert result["status"] == "ok"
+    assert topology(kernel) == expected(conf)
+    for name in ("vrf1", "vrf2", "br-vsi10001", "vxlan10004"):
+        assert kernel.names[name] == index[name]
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_failed_apply_keeps_foreign_devices(apply, kernel, engine):
+    conf = make_conf(6, 2)
+    foreign = {name: add_foreign(kernel, name) for name in ("vxlan10002", "ol0.3")}
+    baseline = topology(kernel)
+
+    result = apply(conf, engine=engine)
+
+    # 创建时EEXIST的接口不是本次运行创建的，全部回滚时同样保留
+    assert result["status"] == "failed"
+    assert topology(kernel) == baseline
+    for name, idx in foreign.items():
+        assert kernel.names[name] == idx
+
+
+# 中断时批次中尚未发出的请求的协程被丢弃
+@pytest.mark.filterwarnings("ignore:coroutine .* was never awaited")
+@pytest.mark.parametrize("engine", ENGINES)
+def test_withdrawn_records_survive_journal_replay(apply, kernel, interrupt, engine):
+    conf = make_conf(6, 2)
+    foreign = add_foreign(kernel, "vxlan10002")
+    baseline = topology(kernel)
+    # 按实体回滚时失败的实体不会停止运行：30个创建请求全部完成（含被拒绝的
+    # vxlan10002）之后，在回滚失败实体的第一个请求时中断
+    interrupt(30)
+    with pytest.raises(Interrupted):
+        apply(conf, engine=engine, rollback_scope="unit")
+    gc.collect()
+    interrupt(None)
+
+    # 由操作日志重建的回滚管理器同样撤销了被拒绝的记录
+    last_state = StateManager.load_state()
+    assert last_state["interrupted"]
+    interrupted = RollbackManager.from_operations(last_state["operations"])
+    assert "vxlan10002" not in interrupted.created_interfaces
+    assert "vxlan10003" in interrupted.created_interfaces
+    with FakeIPRoute(kernel) as ipr:
+        interrupted.rollback(ipr)
+
+    assert topology(kernel) == baseline
+    assert kernel.names["vxlan10002"] == foreign
+
+
+def test_rollback_skips_cascaded_veth_peers(apply, kernel, reject):
+    conf = make_conf(4, 2)
+    for vrf in conf["VRFMapL3VNI"]:
+        vrf["InOutVethRequire"] = True
+    baseline = topology(kernel)
+    reject("ol0.4", errno.EBUSY)
+    kernel.journal = []
+
+    assert apply(conf)["status"] == "failed"
+
+    assert topology(kernel) == baseline
+    # 回滚从最后一次link dump开始：删除veth一端时对端连同其地址一并删除，
+    # 不再单独撤销对端的地址或把它放入删除组
+    ops = [(entry["op"], entry["entity"]) for entry in kernel.journal]
+    start = max(i for (i, (op, _)) in enumerate(ops) if op == "link.dump")
+    assert ops[-1][0] == "group.del"
+    for op, entity in ops[start:]:
+        assert op != "addr.del"
+        assert not entity.endswith("-ext")
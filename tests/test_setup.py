@@ -0,0 +1,66 @@
+import asyncio
+
+import pytest
+
+from common import setup, setup_async
+from common.fake_iproute import FakeAsyncIPRoute, FakeIPRoute
+from common.ifindex_cache import AsyncIfIndexCache, IfIndexCache
+from common.rollback_manager import RollbackManager
+from conftest import make_kernel, topology
+
+# (辅助函数名, 参数)：master或父接口不存在，ifindex解析失败
+MISSING = [
+    ("create_bridge", {"name": "br-x", "master": "vrf9"}),
+    ("create_vlan_interface", {"parent": "ol9", "vlan_id": 5}),
+    ("create_vxlan_interface", {"vni": 42, "local_ip": "192.0.2.1", "master": "br9"}),
+    ("create_veth", {"name": "vt9-in", "peername": "vt9-ext", "master": "vrf9"}),
+]
+NAMES = {
+    "create_bridge": "br-x",
+    "create_vlan_interface": "ol9.5",
+    "create_vxlan_interface": "vxlan42",
+    "create_veth": "vt9-in",
+}
+
+# 创建失败时的返回值；create_veth返回(接口名, 对端名)
+FAILED = ("", ("", ""))
+
+
+def foreign_kernel(helper: str):
+    """带有与helper要创建的接口同名的外来接口的模拟内核"""
+    kernel = make_kernel()
+    with FakeIPRoute(kernel) as ipr:
+        ipr.link("add", ifname=NAMES[helper], kind="dummy")
+    return kernel
+
+
+@pytest.mark.parametrize("helper, kwarg", MISSING)
+def test_unresolved_master_leaves_no_record(helper, kwarg):
+    kernel = foreign_kernel(helper)
+    baseline = topology(kernel)
+    rollback = RollbackManager()
+
+    with FakeIPRoute(kernel, nlm_echo=True) as ipr:
+        result = getattr(setup, helper)(IfIndexCache(ipr), rollback, **kwarg)
+        assert result in FAILED
+        assert len(rollback.log) == 0
+        rollback.rollback(ipr)
+
+    assert topology(kernel) == baseline
+
+
+@pytest.mark.parametrize("helper, kwarg", MISSING)
+def test_unresolved_master_leaves_no_record_async(helper, kwarg):
+    kernel = foreign_kernel(helper)
+    baseline = topology(kernel)
+    rollback = RollbackManager()
+
+    async def run():
+        ipr = AsyncIfIndexCache(FakeAsyncIPRoute(kernel, nlm_echo=True))
+        return await getattr(setup_async, helper)(ipr, rollback, **kwarg)
+
+    assert asyncio.run(run()) in FAILED
+    assert len(rollback.log) == 0
+    with FakeIPRoute(kernel) as ipr:
+        rollback.rollback(ipr)
+    assert topology(kernel) == baseline
@@ -0,0 +1,77 @@
+import pytest
+
+from common import state_manager
+from common.state_manager import StateManager
+from common.state_sqlite import SqliteStateStore
+from common.types import compile_config
+from conftest import change_one_percent, expected, make_conf, topology
+
+
+@pytest.fixture
+def sqlite(apply, monkeypatch, tmp_path):
+    """把状态后端换成tmp_path中的SQLite数据库，返回其路径"""
+    path = str(tmp_path / "state.db")
+    monkeypatch.setattr(state_manager, "STATE_BACKEND", "sqlite")
+    monkeypatch.setattr(state_manager, "STATE_DB", path)
+    return path
+
+
+def grown(conf: dict, vlans: int) -> dict:
+    """conf加上make_conf(vlans, ...)中多出的VLAN"""
+    vrfs = len(conf["VRFMapL3VNI"])
+    more = make_conf(vlans, vrfs)["VlanMapVNI"][len(conf["VlanMapVNI"]) :]
+    return {**conf, "VlanMapVNI": conf["VlanMapVNI"] + more}
+
+
+def test_incremental_apply_on_sqlite(apply, kernel, sqlite):
+    previous = make_conf(8, 3)
+    assert apply(previous)["status"] == "ok"
+    conf = grown(change_one_percent(previous), 10)
+    kernel.requests = 0
+
+    result = apply(conf)
+
+    assert result["status"] == "ok"
+    assert topology(kernel) == expected(conf)
+    # 只改动差异：修改VLAN 1，新增VLAN 9和10
+    assert kernel.requests < 30
+    last_state = StateManager.load_state()
+    assert last_state["run_id"] == 2
+    assert "config" not in last_state
+
+
+def test_last_config_is_rebuilt_from_changed_entries(apply, sqlite):
+    previous = make_conf(8, 3)
+    assert apply(previous)["status"] == "ok"
+    conf = compile_config(grown(change_one_percent(previous), 10))
+
+    last_config = StateManager.last_config(StateManager.load_state(), conf)
+
+    assert last_config.digest == compile_config(previous).digest
+    assert last_config.digests() == compile_config(previous).digests()
+    assert sorted(v.vlan_id for v in last_config.vlans) == list(range(1, 9))
+
+
+def test_unchanged_config_takes_fast_path(apply, sqlite):
+    conf = make_conf(4, 2)
+    assert apply(conf, force=False)["status"] == "ok"
+    assert apply(conf, force=False)["status"] == "unchanged"
+
+
+def test_history_and_lookups(apply, sqlite):
+    previous = make_conf(4, 2)
+    assert apply(previous)["status"] == "ok"
+    assert apply(grown(previous, 5))["status"] == "ok"
+
+    store = SqliteStateStore(sqlite)
+    try:
+        history = store.history(10)
+        assert [run["run_id"] for run in history] == [2, 1]
+        assert all(run["success"] for run in history)
+        assert history[0]["operations"] < history[1]["operations"]
+        assert store.last_changed("br-vsi10005")["run_id"] == 2
+        assert store.last_changed("br-vsi10001")["run_id"] == 1
+        assert store.last_changed("nonexistent") is None
+        assert store.created_names(2) == {"br-vsi10005", "vxlan10005", "ol0.5"}
+    finally:
+        store.close()
@@ -0,0 +1,124 @@
+import errno
+from collections import Counter
+
+import pytest
+from pyroute2.netlink.exceptions import NetlinkError
+
+from common.metrics import METRICS
+from common.types import SVD_BRIDGE, SVD_MODE, SVD_VXLAN
+from conftest import OVERLAY, make_args, make_conf, topology
+
+ENGINES = ["batch", "async"]
+
+
+def make_svd_conf(vlans: int, vrfs: int) -> dict:
+    conf = make_conf(vlans, vrfs)
+    conf["Mode"] = SVD_MODE
+    for (i, vrf) in enumerate(conf["VRFMapL3VNI"], 1):
+        vrf["L3VNIVlanID"] = 4000 + i
+    return conf
+
+
+def ops(kernel) -> Counter:
+    return Counter(entry["op"] for entry in kernel.journal)
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_full_apply(apply, kernel, engine):
+    conf = make_svd_conf(6, 2)
+    kernel.journal = []
+
+    result = apply(conf, engine=engine)
+
+    assert result["status"] == "ok"
+    links = topology(kernel)
+    assert links[SVD_BRIDGE][0] == "bridge"
+    assert links[SVD_VXLAN] == ("vxlan", SVD_BRIDGE, None, (), True)
+    assert links[OVERLAY][1] == SVD_BRIDGE
+    assert links[f"{SVD_BRIDGE}.4001"][1] == "vrf1"
+    assert links[f"{SVD_BRIDGE}.2"][1:4] == ("vrf2", SVD_BRIDGE, (("10.0.2.1", 24),))
+    vxlan = kernel.links[kernel.names[SVD_VXLAN]]
+    assert vxlan.data["vxlan_vnifilter"] == 1
+    assert vxlan.data["vxlan_collect_metadata"] == 1
+    # ip link add和bridge -batch的命令作为请求出现在模拟内核中
+    counts = ops(kernel)
+    assert counts["vxlan.add"] == 1
+    assert counts["brport.set"] == 1
+    # 10001-10006连续，100001-100002连续
+    assert counts["vni.add"] == 2
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_incremental_apply_unmaps_removed_vlans(apply, kernel, engine):
+    conf = make_svd_conf(6, 2)
+    assert apply(conf, engine=engine)["status"] == "ok"
+    conf["VlanMapVNI"] = conf["VlanMapVNI"][:4]
+    kernel.journal = []
+
+    result = apply(conf, engine=engine)
+
+    assert result["status"] == "ok"
+    assert f"{SVD_BRIDGE}.5" not in kernel.names
+    assert f"{SVD_BRIDGE}.6" not in kernel.names
+    vni = [e for e in kernel.journal if e["op"] == "vni.del"]
+    assert [e["args"] for e in vni] == [{"vni": 10005, "vni_end": 10006}]
+    assert "vxlan.add" not in ops(kernel)
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_failed_apply_rolls_back(apply, kernel, reject, engine):
+    initial = topology(kernel)
+    reject(f"{SVD_BRIDGE}.3", errno.EEXIST)
+    kernel.journal = []
+
+    result = apply(make_svd_conf(6, 2), engine=engine)
+
+    assert result["status"] == "failed"
+    # 由ip命令创建的VXLAN设备同样被回滚删除
+    created = [e for e in kernel.journal if e["op"] == "vxlan.add"]
+    assert [(e["entity"], e.get("error")) for e in created] == [(SVD_VXLAN, None)]
+    assert topology(kernel) == initial
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_failed_bridge_batch_rolls_back(apply, kernel, monkeypatch, engine):
+    initial = topology(kernel)
+    request = kernel.request
+
+    def failing(method, *args, **kwarg):
+        if method == "vni_filter" and args[0] == "add":
+            raise NetlinkError(errno.ENOSPC, "No space left on device")
+        return request(method, *args, **kwarg)
+
+    monkeypatch.setattr(kernel, "request", failing)
+    kernel.journal = []
+
+    result = apply(make_svd_conf(6, 2), engine=engine)
+
+    assert result["status"] == "failed"
+    assert ops(kernel)["vxlan.add"] == 1
+    assert topology(kernel) == initial
+
+
+def test_commands_are_metered(apply, kernel, monkeypatch):
+    monkeypatch.setattr(METRICS, "enabled", True)
+    before = dict(METRICS.counts)
+
+    assert apply(make_svd_conf(6, 2))["status"] == "ok"
+
+    for op in ("ip.link.add", "bridge.batch"):
+        assert METRICS.counts[op] - before.get(op, 0) == 1
+
+
+def test_plan_simulates_commands(kernel, state):
+    from common.dry_run import plan_config
+
+    initial = topology(kernel)
+
+    result = plan_config(make_svd_conf(6, 2), None, make_args(plan=True))
+
+    assert result["success"]
+    assert result["counts"]["vxlan.add"] == 1
+    assert result["counts"]["vni.add"] == 2
+    assert result["counts"]["brport.set"] == 1
+    assert topology(kernel) == initial
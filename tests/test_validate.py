@@ -0,0 +1,51 @@
+import pytest
+
+from common.types import config_errors
+from conftest import make_conf
+
+
+def test_valid_config_has_no_errors():
+    assert config_errors(make_conf(8, 3)) == []
+
+
+def test_all_errors_are_reported():
+    conf = make_conf(4, 2)
+    conf["VRFMapL3VNI"][1]["VRFName"] = "vrf1"
+    conf["VlanMapVNI"][1]["VlanID"] = 1
+    conf["VlanMapVNI"][2]["L3VxLANVNI"] = 424242
+    del conf["VlanMapVNI"][3]["L2VxLANVNI"]
+
+    assert config_errors(conf) == [
+        "Error: Duplicate VRFName vrf1",
+        "Error: Duplicate VlanID 1",
+        "Error: No VRF configuration found for L3VxLANVNI 424242 of VLAN 3",
+        "Error: Missing required fields L2VxLANVNI in VlanMapVNI configuration",
+    ]
+
+
+@pytest.mark.parametrize("key", ["VRFMapL3VNI", "VlanMapVNI"])
+@pytest.mark.parametrize("entry", [5, "vrf1", None, ["VlanID"]])
+def test_non_object_entry_is_reported(key, entry):
+    conf = make_conf(2, 1)
+    conf[key].insert(0, entry)
+
+    errors = config_errors(conf)
+
+    # 其余条目照常检查
+    assert errors == [f"Error: {key} entry {entry!r} must be an object"]
+
+
+def test_non_object_config_is_reported():
+    assert config_errors([make_conf(2, 1)]) == [
+        "Error: Configuration must be a JSON object"
+    ]
+
+
+@pytest.mark.parametrize("conf", [[], {"VlanMapVNI": [5]}, "conf"])
+def test_apply_reports_malformed_config_as_invalid(apply, kernel, conf):
+    kernel.requests = 0
+
+    result = apply(conf, force=False)
+
+    assert result["status"] == "invalid"
+    assert kernel.requests == 0